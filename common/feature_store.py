@@ -0,0 +1,359 @@
+# common/feature_store.py
+# Date-partitioned Parquet tables for the session feature sets (features, features_agg,
+# features_clusters, sessions_agg), read back through Arrow with column projection,
+# predicate pushdown and memory-mapped files.
+#
+#   python -m common.feature_store import notebooks/features_agg.csv [--table features_agg]
+#   python -m common.feature_store show features_agg [--columns session_id,reward] [--where "reward > 0"]
+#
+# Layout: <STORE_ROOT>/<table>/date=YYYY-MM-DD/part-0.parquet (date of the session start,
+# "unknown" when it has none). Sparse blocks (e.g. the hashed command sequence, "seq") are
+# stored per row as two list columns, <block>_idx (int32) and <block>_val (float32), with
+# the block width in the schema metadata; read_sparse turns them back into a CSR matrix.
+import os
+import sys
+import json
+import shutil
+import argparse
+
+_REPO = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+STORE_ROOT = os.getenv("FEATURE_STORE", os.path.join(_REPO, "notebooks", "store"))
+LEGACY_CSV_DIR = os.path.join(_REPO, "notebooks")   # <name>.csv files from before the store
+SCHEMA_PATH = os.getenv("FEATURE_SCHEMA", os.path.join(_REPO, "controller", "feature_schema.json"))
+PARTITION = "date"
+UNKNOWN_DATE = "unknown"
+KEY = ("session_id", "start")   # upsert key; see write_table
+
+_model_features = None
+
+
+def model_features():
+    """Context columns the controller's model is trained on, in schema order."""
+    global _model_features
+    if _model_features is None:
+        with open(SCHEMA_PATH, "r") as f:
+            _model_features = json.load(f)["features_order"]
+    return list(_model_features)
+
+
+def _column_types():
+    import pyarrow as pa
+    types = {
+        "session_id": pa.string(), "src_ip": pa.string(), "applied_action": pa.string(),
+        "iocs": pa.string(), "sequence_text": pa.string(),
+        "start": pa.timestamp("us", tz="UTC"), "end": pa.timestamp("us", tz="UTC"),
+        "cmd_count": pa.int64(), "unique_cmds": pa.int64(), "downloads": pa.int64(),
+        "ioc_count": pa.int64(), "start_hour": pa.int64(),
+        "kmeans_label": pa.int64(), "dbscan_label": pa.int64(),
+    }
+    # model inputs are always float64, whatever pandas inferred from the source
+    for c in model_features():
+        types[c] = pa.float64()
+    return types
+
+
+def table_path(name, root=None):
+    if os.path.isabs(name) or os.sep in name:
+        return os.path.abspath(name)
+    return os.path.join(root or STORE_ROOT, name)
+
+
+def to_arrow(df):
+    """Typed Arrow table for a feature DataFrame. Timestamps become UTC timestamps,
+    model features (feature_schema.json) float64, other counters int64 and seq_* hash
+    buckets float32; the feature order is kept in the schema metadata."""
+    import pyarrow as pa
+    from common.timestamps import parse_series
+    import pandas as pd
+    df = df.copy()
+    for c in df.columns:
+        # Arrow has no sparse column type; wide sparse features go in `sparse=` blocks instead
+        if isinstance(df[c].dtype, pd.SparseDtype):
+            df[c] = df[c].sparse.to_dense()
+    for c in ("start", "end"):
+        if c in df.columns and not str(df[c].dtype).startswith("datetime64"):
+            df[c] = parse_series(df[c].astype(object).where(df[c].notna(), None))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    types = _column_types()
+    fields = []
+    for f in table.schema:
+        t = types.get(f.name)
+        if t is None and f.name.startswith("seq_"):
+            t = pa.float32()
+        if t is None and pa.types.is_null(f.type):
+            t = pa.string()   # an all-empty column
+        fields.append(pa.field(f.name, t or f.type))
+    meta = {b"feature_schema": json.dumps({"features_order": model_features()}).encode()}
+    return table.cast(pa.schema(fields, metadata=meta))
+
+
+def _partition_dates(table):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    if "start" not in table.column_names:
+        return pa.array([UNKNOWN_DATE] * table.num_rows, pa.string())
+    return pc.fill_null(pc.strftime(table["start"], format="%Y-%m-%d"), UNKNOWN_DATE)
+
+
+def _row_keys(table):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    parts = [pc.fill_null(pc.cast(table[c], pa.string()), "") for c in KEY if c in table.column_names]
+    return pc.binary_join_element_wise(*parts, "|")
+
+
+def sparse_columns(block):
+    return f"{block}_idx", f"{block}_val"
+
+
+def _sparse_to_arrow(X):
+    """(indices, values) list arrays, one list per CSR row."""
+    import numpy as np
+    import pyarrow as pa
+    X = X.tocsr()
+    X.sort_indices()
+    offsets = pa.array(X.indptr.astype(np.int32))
+    return (pa.ListArray.from_arrays(offsets, pa.array(X.indices.astype(np.int32))),
+            pa.ListArray.from_arrays(offsets, pa.array(X.data.astype(np.float32))))
+
+
+def _sparse_from_arrow(idx, val, dim):
+    import numpy as np
+    import pyarrow.compute as pc
+    import scipy.sparse as sp
+    idx = idx.combine_chunks() if hasattr(idx, "combine_chunks") else idx
+    val = val.combine_chunks() if hasattr(val, "combine_chunks") else val
+    # rows written before the block existed are null lists -> empty rows
+    lengths = pc.fill_null(pc.list_value_length(idx), 0).to_numpy(zero_copy_only=False)
+    indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    indices = pc.list_flatten(idx).to_numpy(zero_copy_only=False)
+    data = pc.list_flatten(val).to_numpy(zero_copy_only=False)
+    return sp.csr_matrix((data, indices, indptr), shape=(len(lengths), dim))
+
+
+def _sparse_dims(schema):
+    meta = schema.metadata or {}
+    return json.loads(meta.get(b"sparse_dims", b"{}"))
+
+
+def _write_file(table, path):
+    import pyarrow.parquet as pq
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    pq.write_table(table, tmp, compression="zstd")
+    os.replace(tmp, path)
+
+
+def write_table(df, name, mode="upsert", root=None, sparse=None):
+    """Writes a feature DataFrame into the store, partitioned by session start date.
+    `sparse` maps block names to scipy matrices with one row per row of `df`.
+
+    mode="upsert" rewrites only the partitions `df` touches, replacing rows with the
+    same (session_id, start) key, so re-writing a batch is idempotent. A session id
+    that comes back as a later fragment (different start) is kept as a separate row.
+    mode="overwrite" replaces the whole table.
+    Returns the partition files written.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    path = table_path(name, root)
+    if df is None or len(df) == 0:
+        return []
+    table = to_arrow(df)
+    meta = dict(table.schema.metadata or {})
+    if sparse:
+        for block, X in sparse.items():
+            if X.shape[0] != table.num_rows:
+                raise ValueError(f"sparse block {block!r} has {X.shape[0]} rows, table has {table.num_rows}")
+            idx, val = _sparse_to_arrow(X)
+            for col, arr in zip(sparse_columns(block), (idx, val)):
+                table = table.append_column(col, arr)
+        meta[b"sparse_dims"] = json.dumps({b: int(X.shape[1]) for b, X in sparse.items()}).encode()
+        table = table.replace_schema_metadata(meta)
+    dates = _partition_dates(table)
+    target = path + ".tmp" if mode == "overwrite" else path
+    if mode == "overwrite":
+        shutil.rmtree(target, ignore_errors=True)
+    written = []
+    for d in sorted(pc.unique(dates).to_pylist()):
+        part = table.filter(pc.equal(dates, d))
+        fpath = os.path.join(target, f"{PARTITION}={d}", "part-0.parquet")
+        if mode == "upsert" and os.path.exists(fpath):
+            old = pq.read_table(fpath, memory_map=True)
+            old = old.filter(pc.invert(pc.is_in(_row_keys(old), value_set=_row_keys(part))))
+            part_meta = dict(meta)
+            dims = {**_sparse_dims(old.schema), **_sparse_dims(table.schema)}
+            if dims:
+                part_meta[b"sparse_dims"] = json.dumps(dims).encode()
+            part = pa.concat_tables([old, part], promote_options="permissive").replace_schema_metadata(part_meta)
+        if "start" in part.column_names:
+            part = part.sort_by([("start", "ascending"), ("session_id", "ascending")])
+        _write_file(part, fpath)
+        written.append(os.path.join(path, f"{PARTITION}={d}", "part-0.parquet"))
+    if mode == "overwrite":
+        old_dir = path + ".old"
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.isdir(path):
+            os.replace(path, old_dir)
+        os.replace(target, path)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    return written
+
+
+def _dataset(path):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+    import pyarrow.parquet as pq
+    files = sorted(
+        os.path.join(d, f) for d, _, fs in os.walk(path) for f in fs if f.endswith(".parquet")
+    )
+    if not files:
+        return None
+    # partitions written at different times may differ in columns; read footers only
+    schemas = [pq.read_schema(f) for f in files]
+    dims = {}
+    for sch in schemas:
+        dims.update(_sparse_dims(sch))
+    schema = pa.unify_schemas(schemas, promote_options="permissive")
+    schema = schema.with_metadata({**(schema.metadata or {}), b"sparse_dims": json.dumps(dims).encode()})
+    part = ds.partitioning(pa.schema([(PARTITION, pa.string())]), flavor="hive")
+    return ds.dataset(files, schema=schema.append(pa.field(PARTITION, pa.string())), format="parquet",
+                      partitioning=part, partition_base_dir=path,
+                      filesystem=pafs.LocalFileSystem(use_mmap=True))
+
+
+def _expression(filters):
+    import pyarrow.parquet as pq
+    if filters is None or not isinstance(filters, (list, tuple)):
+        return filters
+    return pq.filters_to_expression(filters)
+
+
+def _scan(name, columns, filters, dates, root, extra=()):
+    """(arrow table, dataset) for a projected, filtered read; (None, None) if the table is empty."""
+    import pyarrow.dataset as ds
+    dataset = _dataset(table_path(name, root))
+    if dataset is None:
+        return None, None
+    expr = _expression(filters)
+    if dates:
+        by_date = ds.field(PARTITION).isin(list(dates))
+        expr = by_date if expr is None else expr & by_date
+    names = set(dataset.schema.names)
+    if columns is None:
+        # sparse blocks are only returned by read_sparse
+        hidden = {c for b in _sparse_dims(dataset.schema) for c in sparse_columns(b)}
+        cols = [c for c in dataset.schema.names if c != PARTITION and c not in hidden]
+    else:
+        cols = [c for c in columns if c in names]
+    cols += [c for c in extra if c in names]
+    return dataset.to_table(columns=cols, filter=expr), dataset
+
+
+def _to_frame(table, columns):
+    import pandas as pd
+    df = table.to_pandas() if table is not None else pd.DataFrame()
+    for c in columns or []:
+        if c not in df.columns:
+            df[c] = None
+    return df[columns] if columns else df
+
+
+def read_table(name, columns=None, filters=None, dates=None, root=None):
+    """DataFrame of a stored table.
+
+    columns: only these columns are read from disk (missing ones come back as nulls).
+    filters: a pyarrow.dataset expression or DNF tuples like [("reward", ">", 0)];
+             evaluated against Parquet row-group statistics before any data is decoded.
+    dates:   restrict to these YYYY-MM-DD partitions without opening the others.
+    """
+    table, _ = _scan(name, columns, filters, dates, root)
+    return _to_frame(table, columns)
+
+
+def read_sparse(name, block="seq", columns=None, filters=None, dates=None, root=None):
+    """(DataFrame, CSR matrix) for a table with a sparse block; rows line up. The matrix
+    is built straight from the Arrow list buffers, never densified. X is None when the
+    table has no such block."""
+    idx_col, val_col = sparse_columns(block)
+    table, dataset = _scan(name, columns, filters, dates, root, extra=(idx_col, val_col))
+    if table is None:
+        return _to_frame(None, columns), None
+    dim = _sparse_dims(dataset.schema).get(block)
+    X = None
+    if dim is not None and idx_col in table.column_names:
+        X = _sparse_from_arrow(table[idx_col], table[val_col], dim)
+        table = table.drop_columns([idx_col, val_col])
+    return _to_frame(table, columns), X
+
+
+def read_any(source, columns=None, filters=None):
+    """Loads a feature set from a store table name/directory, a single Parquet file or
+    a legacy CSV, reading only `columns` where the format allows it."""
+    import pandas as pd
+    if source.endswith(".csv"):
+        if not os.path.exists(source):
+            return pd.DataFrame(columns=columns or [])
+        usecols = (lambda c: c in columns) if columns else None
+        df = pd.read_csv(source, usecols=usecols)
+        for c in columns or []:
+            if c not in df.columns:
+                df[c] = None
+        return df[columns] if columns else df
+    if source.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        return pq.read_table(source, columns=columns, filters=filters, memory_map=True).to_pandas()
+    legacy = os.path.join(LEGACY_CSV_DIR, source + ".csv")
+    if not exists(source) and os.path.exists(legacy):
+        # not imported yet (python -m common.feature_store import ...); filters need the store
+        return read_any(legacy, columns=columns)
+    return read_table(source, columns=columns, filters=filters)
+
+
+def exists(name, root=None):
+    path = table_path(name, root)
+    return os.path.isdir(path) and any(f.endswith(".parquet") for _, _, fs in os.walk(path) for f in fs)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Parquet feature store")
+    sub = ap.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="convert a CSV into a store table")
+    imp.add_argument("csv")
+    imp.add_argument("--table", help="default: the CSV file name without extension")
+    imp.add_argument("--root", default=STORE_ROOT)
+    show = sub.add_parser("show", help="print rows of a store table")
+    show.add_argument("table")
+    show.add_argument("--columns", help="comma-separated projection")
+    show.add_argument("--where", help='e.g. "reward > 0" (column op value)')
+    show.add_argument("--root", default=STORE_ROOT)
+    show.add_argument("--limit", type=int, default=20)
+    args = ap.parse_args(argv)
+
+    if args.command == "import":
+        import pandas as pd
+        name = args.table or os.path.splitext(os.path.basename(args.csv))[0]
+        files = write_table(pd.read_csv(args.csv), name, mode="overwrite", root=args.root)
+        print(f"Wrote {name} ({len(files)} partitions) under {args.root}")
+        return 0
+    filters = None
+    if args.where:
+        col, op, val = args.where.split(None, 2)
+        try:
+            val = float(val)
+        except ValueError:
+            val = val.strip("'\"")
+        filters = [(col, op, val)]
+    cols = args.columns.split(",") if args.columns else None
+    df = read_table(args.table, columns=cols, filters=filters, root=args.root)
+    print(df.head(args.limit).to_string())
+    print(f"({len(df)} rows)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, _REPO)
+    sys.exit(main())
@@ -0,0 +1,311 @@
+# common/geo.py
+# Local-only GeoIP lookups shared by the forwarder (at ingest) and the dashboards.
+# The GeoLite2 City database is memory-mapped once per process; answers are kept in a
+# bounded in-memory LRU and a persistent SQLite cache, so a repeated attacker network
+# costs a dict hit and a restart doesn't start cold. An answer is cached for the whole
+# /24 (/48) only when the database network it came from covers that block; networks
+# smaller than that are cached per address, since neighbours may be elsewhere.
+# Nothing here calls out to the network.
+#
+#   python -m common.geo lookup 1.2.3.4 5.6.7.8
+#   python -m common.geo backfill [--uri mongodb://...]   # sessions_agg docs without geo
+import os
+import json
+import hashlib
+import time
+import sqlite3
+import argparse
+import ipaddress
+import threading
+from collections import OrderedDict
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# first existing path wins; GEOIP_DB overrides
+GEOIP_DB_PATHS = [p for p in (
+    os.getenv("GEOIP_DB"),
+    os.path.join(ROOT, "data", "GeoLite2-City.mmdb"),
+    "data/GeoLite2-City.mmdb",
+    "./GeoLite2-City.mmdb",
+    "/usr/local/share/GeoIP/GeoLite2-City.mmdb",
+) if p]
+GEO_CACHE = os.getenv("GEO_CACHE", os.path.join(ROOT, "state", "geo_cache.db"))   # "" disables the disk cache
+GEO_LRU_SIZE = int(os.getenv("GEO_LRU_SIZE", "100000"))   # prefixes kept in memory
+# one cache entry serves the whole block when the database network is at least this wide
+PREFIX_V4 = 24
+PREFIX_V6 = 48
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS geo (
+    prefix TEXT PRIMARY KEY,   -- a block (1.2.3.0/24) or a single address
+    build  INTEGER NOT NULL,   -- MMDB build epoch the answer came from
+    geo    TEXT,               -- JSON, NULL if the database has no location
+    ts     REAL NOT NULL
+);
+"""
+# v1 caches reused every answer across its /24 regardless of the database network
+CACHE_VERSION = 2
+
+_MISS = object()
+
+
+def _address(ip):
+    # the parsed address, or None for addresses that have no public location
+    # (private, loopback, malformed...)
+    try:
+        addr = ipaddress.ip_address(str(ip).strip())
+    except ValueError:
+        return None
+    return addr if addr.is_global else None
+
+
+def _block_bits(addr):
+    return PREFIX_V4 if addr.version == 4 else PREFIX_V6
+
+
+def prefix_of(ip):
+    """The /24 (IPv4) or /48 (IPv6) block of an address; None for addresses that have
+    no public location."""
+    addr = _address(ip)
+    if addr is None:
+        return None
+    return str(ipaddress.ip_network(f"{addr}/{_block_bits(addr)}", strict=False))
+
+
+def open_reader(paths=GEOIP_DB_PATHS):
+    """geoip2 Reader over the first database found, memory-mapped; None if geoip2 or
+    the database is missing."""
+    try:
+        import geoip2.database
+        from maxminddb import MODE_MMAP
+    except ImportError:
+        return None
+    for p in paths:
+        if os.path.exists(p):
+            return geoip2.database.Reader(p, mode=MODE_MMAP)
+    return None
+
+
+def _record(r):
+    if r.location.latitude is None or r.location.longitude is None:
+        return None
+    return {
+        "country": r.country.name,
+        "country_code": r.country.iso_code,
+        "city": r.city.name,
+        "lat": r.location.latitude,
+        "lon": r.location.longitude,
+    }
+
+
+class GeoLocator:
+    """lookup(ip) -> {"country", "country_code", "city", "lat", "lon"} or None.
+    Thread-safe; lookup_many() resolves a batch with one disk-cache query."""
+
+    def __init__(self, reader=_MISS, cache_path=GEO_CACHE, lru_size=GEO_LRU_SIZE):
+        self.reader = open_reader() if reader is _MISS else reader
+        self.build = int(self.reader.metadata().build_epoch) if self.reader is not None else 0
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if cache_path:
+            d = os.path.dirname(cache_path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            self._db = sqlite3.connect(cache_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(SCHEMA)
+            if self._db.execute("PRAGMA user_version").fetchone()[0] < CACHE_VERSION:
+                with self._db:
+                    self._db.execute("DELETE FROM geo")
+                self._db.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def available(self):
+        return self.reader is not None
+
+    def _remember(self, prefix, geo):
+        self._lru[prefix] = geo
+        self._lru.move_to_end(prefix)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def _from_disk(self, prefixes):
+        found = {}
+        if self._db is None or not prefixes:
+            return found
+        prefixes = list(prefixes)
+        for i in range(0, len(prefixes), 500):
+            chunk = prefixes[i:i + 500]
+            q = f"SELECT prefix, geo FROM geo WHERE build = ? AND prefix IN ({','.join('?' * len(chunk))})"
+            for prefix, geo in self._db.execute(q, [self.build, *chunk]):
+                found[prefix] = json.loads(geo) if geo else None
+        return found
+
+    def _from_mmdb(self, addr):
+        """(geo or None, network the database answered for, or None)."""
+        try:
+            r = self.reader.city(str(addr))
+            return _record(r), r.traits.network
+        except Exception as e:   # AddressNotFoundError (carries its network), or a corrupt record
+            return None, getattr(e, "network", None)
+
+    def _cached(self, keys):
+        for key in keys:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                return True, self._lru[key]
+        return False, None
+
+    def lookup(self, ip):
+        return self.lookup_many([ip]).get(ip)
+
+    def lookup_many(self, ips):
+        """{ip: geo or None} for every distinct ip in `ips`."""
+        out = {}
+        todo = {}   # ip -> (block key, address key)
+        with self._lock:
+            for ip in ips:
+                if ip in out or ip in todo or not ip:
+                    continue
+                addr = _address(ip)
+                if addr is None:
+                    out[ip] = None
+                    continue
+                keys = (str(ipaddress.ip_network(f"{addr}/{_block_bits(addr)}", strict=False)), str(addr))
+                found, geo = self._cached(keys)
+                if found:
+                    out[ip] = geo
+                    self.hits += 1
+                else:
+                    todo[ip] = keys
+            if not todo:
+                return out
+            disk = self._from_disk({k for keys in todo.values() for k in keys})
+            fresh = []
+            for ip, (block, host) in todo.items():
+                # an earlier address of this batch may have just cached its block
+                found, geo = self._cached((block, host))
+                if found:
+                    out[ip] = geo
+                    self.hits += 1
+                    continue
+                if block in disk or host in disk:
+                    key = block if block in disk else host
+                    geo = disk[key]
+                    self.disk_hits += 1
+                elif self.reader is not None:
+                    geo, network = self._from_mmdb(host)
+                    # reuse for the block only if the database says the whole block is alike
+                    addr = ipaddress.ip_address(host)
+                    wide = network is not None and network.prefixlen <= _block_bits(addr)
+                    key = block if wide else host
+                    fresh.append((key, self.build, json.dumps(geo) if geo else None, time.time()))
+                    self.misses += 1
+                else:
+                    # no database: answer None but don't cache, so installing one takes effect
+                    out[ip] = None
+                    continue
+                self._remember(key, geo)
+                out[ip] = geo
+            if fresh and self._db is not None:
+                with self._db:
+                    self._db.executemany("INSERT OR REPLACE INTO geo VALUES (?, ?, ?, ?)", fresh)
+        return out
+
+    def stats(self):
+        with self._lock:
+            return {"database": self.available, "build": self.build, "lru": len(self._lru),
+                    "hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            if self.reader is not None:
+                self.reader.close()
+                self.reader = None
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_locator():
+    """Process-wide GeoLocator (one mmap, one cache connection)."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = GeoLocator()
+            if not _default.available:
+                print("[geo] no GeoLite2 database found; locations will be empty. Looked in:", GEOIP_DB_PATHS)
+        return _default
+
+
+def lookup(ip):
+    return get_locator().lookup(ip)
+
+
+def lookup_many(ips):
+    return get_locator().lookup_many(ips)
+
+
+def placeholder(ip):
+    """Stable stand-in (lat, lon) for display when an address has no location, so demo
+    data without a database still shows up on the map, always in the same spot."""
+    h = hashlib.blake2b(str(ip).encode(), digest_size=8).digest()
+    return -30 + 90 * h[0] / 255.0, -130 + 280 * h[1] / 255.0
+
+
+def backfill(coll, batch_size=1000):
+    """Stores geo on session docs that were written without it. Returns docs updated."""
+    from pymongo import UpdateOne
+
+    updated = 0
+    cur = coll.find({"$or": [{"geo": {"$exists": False}}, {"geo": None}], "src_ip": {"$ne": None}},
+                    {"_id": 1, "src_ip": 1}).batch_size(batch_size)
+    batch = []
+    for d in cur:
+        batch.append(d)
+        if len(batch) >= batch_size:
+            updated += _backfill_batch(coll, batch, UpdateOne)
+            batch = []
+    if batch:
+        updated += _backfill_batch(coll, batch, UpdateOne)
+    return updated
+
+
+def _backfill_batch(coll, docs, UpdateOne):
+    found = lookup_many([d["src_ip"] for d in docs])
+    ops = [UpdateOne({"_id": d["_id"]}, {"$set": {"geo": found[d["src_ip"]]}})
+           for d in docs if found.get(d["src_ip"])]
+    if ops:
+        coll.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Local GeoIP lookups")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("lookup")
+    p.add_argument("ips", nargs="+")
+    p = sub.add_parser("backfill", help="add geo to sessions_agg docs stored without it")
+    p.add_argument("--uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    args = ap.parse_args(argv)
+
+    if args.cmd == "lookup":
+        for ip, geo in lookup_many(args.ips).items():
+            print(ip, json.dumps(geo))
+    else:
+        from pymongo import MongoClient
+        n = backfill(MongoClient(args.uri)["honeypot"]["sessions_agg"])
+        print(f"Stored geo on {n} sessions")
+    print(get_locator().stats())
+
+if __name__ == "__main__":
+    main()
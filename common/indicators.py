@@ -0,0 +1,85 @@
+# common/indicators.py
+# Field-targeted indicator (IOC) matching shared by the forwarder and the offline extractor.
+import os
+import re
+import json
+
+# fields of a Cowrie event that can carry commands, URLs or event names
+DEFAULT_FIELDS = ("input", "command", "cmd", "url", "eventid", "event", "message")
+
+# name -> (regex, counts as a download attempt). Matched case-insensitively.
+# Patterns must not define their own named groups.
+DEFAULT_INDICATORS = {
+    "wget": (r"wget", True),
+    "curl": (r"curl", True),
+    "tftp": (r"\btftp\b", True),
+    "ftpget": (r"\bftpget\b", True),
+    "download": (r"download", True),
+    "upload": (r"upload", True),
+    "shell_script": (r"\.sh\b", True),
+    "url": (r"\b(?:https?|ftp)://", False),
+    "chmod_exec": (r"\bchmod\s+(?:[0-7]*7[0-7]*|\+x|[ugoa]*\+x)", False),
+    "base64": (r"\bbase64\b", False),
+    "miner": (r"xmrig|minerd|stratum\+tcp", False),
+}
+
+IOC_PATH = os.getenv("IOC_PATH")   # optional JSON file overriding DEFAULT_INDICATORS
+
+
+def load_indicators(path):
+    """Reads {name: regex} or {name: {"pattern": regex, "download": bool}} from JSON."""
+    with open(path, "r") as f:
+        raw = json.load(f)
+    out = {}
+    for name, spec in raw.items():
+        if isinstance(spec, str):
+            out[name] = (spec, False)
+        else:
+            out[name] = (spec["pattern"], bool(spec.get("download", False)))
+    return out
+
+
+class IndicatorMatcher:
+    """All indicators compiled into one alternation, run only over `fields`.
+
+    `match(event)` returns the set of indicator names found in the event. The
+    combined regex is wrapped in a lookahead so every start position is tried,
+    which lets e.g. "url" and "wget" both fire on "wget http://...".
+    """
+
+    def __init__(self, indicators=None, fields=DEFAULT_FIELDS):
+        self.indicators = dict(indicators or DEFAULT_INDICATORS)
+        self.fields = tuple(fields)
+        self.download_names = frozenset(n for n, (_, dl) in self.indicators.items() if dl)
+        self._names = list(self.indicators)
+        alts = "|".join(f"(?P<i{i}>{pat})" for i, (pat, _) in enumerate(self.indicators.values()))
+        self._rx = re.compile(f"(?=(?:{alts}))", re.IGNORECASE)
+
+    def match_text(self, text, hits=None):
+        hits = set() if hits is None else hits
+        for m in self._rx.finditer(text):
+            hits.add(self._names[int(m.lastgroup[1:])])
+        return hits
+
+    def match(self, event):
+        hits = set()
+        for f in self.fields:
+            v = event.get(f)
+            if not v:
+                continue
+            self.match_text(v if isinstance(v, str) else str(v), hits)
+        return hits
+
+    def is_download(self, hits):
+        return not self.download_names.isdisjoint(hits)
+
+
+_default = None
+
+
+def get_matcher():
+    """Process-wide matcher built from IOC_PATH if set, else the defaults."""
+    global _default
+    if _default is None:
+        _default = IndicatorMatcher(load_indicators(IOC_PATH) if IOC_PATH else None)
+    return _default
@@ -0,0 +1,175 @@
+# common/live_feed.py
+# Live view of finished sessions for the dashboards: a background thread follows
+# sessions_agg and keeps a rolling window of recent sessions with running totals and map
+# cells, updated per new doc. Readers ask for what changed since their last sequence
+# number, so a refresh costs work proportional to the new sessions, not the history.
+#
+# A change stream is used when Mongo supports one (replica set / Atlas); on a standalone
+# server (the docker-compose setup) the feed tails the collection by _id instead.
+import os
+import time
+import threading
+from collections import deque, Counter
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+
+from common.map_cells import ZOOMS, cell_of
+
+LIVE_WINDOW = timedelta(hours=float(os.getenv("LIVE_WINDOW_HOURS", "1")))   # sessions kept in the rolling window
+LIVE_MAX_ITEMS = int(os.getenv("LIVE_MAX_ITEMS", "50000"))   # and at most this many
+POLL_INTERVAL = 0.5   # seconds between _id tail queries when there is no change stream
+EXPIRE_INTERVAL = 1.0   # seconds between window trims, however busy the stream is
+# forwarder _ids are assigned when a doc is queued, so one can land slightly after a
+# newer one; the tail re-reads this far back and skips what it has already seen
+TAIL_OVERLAP = timedelta(seconds=10)
+FIELDS = ("_id", "session_id", "src_ip", "start", "reward", "applied_action", "geo", "ts")
+
+
+class LiveFeed:
+    def __init__(self, coll, window=LIVE_WINDOW, max_items=LIVE_MAX_ITEMS, zooms=ZOOMS):
+        self.coll = coll
+        self.window = window
+        self.max_items = max_items
+        self.zooms = zooms
+        self.mode = None   # "change stream" or "tail"
+        self.seq = 0
+        self._items = deque()   # (seq, doc), oldest first
+        self._lock = threading.Lock()
+        self.total = 0
+        self.reward_sum = 0.0
+        self.actions = Counter()
+        self.cells = {z: {} for z in zooms}   # zoom -> (lat, lon) -> [count, reward sum]
+        self._last_id = None
+        self._resume = None   # change stream resume token
+        self._bootstrapped = False
+        self._recent_ids = {}   # _id -> generation time: bootstrap dedupe and the tail overlap
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="live-feed", daemon=True)
+        self._thread.start()
+
+    # ----- window bookkeeping -----
+    def _apply(self, doc, sign):
+        reward = float(doc.get("reward") or 0.0)
+        self.total += sign
+        self.reward_sum += sign * reward
+        self.actions[doc.get("applied_action") or "none"] += sign
+        geo = doc.get("geo")
+        if geo and geo.get("lat") is not None and geo.get("lon") is not None:
+            for zoom, size in self.zooms.items():
+                key = cell_of(geo["lat"], geo["lon"], size)
+                acc = self.cells[zoom].setdefault(key, [0, 0.0])
+                acc[0] += sign
+                acc[1] += sign * reward
+                if acc[0] <= 0:
+                    del self.cells[zoom][key]
+
+    def _ingest(self, doc):
+        doc = {k: doc.get(k) for k in FIELDS}
+        if (doc.get("ts") or 0) < time.time() - self.window.total_seconds():
+            return   # backfills / replays of old sessions are not live
+        with self._lock:
+            self.seq += 1
+            self._items.append((self.seq, doc))
+            self._apply(doc, +1)
+            _id = doc.get("_id")
+            if isinstance(_id, ObjectId) and (self._last_id is None or _id > self._last_id):
+                self._last_id = _id
+
+    def _expire(self):
+        cutoff = time.time() - self.window.total_seconds()
+        with self._lock:
+            while self._items and (len(self._items) > self.max_items or (self._items[0][1].get("ts") or 0) < cutoff):
+                _, doc = self._items.popleft()
+                self._apply(doc, -1)
+            if self.actions:
+                self.actions = +self.actions   # drop zero counts
+
+    # ----- followers -----
+    def _bootstrap(self):
+        since = time.time() - self.window.total_seconds()
+        docs = list(self.coll.find({"ts": {"$gte": since}}, {k: 1 for k in FIELDS})
+                    .sort("ts", -1).limit(self.max_items))
+        for d in reversed(docs):
+            self._ingest(d)
+            self._recent_ids[d["_id"]] = d["_id"].generation_time
+        self._bootstrapped = True
+
+    def _follow_change_stream(self):
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        with self.coll.watch(pipeline, resume_after=self._resume, max_await_time_ms=500) as stream:
+            self.mode = "change stream"
+            # read the window only once the stream is open, so no insert falls between the
+            # two; one landing in both is skipped by _id
+            if not self._bootstrapped:
+                self._bootstrap()
+            last_expire = time.monotonic()
+            while not self._stop.is_set():
+                change = stream.try_next()
+                if change is not None:
+                    doc = change["fullDocument"]
+                    if doc.get("_id") not in self._recent_ids:
+                        self._ingest(doc)
+                # also advances on empty batches, so a reopened stream resumes without a gap
+                self._resume = stream.resume_token
+                if time.monotonic() - last_expire >= EXPIRE_INTERVAL:
+                    self._expire()
+                    horizon = datetime.now(timezone.utc) - self.window - TAIL_OVERLAP
+                    self._recent_ids = {k: t for k, t in self._recent_ids.items() if t >= horizon}
+                    last_expire = time.monotonic()
+
+    def _follow_tail(self):
+        self.mode = "tail"
+        while not self._stop.is_set():
+            start = self._last_id.generation_time - TAIL_OVERLAP if self._last_id else \
+                datetime.now(timezone.utc) - TAIL_OVERLAP
+            cur = self.coll.find({"_id": {"$gt": ObjectId.from_datetime(start)}}, {k: 1 for k in FIELDS}).sort("_id", 1)
+            for d in cur:
+                if d["_id"] in self._recent_ids:
+                    continue
+                self._recent_ids[d["_id"]] = d["_id"].generation_time
+                self._ingest(d)
+            horizon = start - TAIL_OVERLAP
+            self._recent_ids = {k: t for k, t in self._recent_ids.items() if t >= horizon}
+            self._expire()
+            self._stop.wait(POLL_INTERVAL)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                try:
+                    self._follow_change_stream()
+                except OperationFailure as e:
+                    # standalone servers have no oplog to stream from
+                    print("[live] no change stream, tailing by _id:", e.details.get("errmsg", e) if e.details else e)
+                    if not self._bootstrapped:
+                        self._bootstrap()
+                    self._follow_tail()
+            except PyMongoError as e:
+                print("[live] feed error, retrying:", e)
+                self._stop.wait(2)
+
+    # ----- readers -----
+    def view(self, zoom, since_seq=0, limit=200):
+        """What a dashboard needs to refresh: totals and cells of the window, plus up to
+        `limit` sessions newer than `since_seq` (newest first)."""
+        with self._lock:
+            new = []
+            for seq, doc in reversed(self._items):
+                if seq <= since_seq or len(new) >= limit:
+                    break
+                new.append(doc)
+            return {
+                "seq": self.seq,
+                "new": new,
+                "total": self.total,
+                "avg_reward": self.reward_sum / self.total if self.total else 0.0,
+                "actions": dict(self.actions),
+                "cells": [{"lat": lat, "lon": lon, "count": n, "avg_reward": r / n}
+                          for (lat, lon), (n, r) in self.cells[zoom].items()],
+                "mode": self.mode,
+            }
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(5)
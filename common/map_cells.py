@@ -0,0 +1,191 @@
+# common/map_cells.py
+# Pre-aggregated map data: finished sessions counted into lat/lon grid cells per hour at
+# a few grid sizes ("zoom levels"), so the Attack Map draws one point per occupied cell
+# instead of one per session. The forwarder keeps honeypot.geo_cells current with $inc
+# upserts as sessions finish; the dashboards sum the hours of the chosen window.
+#
+# Each drain() carries a flush id that is recorded on the docs it touches, so a batch the
+# writer retries after a lost acknowledgement is not counted twice.
+#
+#   python -m common.map_cells rebuild [--uri mongodb://...]   # recount from sessions_agg
+#   python -m common.map_cells show [--zoom 2] [--hours 24]
+#
+# rebuild deletes and recounts every cell: stop the forwarder first, or increments it
+# makes meanwhile are lost or counted twice.
+import os
+import math
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from bson import ObjectId
+from pymongo import UpdateOne
+
+# zoom level -> cell edge in degrees
+ZOOMS = {1: 10.0, 2: 2.5, 3: 0.5, 4: 0.1}
+DEFAULT_ZOOM = 2
+BUCKET = 3600   # seconds per time bucket
+CELLS_COLLECTION = "geo_cells"
+FLUSHES_KEPT = 16   # recent flush ids kept per cell; retries happen well within that many flushes
+
+
+def cell_of(lat, lon, size):
+    """Center of the grid cell holding (lat, lon)."""
+    return (round((math.floor(lat / size) + 0.5) * size, 6), round((math.floor(lon / size) + 0.5) * size, 6))
+
+
+def bucket_of(ts):
+    """Start of the time bucket of an epoch timestamp, as an aware UTC datetime."""
+    return datetime.fromtimestamp(int(ts // BUCKET) * BUCKET, tz=timezone.utc)
+
+
+def cell_id(zoom, hour, lat, lon):
+    return f"{zoom}:{hour:%Y%m%d%H}:{lat:.4f}:{lon:.4f}"
+
+
+class CellRollup:
+    """Accumulates (count, reward sum) per (zoom, hour, cell) in memory; drain() turns
+    them into one $inc upsert per touched cell. Between drains a busy cell costs a
+    dict update, not a Mongo write."""
+
+    def __init__(self, zooms=ZOOMS):
+        self.zooms = zooms
+        self._acc = {}
+        self._lock = threading.Lock()
+        self.sessions = 0
+
+    def add(self, geo, reward, ts):
+        if not geo or geo.get("lat") is None or geo.get("lon") is None:
+            return False
+        hour = bucket_of(ts)
+        with self._lock:
+            for zoom, size in self.zooms.items():
+                lat, lon = cell_of(geo["lat"], geo["lon"], size)
+                key = (zoom, hour, lat, lon)
+                acc = self._acc.get(key)
+                if acc is None:
+                    self._acc[key] = [1, float(reward or 0.0)]
+                else:
+                    acc[0] += 1
+                    acc[1] += float(reward or 0.0)
+            self.sessions += 1
+        return True
+
+    def __len__(self):
+        return len(self._acc)
+
+    def drain(self):
+        with self._lock:
+            acc, self._acc = self._acc, {}
+        flush = str(ObjectId())
+        # a cell that already has this flush id doesn't match; the upsert then hits its
+        # _id and fails with a duplicate key error, which the writers treat as done
+        return [UpdateOne({"_id": cell_id(zoom, hour, lat, lon), "flushes": {"$ne": flush}},
+                          {"$inc": {"count": n, "reward_sum": r},
+                           "$push": {"flushes": {"$each": [flush], "$slice": -FLUSHES_KEPT}},
+                           "$setOnInsert": {"zoom": zoom, "hour": hour, "lat": lat, "lon": lon}},
+                          upsert=True)
+                for (zoom, hour, lat, lon), (n, r) in acc.items()]
+
+
+def record(coll, doc):
+    """Counts one session doc into its cells right away (demo injectors, which write
+    sessions_agg directly instead of through the forwarder)."""
+    rollup = CellRollup()
+    if rollup.add(doc.get("geo"), doc.get("reward"), doc.get("ts") or 0):
+        coll.bulk_write(rollup.drain(), ordered=False)
+
+
+def load_cells(coll, zoom=DEFAULT_ZOOM, since=None, until=None):
+    """Cells of one zoom level summed over the hours in [since, until): a list of
+    {"lat", "lon", "count", "avg_reward"}, busiest first."""
+    match = {"zoom": zoom}
+    if since is not None or until is not None:
+        match["hour"] = {}
+        if since is not None:
+            # the bucket holding `since` counts as inside the window
+            match["hour"]["$gte"] = bucket_of(since.timestamp())
+        if until is not None:
+            match["hour"]["$lt"] = until
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": {"lat": "$lat", "lon": "$lon"},
+                    "count": {"$sum": "$count"}, "reward_sum": {"$sum": "$reward_sum"}}},
+        {"$project": {"_id": 0, "lat": "$_id.lat", "lon": "$_id.lon", "count": 1,
+                      "avg_reward": {"$divide": ["$reward_sum", "$count"]}}},
+        {"$sort": {"count": -1}},
+    ]
+    return list(coll.aggregate(pipeline, allowDiskUse=True))
+
+
+def cells_from_frame(df, zoom=DEFAULT_ZOOM):
+    """Same cells computed from a frame with lat / lon / reward columns (feature store
+    sources), vectorized."""
+    import pandas as pd
+
+    size = ZOOMS[zoom]
+    lat = pd.to_numeric(df["lat"], errors="coerce").to_numpy(dtype=float)
+    lon = pd.to_numeric(df["lon"], errors="coerce").to_numpy(dtype=float)
+    ok = ~(np.isnan(lat) | np.isnan(lon))
+    cells = pd.DataFrame({
+        "lat": np.round((np.floor(lat[ok] / size) + 0.5) * size, 6),
+        "lon": np.round((np.floor(lon[ok] / size) + 0.5) * size, 6),
+        "reward": pd.to_numeric(df["reward"], errors="coerce").fillna(0.0).to_numpy(dtype=float)[ok],
+    })
+    out = cells.groupby(["lat", "lon"], sort=False).agg(count=("reward", "size"), avg_reward=("reward", "mean"))
+    return out.reset_index().sort_values("count", ascending=False, ignore_index=True)
+
+
+def for_deck(cells, zoom=DEFAULT_ZOOM):
+    """Adds the radius (meters) pydeck draws each cell with: up to half the cell edge,
+    by the square root of its share of the busiest cell, so areas compare like counts."""
+    cells = cells.copy()
+    half = ZOOMS[zoom] * 111_000 / 2
+    if cells.empty:
+        cells["radius"] = []
+        return cells
+    share = np.sqrt(cells["count"].to_numpy(dtype=float) / max(float(cells["count"].max()), 1.0))
+    cells["radius"] = half * np.clip(share, 0.15, 1.0)
+    cells["avg_reward"] = cells["avg_reward"].astype(float).round(3)
+    return cells
+
+
+def rebuild(agg, cells, batch_size=1000):
+    """Recounts every cell from the session docs. Returns sessions counted. Not safe
+    while the forwarder is writing cells: run it with the forwarder stopped."""
+    cells.delete_many({})
+    rollup = CellRollup()
+    cur = agg.find({"geo.lat": {"$ne": None}}, {"_id": 0, "geo": 1, "reward": 1, "ts": 1}).batch_size(batch_size)
+    for d in cur:
+        rollup.add(d["geo"], d.get("reward"), d.get("ts") or 0)
+        if len(rollup) >= batch_size:
+            cells.bulk_write(rollup.drain(), ordered=False)
+    ops = rollup.drain()
+    if ops:
+        cells.bulk_write(ops, ordered=False)
+    return rollup.sessions
+
+
+def main(argv=None):
+    from pymongo import MongoClient
+
+    ap = argparse.ArgumentParser(description="Pre-aggregated Attack Map cells")
+    ap.add_argument("--uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("rebuild", help="recount all cells from sessions_agg (stop the forwarder first)")
+    p = sub.add_parser("show")
+    p.add_argument("--zoom", type=int, default=DEFAULT_ZOOM, choices=sorted(ZOOMS))
+    p.add_argument("--hours", type=float, default=24)
+    args = ap.parse_args(argv)
+    db = MongoClient(args.uri)["honeypot"]
+
+    if args.cmd == "rebuild":
+        n = rebuild(db["sessions_agg"], db[CELLS_COLLECTION])
+        print(f"Counted {n} located sessions into {db[CELLS_COLLECTION].count_documents({})} cells")
+    else:
+        since = datetime.now(timezone.utc) - timedelta(hours=args.hours)
+        for c in load_cells(db[CELLS_COLLECTION], args.zoom, since)[:20]:
+            print(f"{c['lat']:9.3f} {c['lon']:9.3f} {c['count']:8d} {c['avg_reward']:.3f}")
+
+if __name__ == "__main__":
+    main()
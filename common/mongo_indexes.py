@@ -0,0 +1,150 @@
+# common/mongo_indexes.py
+# Index bootstrap for every collection the controller, forwarder and dashboards query,
+# plus a query-plan audit.
+#
+#   python -m common.mongo_indexes ensure [--uri mongodb://...]
+#   python -m common.mongo_indexes explain [--uri mongodb://...] [--slow-ms 50]
+import os
+import sys
+import argparse
+from pymongo import ASCENDING, DESCENDING, MongoClient
+from pymongo.errors import ConnectionFailure, OperationFailure
+
+INDEX_TIMEOUT_MS = int(os.getenv("INDEX_TIMEOUT_MS", "2000"))   # server selection timeout of the bootstrap
+
+# (db, collection) -> [(keys, options)]
+INDEXES = {
+    ("controller_db", "decisions"): [
+        ([("action_id", ASCENDING)], {"name": "action_id_unique", "unique": True}),
+        ([("session_id", ASCENDING)], {"name": "session_id"}),
+        ([("ts", DESCENDING)], {"name": "ts_desc"}),
+    ],
+    ("controller_db", "reports"): [
+        ([("action_id", ASCENDING)], {"name": "action_id"}),
+        ([("session_id", ASCENDING)], {"name": "session_id"}),
+        ([("ts", DESCENDING)], {"name": "ts_desc"}),
+    ],
+    # raw Cowrie events
+    ("honeypot", "sessions"): [
+        # exact session lookup, already in replay order; _id breaks timestamp ties so
+        # replay chunks can resume from the last event (common/replay.py)
+        ([("session", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)], {"name": "session_timestamp_id"}),
+        ([("timestamp", ASCENDING)], {"name": "timestamp"}),
+        ([("src_ip", ASCENDING), ("timestamp", ASCENDING)], {"name": "src_ip_timestamp"}),
+    ],
+    # one document per finished session; the trailing _id lets Session Replay pages
+    # resume from the last row shown
+    ("honeypot", "sessions_agg"): [
+        ([("ts", DESCENDING), ("_id", DESCENDING)], {"name": "ts_id_desc"}),
+        ([("session_id", ASCENDING)], {"name": "session_id"}),
+        ([("src_ip", ASCENDING), ("ts", DESCENDING), ("_id", DESCENDING)], {"name": "src_ip_ts_id"}),
+        ([("applied_action", ASCENDING), ("ts", DESCENDING), ("_id", DESCENDING)], {"name": "applied_action_ts_id"}),
+    ],
+    # Attack Map cells (common/map_cells.py): one zoom level over a window of hours
+    ("honeypot", "geo_cells"): [
+        ([("zoom", ASCENDING), ("hour", ASCENDING)], {"name": "zoom_hour"}),
+    ],
+    # Overview rollups (common/rollups.py); minute docs carry expire_at, hour docs don't
+    ("honeypot", "session_rollups"): [
+        ([("res", ASCENDING), ("bucket", ASCENDING)], {"name": "res_bucket"}),
+        ([("expire_at", ASCENDING)], {"name": "expire_at_ttl", "expireAfterSeconds": 0}),
+    ],
+}
+
+# representative queries for the audit: (label, db, collection, filter, sort)
+QUERIES = [
+    ("report: decision by action_id", "controller_db", "decisions", {"action_id": "00000000-0000-0000-0000-000000000000"}, None),
+    ("dashboard: latest sessions", "honeypot", "sessions_agg", {}, [("ts", DESCENDING)]),
+    ("replay: events of one session", "honeypot", "sessions", {"session": "0000000000000"}, [("timestamp", ASCENDING), ("_id", ASCENDING)]),
+    ("replay: sessions of one ip", "honeypot", "sessions_agg", {"src_ip": "0.0.0.0"}, [("ts", DESCENDING), ("_id", DESCENDING)]),
+    ("replay: sessions by action", "honeypot", "sessions_agg", {"applied_action": "none"}, [("ts", DESCENDING), ("_id", DESCENDING)]),
+    ("extract: all events by time", "honeypot", "sessions", {}, [("timestamp", ASCENDING)]),
+]
+
+
+def ensure_indexes(client, dbs=None):
+    """Creates any missing index; existing ones are left alone. Never raises, so a
+    conflict (e.g. duplicate action_ids in old data) or an unreachable Mongo can't
+    stop a service from starting; services should go through bootstrap_indexes() so an
+    unreachable Mongo doesn't hold them up for the driver's 30s default either."""
+    created = []
+    for (db_name, coll_name), specs in INDEXES.items():
+        if dbs and db_name not in dbs:
+            continue
+        coll = client[db_name][coll_name]
+        for keys, opts in specs:
+            try:
+                created.append(f"{db_name}.{coll_name}.{coll.create_index(keys, **opts)}")
+            except OperationFailure as e:
+                print(f"[indexes] could not create {opts.get('name')} on {db_name}.{coll_name}: {e}")
+            except ConnectionFailure as e:
+                print("[indexes] Mongo unreachable, skipping index bootstrap:", e)
+                return created
+    return created
+
+
+def bootstrap_indexes(uri, dbs=None, timeout_ms=INDEX_TIMEOUT_MS):
+    """ensure_indexes() over a short-lived client that gives up after `timeout_ms`."""
+    with MongoClient(uri, serverSelectionTimeoutMS=timeout_ms) as client:
+        return ensure_indexes(client, dbs=dbs)
+
+
+def _walk_stages(plan):
+    while plan:
+        yield plan.get("stage")
+        inputs = plan.get("inputStages") or ([plan["inputStage"]] if "inputStage" in plan else [])
+        plan = inputs[0] if inputs else None
+
+
+def explain_queries(client, slow_ms=50):
+    rows = []
+    for label, db_name, coll_name, flt, sort in QUERIES:
+        cur = client[db_name][coll_name].find(flt).limit(1000)
+        if sort:
+            cur = cur.sort(sort)
+        try:
+            ex = cur.explain()
+        except OperationFailure as e:
+            rows.append({"query": label, "error": str(e)})
+            continue
+        stats = ex.get("executionStats", {})
+        stages = list(_walk_stages(ex.get("queryPlanner", {}).get("winningPlan", {})))
+        row = {
+            "query": label,
+            "collection": f"{db_name}.{coll_name}",
+            "plan": " <- ".join(s for s in stages if s),
+            "ms": stats.get("executionTimeMillis"),
+            "keys_examined": stats.get("totalKeysExamined"),
+            "docs_examined": stats.get("totalDocsExamined"),
+            "returned": stats.get("nReturned"),
+        }
+        row["slow"] = "COLLSCAN" in stages or "SORT" in stages or (row["ms"] or 0) >= slow_ms
+        rows.append(row)
+    return rows
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Create Mongo indexes / audit query plans")
+    ap.add_argument("command", choices=["ensure", "explain"])
+    ap.add_argument("--uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    ap.add_argument("--slow-ms", type=int, default=50)
+    args = ap.parse_args(argv)
+    client = MongoClient(args.uri, serverSelectionTimeoutMS=5000)
+    if args.command == "ensure":
+        for name in ensure_indexes(client):
+            print("ok", name)
+        return 0
+    slow = 0
+    for r in explain_queries(client, slow_ms=args.slow_ms):
+        if "error" in r:
+            print(f"ERR   {r['query']}: {r['error']}")
+            continue
+        flag = "SLOW" if r["slow"] else "ok  "
+        slow += r["slow"]
+        print(f"{flag}  {r['query']:<32} {r['collection']:<26} plan={r['plan']} ms={r['ms']} "
+              f"keys={r['keys_examined']} docs={r['docs_examined']} returned={r['returned']}")
+    return 1 if slow else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
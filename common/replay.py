@@ -0,0 +1,127 @@
+# common/replay.py
+# Session Replay backend: keyset ("seek") pagination over sessions_agg and over one
+# session's raw events. Each page resumes from the last row of the previous one on an
+# index that already holds the sort order, so page 500 costs the same as page 1 and a
+# 10k-event session is read a chunk at a time instead of all at once.
+#
+#   python -m common.replay sessions [--ip 1.2.3.4] [--action tarpit] [--hours 24]
+#   python -m common.replay events <session_id> [--chunk 1000]
+import os
+import argparse
+from datetime import datetime, timedelta, timezone
+from pymongo import ASCENDING, DESCENDING
+
+PAGE_SIZE = 50   # sessions per page
+EVENT_CHUNK = int(os.getenv("REPLAY_EVENT_CHUNK", "500"))   # raw events per chunk
+SESSION_FIELDS = ("session_id", "src_ip", "start", "end", "reward", "applied_action", "end_reason", "ts")
+EVENT_FIELDS = ("timestamp", "_ts_parsed", "eventid", "event", "input", "command", "message")
+
+
+def _after(key, value, _id, order):
+    # rows strictly past (value, _id) in `order` (1 ascending, -1 descending)
+    op = "$gt" if order == ASCENDING else "$lt"
+    return {"$or": [{key: {op: value}}, {key: value, "_id": {op: _id}}]}
+
+
+def session_query(ip=None, action=None, since=None, until=None):
+    """sessions_agg filter for the search form; each field lands on one of the
+    (field, ts, _id) indexes. `since` / `until` are aware datetimes."""
+    q = {}
+    if ip:
+        q["src_ip"] = ip
+    if action:
+        q["applied_action"] = action
+    if since is not None or until is not None:
+        q["ts"] = {}
+        if since is not None:
+            q["ts"]["$gte"] = since.timestamp()
+        if until is not None:
+            q["ts"]["$lt"] = until.timestamp()
+    return q
+
+
+def find_sessions(coll, ip=None, action=None, since=None, until=None, after=None, limit=PAGE_SIZE):
+    """One page of sessions, newest first: (rows, cursor). Pass `cursor` back as
+    `after` for the next page; it is None on the last page."""
+    q = session_query(ip, action, since, until)
+    if after is not None:
+        q = {"$and": [q, _after("ts", after["ts"], after["_id"], DESCENDING)]}
+    rows = list(coll.find(q, {k: 1 for k in SESSION_FIELDS})
+                .sort([("ts", DESCENDING), ("_id", DESCENDING)]).limit(limit + 1))
+    more = len(rows) > limit
+    rows = rows[:limit]
+    cursor = {"ts": rows[-1]["ts"], "_id": rows[-1]["_id"]} if more else None
+    return rows, cursor
+
+
+def session_events(coll, session_id, after=None, limit=EVENT_CHUNK):
+    """One chunk of a session's raw events in timestamp order: (events, cursor).
+    Exact match on the session id, so other sessions sharing a prefix never show up."""
+    q = {"session": session_id}
+    if after is not None:
+        q = {"$and": [q, _after("timestamp", after["timestamp"], after["_id"], ASCENDING)]}
+    events = list(coll.find(q, {k: 1 for k in EVENT_FIELDS})
+                  .sort([("timestamp", ASCENDING), ("_id", ASCENDING)]).limit(limit + 1))
+    more = len(events) > limit
+    events = events[:limit]
+    cursor = {"timestamp": events[-1].get("timestamp"), "_id": events[-1]["_id"]} if more else None
+    return events, cursor
+
+
+def iter_events(coll, session_id, chunk=EVENT_CHUNK):
+    """Yields a session's events chunk by chunk, for playback and exports."""
+    after = None
+    while True:
+        events, after = session_events(coll, session_id, after, chunk)
+        if events:
+            yield events
+        if after is None:
+            return
+
+
+def count_events(coll, session_id):
+    return coll.count_documents({"session": session_id})
+
+
+def event_row(e):
+    """Display row of one raw event."""
+    return {
+        "ts": str(e.get("timestamp") or e.get("_ts_parsed") or ""),
+        "event": e.get("eventid") or e.get("event"),
+        "input": e.get("input") or e.get("command") or e.get("message"),
+    }
+
+
+def main(argv=None):
+    from pymongo import MongoClient
+
+    ap = argparse.ArgumentParser(description="Browse sessions and replay their events")
+    ap.add_argument("--uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("sessions")
+    p.add_argument("--ip")
+    p.add_argument("--action")
+    p.add_argument("--hours", type=float)
+    p.add_argument("--limit", type=int, default=PAGE_SIZE)
+    p = sub.add_parser("events")
+    p.add_argument("session_id")
+    p.add_argument("--chunk", type=int, default=EVENT_CHUNK)
+    args = ap.parse_args(argv)
+    db = MongoClient(args.uri)["honeypot"]
+
+    if args.cmd == "sessions":
+        since = datetime.now(timezone.utc) - timedelta(hours=args.hours) if args.hours else None
+        rows, cursor = find_sessions(db["sessions_agg"], args.ip, args.action, since, limit=args.limit)
+        for r in rows:
+            print(f"{r.get('session_id')!s:24} {r.get('src_ip')!s:16} {r.get('start')!s:32} "
+                  f"{r.get('applied_action')!s:16} {r.get('reward')}")
+        if cursor:
+            print("... more")
+    else:
+        for events in iter_events(db["sessions"], args.session_id, args.chunk):
+            for e in events:
+                row = event_row(e)
+                print(row["ts"], row["event"], row["input"] or "")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+# common/rollups.py
+# Per-minute and per-hour summaries of finished sessions (count, reward sum, reward
+# histogram, per-action count / reward) kept in honeypot.session_rollups, so the Overview
+# answers any time window from a few hundred small docs instead of every session.
+# The forwarder sums them in memory and flushes $inc upserts; minute docs expire after
+# MINUTE_RETENTION, hour docs are kept. As with the map cells (common/map_cells.py), each
+# flush id is recorded on the docs it touched, so a retried flush is counted once.
+#
+#   python -m common.rollups rebuild [--uri mongodb://...]   # recount from sessions_agg
+#   python -m common.rollups show [--hours 24]
+#
+# rebuild deletes and recounts every rollup: stop the forwarder first.
+import os
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import UpdateOne
+
+ROLLUPS_COLLECTION = "session_rollups"
+RESOLUTIONS = {"minute": 60, "hour": 3600}   # name -> seconds per bucket
+MINUTE_RETENTION = timedelta(days=float(os.getenv("MINUTE_ROLLUP_DAYS", "7")))
+MINUTE_WINDOW_MAX = timedelta(hours=6)   # windows up to this long are summed from minute docs
+REWARD_BINS = 10   # histogram of rewards over [0, 1]
+FLUSHES_KEPT = 16   # recent flush ids kept per rollup doc
+
+
+def bucket_of(ts, res):
+    step = RESOLUTIONS[res]
+    return datetime.fromtimestamp(int(ts // step) * step, tz=timezone.utc)
+
+
+def _field(action):
+    # action names become field names; '.' and '$' are not allowed there
+    return str(action).replace(".", "．").replace("$", "＄")
+
+
+def _action(field):
+    return field.replace("．", ".").replace("＄", "$")
+
+
+def _reward_bin(reward):
+    return min(max(int(reward * REWARD_BINS), 0), REWARD_BINS - 1)
+
+
+class SessionRollup:
+    """Accumulates $inc fields per (resolution, bucket) in memory; drain() turns them
+    into one upsert per touched bucket doc."""
+
+    def __init__(self):
+        self._acc = {}
+        self._lock = threading.Lock()
+        self.sessions = 0
+
+    def add(self, doc):
+        ts = doc.get("ts")
+        if ts is None:
+            return False
+        reward = float(doc.get("reward") or 0.0)
+        action = _field(doc.get("applied_action") or "none")
+        inc = {
+            "count": 1,
+            "reward_sum": reward,
+            f"reward_bins.{_reward_bin(reward)}": 1,
+            f"actions.{action}.count": 1,
+            f"actions.{action}.reward_sum": reward,
+        }
+        with self._lock:
+            for res in RESOLUTIONS:
+                acc = self._acc.setdefault((res, bucket_of(ts, res)), {})
+                for k, v in inc.items():
+                    acc[k] = acc.get(k, 0) + v
+            self.sessions += 1
+        return True
+
+    def __len__(self):
+        return len(self._acc)
+
+    def drain(self):
+        with self._lock:
+            acc, self._acc = self._acc, {}
+        flush = str(ObjectId())
+        ops = []
+        for (res, bucket), inc in acc.items():
+            on_insert = {"res": res, "bucket": bucket}
+            if res == "minute":
+                on_insert["expire_at"] = bucket + MINUTE_RETENTION
+            # already applied -> no match -> duplicate key on the upsert, treated as done
+            ops.append(UpdateOne({"_id": f"{res}:{bucket:%Y%m%d%H%M}", "flushes": {"$ne": flush}},
+                                 {"$inc": inc, "$setOnInsert": on_insert,
+                                  "$push": {"flushes": {"$each": [flush], "$slice": -FLUSHES_KEPT}}},
+                                 upsert=True))
+        return ops
+
+
+def record(coll, doc):
+    """Counts one session doc right away (demo injectors write sessions_agg directly)."""
+    rollup = SessionRollup()
+    if rollup.add(doc):
+        coll.bulk_write(rollup.drain(), ordered=False)
+
+
+def summarize(docs):
+    """Sums rollup docs into {"total", "avg_reward", "actions", "reward_bins", "series"}."""
+    total = 0
+    reward_sum = 0.0
+    bins = [0] * REWARD_BINS
+    actions = {}
+    series = []
+    for d in docs:
+        n = d.get("count", 0)
+        r = d.get("reward_sum", 0.0)
+        total += n
+        reward_sum += r
+        for k, v in (d.get("reward_bins") or {}).items():
+            bins[int(k)] += v
+        for k, a in (d.get("actions") or {}).items():
+            acc = actions.setdefault(_action(k), [0, 0.0])
+            acc[0] += a.get("count", 0)
+            acc[1] += a.get("reward_sum", 0.0)
+        series.append({"bucket": d["bucket"], "count": n, "avg_reward": r / n if n else 0.0})
+    return {
+        "total": total,
+        "avg_reward": reward_sum / total if total else 0.0,
+        "actions": sorted(({"action": a, "count": n, "avg_reward": r / n if n else 0.0}
+                           for a, (n, r) in actions.items()), key=lambda x: -x["count"]),
+        "reward_bins": [{"reward": f"{i / REWARD_BINS:.1f}-{(i + 1) / REWARD_BINS:.1f}", "count": c}
+                        for i, c in enumerate(bins)],
+        "series": series,
+    }
+
+
+def overview(coll, since=None, until=None):
+    """Summary of the sessions finished in [since, until). Short windows are summed from
+    minute docs, longer ones (or open-ended) from hour docs; either way at most a few
+    hundred docs are read, however many sessions there were."""
+    now = datetime.now(timezone.utc)
+    res = "minute" if since is not None and (until or now) - since <= MINUTE_WINDOW_MAX else "hour"
+    query = {"res": res}
+    if since is not None or until is not None:
+        query["bucket"] = {}
+        if since is not None:
+            # the bucket holding `since` counts as inside the window
+            query["bucket"]["$gte"] = bucket_of(since.timestamp(), res)
+        if until is not None:
+            query["bucket"]["$lt"] = until
+    out = summarize(coll.find(query, {"_id": 0, "expire_at": 0, "flushes": 0}).sort("bucket", 1))
+    out["resolution"] = res
+    return out
+
+
+def rebuild(agg, coll, batch_size=1000):
+    """Recounts every rollup from the session docs. Returns sessions counted. Run it
+    with the forwarder stopped; its increments would race the delete and recount."""
+    coll.delete_many({})
+    rollup = SessionRollup()
+    cur = agg.find({}, {"_id": 0, "ts": 1, "reward": 1, "applied_action": 1}).batch_size(batch_size)
+    for d in cur:
+        rollup.add(d)
+        if len(rollup) >= batch_size:
+            coll.bulk_write(rollup.drain(), ordered=False)
+    ops = rollup.drain()
+    if ops:
+        coll.bulk_write(ops, ordered=False)
+    return rollup.sessions
+
+
+def main(argv=None):
+    from pymongo import MongoClient
+
+    ap = argparse.ArgumentParser(description="Session rollups for the Overview")
+    ap.add_argument("--uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("rebuild", help="recount all rollups from sessions_agg (stop the forwarder first)")
+    p = sub.add_parser("show")
+    p.add_argument("--hours", type=float, default=24)
+    args = ap.parse_args(argv)
+    db = MongoClient(args.uri)["honeypot"]
+
+    if args.cmd == "rebuild":
+        n = rebuild(db["sessions_agg"], db[ROLLUPS_COLLECTION])
+        print(f"Counted {n} sessions into {db[ROLLUPS_COLLECTION].count_documents({})} rollup docs")
+    else:
+        s = overview(db[ROLLUPS_COLLECTION], datetime.now(timezone.utc) - timedelta(hours=args.hours))
+        print(f"{s['total']} sessions, avg reward {s['avg_reward']:.3f} ({s['resolution']} rollups)")
+        for a in s["actions"]:
+            print(f"  {a['action']:24s} {a['count']:8d} {a['avg_reward']:.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# common/session_features.py
+# Streaming per-session features, shared by the forwarder (live, one event at a time) and
+# notebooks/feature_extractor.py (offline), so the contexts sent to /decide are computed
+# exactly like the features the models are trained on.
+import re
+import math
+import hashlib
+from collections import deque
+
+from common.indicators import get_matcher
+from common.timestamps import parse_ts
+
+N_FEATURES = 2 ** 18   # hash buckets of the command-sequence block ("seq" in the feature store)
+NGRAM = 2              # token n-grams up to this length
+MAX_SEQ_BUCKETS = 4096   # per-session cap on distinct buckets; bounds memory of long sessions
+EXACT_DISTINCT = 64    # distinct commands counted exactly up to here, then by HyperLogLog
+
+TOKEN_RE = re.compile(r"(?u)\b\w\w+\b")
+
+
+def stable_hash(s):
+    # 64-bit and identical in every process (unlike hash(), which is salted per run)
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8", "replace"), digest_size=8).digest(), "big")
+
+
+def command_of(event):
+    """The attacker command carried by a Cowrie event, or None."""
+    cmd = event.get("input") or event.get("command") or event.get("cmd")
+    if not cmd and str(event.get("eventid") or event.get("event") or "").endswith("command.input"):
+        cmd = event.get("message")
+    if not cmd:
+        return None
+    return cmd if isinstance(cmd, str) else str(cmd)
+
+
+class DistinctCounter:
+    """Distinct count: an exact set for the first `exact` values, then a HyperLogLog with
+    2^p one-byte registers (~3% error at p=10). Updates are O(1) and memory is fixed."""
+
+    __slots__ = ("exact", "p", "_set", "_reg")
+
+    def __init__(self, exact=EXACT_DISTINCT, p=10):
+        self.exact = exact
+        self.p = p
+        self._set = set()
+        self._reg = None
+
+    def add(self, value):
+        h = stable_hash(value)
+        if self._reg is None:
+            self._set.add(h)
+            if len(self._set) <= self.exact:
+                return
+            self._reg = bytearray(1 << self.p)
+            for x in self._set:
+                self._add_hll(x)
+            self._set = None
+        else:
+            self._add_hll(h)
+
+    def _add_hll(self, h):
+        bits = 64 - self.p
+        i = h >> bits
+        rest = h & ((1 << bits) - 1)
+        rank = bits - rest.bit_length() + 1
+        if rank > self._reg[i]:
+            self._reg[i] = rank
+
+    def __len__(self):
+        if self._reg is None:
+            return len(self._set)
+        m = len(self._reg)
+        est = (0.7213 / (1 + 1.079 / m)) * m * m / sum(2.0 ** -r for r in self._reg)
+        zeros = self._reg.count(0)
+        if est <= 2.5 * m and zeros:
+            est = m * math.log(m / zeros)
+        return int(round(est))
+
+
+class SessionFeatures:
+    """Incremental feature state of one session. update() costs O(tokens in the event);
+    nothing is kept per event, so memory does not grow with session length beyond the
+    capped n-gram bucket map."""
+
+    __slots__ = ("n_features", "ngram", "first_ts", "last_ts", "cmd_count", "downloads", "iocs",
+                 "distinct", "seq", "_tail", "_last_cmd_ts", "_gap_n", "_gap_mean", "_gap_m2", "gap_max")
+
+    def __init__(self, n_features=N_FEATURES, ngram=NGRAM):
+        self.n_features = n_features
+        self.ngram = ngram
+        self.first_ts = None
+        self.last_ts = None
+        self.cmd_count = 0
+        self.downloads = 0
+        self.iocs = set()
+        self.distinct = DistinctCounter()
+        self.seq = {}   # bucket -> count
+        self._tail = deque(maxlen=max(ngram - 1, 0))   # last tokens, for n-grams across commands
+        self._last_cmd_ts = None
+        self._gap_n = 0
+        self._gap_mean = 0.0
+        self._gap_m2 = 0.0
+        self.gap_max = 0.0
+
+    def update(self, event, ts=None, matcher=None):
+        """Folds one event in. `ts` may be passed if the caller already parsed it."""
+        ts = ts if ts is not None else parse_ts(event.get("timestamp") or event.get("time") or event.get("ts"))
+        if ts is not None:
+            if self.first_ts is None or ts < self.first_ts:
+                self.first_ts = ts
+            if self.last_ts is None or ts > self.last_ts:
+                self.last_ts = ts
+
+        cmd = command_of(event)
+        if cmd is not None:
+            self.cmd_count += 1
+            self.distinct.add(cmd.strip())
+            self._hash_tokens(cmd)
+            if ts is not None:
+                if self._last_cmd_ts is not None:
+                    self._add_gap(max(0.0, (ts - self._last_cmd_ts).total_seconds()))
+                self._last_cmd_ts = ts
+
+        matcher = matcher or get_matcher()
+        hits = matcher.match(event)
+        if hits:
+            self.iocs.update(hits)
+            if matcher.is_download(hits):
+                self.downloads += 1
+
+    def _hash_tokens(self, cmd):
+        for tok in TOKEN_RE.findall(cmd.lower()):
+            self._bump(tok)
+            gram = tok
+            for prev in reversed(self._tail):
+                gram = prev + " " + gram
+                self._bump(gram)
+            self._tail.append(tok)
+
+    def _bump(self, term):
+        b = stable_hash(term) % self.n_features
+        if b in self.seq:
+            self.seq[b] += 1
+        elif len(self.seq) < MAX_SEQ_BUCKETS:
+            self.seq[b] = 1
+
+    def _add_gap(self, gap):
+        # Welford: running mean/variance of the time between commands
+        self._gap_n += 1
+        d = gap - self._gap_mean
+        self._gap_mean += d / self._gap_n
+        self._gap_m2 += d * (gap - self._gap_mean)
+        if gap > self.gap_max:
+            self.gap_max = gap
+
+    @property
+    def duration(self):
+        if self.first_ts is None or self.last_ts is None:
+            return 0.0
+        return max(0.0, (self.last_ts - self.first_ts).total_seconds())
+
+    @property
+    def unique_cmds(self):
+        return len(self.distinct)
+
+    def gap_stats(self):
+        std = math.sqrt(self._gap_m2 / self._gap_n) if self._gap_n > 1 else 0.0
+        return self._gap_mean, std, self.gap_max
+
+    def context(self, reward=0.0):
+        """Numeric features by name; covers every column of controller/feature_schema.json."""
+        gap_mean, gap_std, gap_max = self.gap_stats()
+        return {
+            "duration": self.duration,
+            "cmd_count": float(self.cmd_count),
+            "unique_cmds": float(self.unique_cmds),
+            "downloads": float(self.downloads),
+            "reward": reward,
+            "ioc_count": float(len(self.iocs)),
+            "cmd_gap_mean": gap_mean,
+            "cmd_gap_std": gap_std,
+            "cmd_gap_max": gap_max,
+        }
+
+    def reward(self):
+        # engagement: 60% time kept busy (capped at 5 min), 40% distinct commands (capped at 5)
+        dur_norm = min(self.duration / 300.0, 1.0)
+        cmd_norm = min(self.unique_cmds / 5.0, 1.0)
+        return max(0.0, min(0.6 * dur_norm + 0.4 * cmd_norm, 1.0))
+
+    def seq_sparse(self):
+        """{"indices", "values"} of the n-gram bucket counts, sorted by index."""
+        idx = sorted(self.seq)
+        return {"indices": idx, "values": [float(self.seq[i]) for i in idx]}
@@ -0,0 +1,153 @@
+# common/session_io.py
+# Streaming readers/writers for sessionized events (JSONL or Parquet, legacy JSON list).
+import os
+import json
+
+SESSION_COLUMNS = ("session_id", "src_ip", "start", "end", "n_events", "events")
+
+
+def _fmt_for(path, fmt=None):
+    if fmt:
+        return fmt
+    if path.endswith(".parquet"):
+        return "parquet"
+    if path.endswith(".json"):
+        return "json"
+    return "jsonl"
+
+
+class JsonlSink:
+    """One session per line. Written to a temp file and renamed on close, so a
+    crashed run never leaves a truncated output behind."""
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp = path + ".tmp"
+        self._fh = open(self.tmp, "w")
+        self.count = 0
+
+    def write(self, session):
+        self._fh.write(json.dumps(session, default=str) + "\n")
+        self.count += 1
+
+    def close(self):
+        self._fh.close()
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        # drop the partial output; an existing file at `path` is left as it was
+        self._fh.close()
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+class ParquetSink:
+    """Sessions as Parquet row groups of `row_group_size` sessions; the events of a
+    session are stored as one JSON string column."""
+
+    def __init__(self, path, row_group_size=5000):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa = pa
+        self.path = path
+        self.tmp = path + ".tmp"
+        self.row_group_size = row_group_size
+        self.schema = pa.schema([
+            ("session_id", pa.string()), ("src_ip", pa.string()),
+            ("start", pa.string()), ("end", pa.string()),
+            ("n_events", pa.int64()), ("events", pa.string()),
+        ])
+        self._writer = pq.ParquetWriter(self.tmp, self.schema, compression="zstd")
+        self._buf = []
+        self.count = 0
+
+    def write(self, session):
+        row = dict(session)
+        events = row.get("events") or []
+        row["n_events"] = len(events)
+        row["events"] = json.dumps(events, default=str)
+        self._buf.append(row)
+        self.count += 1
+        if len(self._buf) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if self._buf:
+            cols = {c: [r.get(c) for r in self._buf] for c in SESSION_COLUMNS}
+            self._writer.write_table(self._pa.table(cols, schema=self.schema))
+            self._buf = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        self._buf = []
+        self._writer.close()
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+class JsonListSink(JsonlSink):
+    """Legacy single JSON array (sessions.json); still streamed, one element at a time."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._fh.write("[\n")
+
+    def write(self, session):
+        if self.count:
+            self._fh.write(",\n")
+        self._fh.write(json.dumps(session, default=str))
+        self.count += 1
+
+    def close(self):
+        self._fh.write("\n]\n")
+        super().close()
+
+
+def open_sink(path, fmt=None):
+    fmt = _fmt_for(path, fmt)
+    if fmt == "parquet":
+        return ParquetSink(path)
+    if fmt == "json":
+        return JsonListSink(path)
+    return JsonlSink(path)
+
+
+def iter_sessions(path, fmt=None):
+    """Yields session dicts one at a time from any of the formats above."""
+    fmt = _fmt_for(path, fmt)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches():
+            for row in batch.to_pylist():
+                row["events"] = json.loads(row["events"]) if row.get("events") else []
+                yield row
+    elif fmt == "json":
+        with open(path, "r") as f:
+            yield from json.load(f)
+    else:
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
@@ -0,0 +1,60 @@
+# common/timestamps.py
+# Fast timestamp parsing shared by the forwarder and the notebook scripts.
+from datetime import datetime
+from functools import lru_cache
+
+_dateutil_parser = None
+
+
+def _slow_parse(s):
+    global _dateutil_parser
+    if _dateutil_parser is None:
+        from dateutil import parser as _dateutil_parser
+    return _dateutil_parser.parse(s)
+
+
+@lru_cache(maxsize=65536)
+def _parse_str(s):
+    # Cowrie writes "2025-10-21T12:00:01.123456Z"; fromisoformat handles that and
+    # the other ISO shapes we see ("2025-10-21 12:00:00", "+00:00" offsets)
+    try:
+        if s.endswith("Z"):
+            return datetime.fromisoformat(s[:-1] + "+00:00")
+        return datetime.fromisoformat(s)
+    except ValueError:
+        pass
+    try:
+        return _slow_parse(s)
+    except (ValueError, OverflowError):
+        return None
+
+
+def parse_ts(value):
+    """datetime for an ISO-ish timestamp string, or None if it can't be parsed.
+    datetimes pass through unchanged; repeated strings are served from a cache."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value
+    if not isinstance(value, str):
+        value = str(value)
+    value = value.strip()
+    return _parse_str(value) if value else None
+
+
+def parse_series(series, utc=True):
+    """Vectorized parse of a pandas Series of timestamp strings.
+
+    Uses pandas' ISO8601 parser for the whole column, then sends only the values
+    it rejected through parse_ts. Unparseable values become NaT.
+    """
+    import pandas as pd
+    try:
+        out = pd.to_datetime(series, format="ISO8601", utc=utc, errors="coerce")
+    except (TypeError, ValueError):
+        # pandas < 2.0 has no format="ISO8601"
+        out = pd.to_datetime(series, utc=utc, errors="coerce")
+    bad = out.isna() & series.notna()
+    if bad.any():
+        out.loc[bad] = pd.to_datetime(series[bad].map(parse_ts), utc=utc, errors="coerce")
+    return out
@@ -0,0 +1,110 @@
+# controller/action_store.py
+# Indexed, append-mostly log of controller decisions (replaces controller/actions/*.json).
+import os
+import json
+import time
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS actions (
+    action_id  TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    action     TEXT NOT NULL,
+    context    TEXT,
+    ts         REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS actions_session ON actions (session_id);
+CREATE INDEX IF NOT EXISTS actions_ts ON actions (ts);
+"""
+
+
+class ActionStore:
+    """Decisions in one SQLite file (WAL mode), looked up by action_id or session_id.
+
+    Other processes can open the same file read-only to see decisions, which is
+    what the per-decision JSON files were for. Rows older than `retention_days`
+    are deleted every `compact_every` writes; `compact(vacuum=True)` also gives
+    the space back to the filesystem.
+    """
+
+    def __init__(self, path, retention_days=30.0, compact_every=10000):
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.path = path
+        self.retention_days = retention_days
+        self.compact_every = compact_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")   # no fsync per commit in WAL mode
+        self._db.executescript(SCHEMA)
+
+    @staticmethod
+    def _row(action_id, session_id, action, context, ts):
+        return (action_id, session_id, action, json.dumps(context) if context is not None else None, ts)
+
+    def put(self, action_id, session_id, action, context=None, ts=None):
+        self.put_many([(action_id, session_id, action, context, ts)])
+
+    def put_many(self, items):
+        now = time.time()
+        rows = [self._row(a_id, sid, act, ctx, ts if ts is not None else now) for a_id, sid, act, ctx, ts in items]
+        with self._lock:
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO actions VALUES (?, ?, ?, ?, ?)", rows)
+            self._writes += len(rows)
+            due = self.compact_every and self._writes >= self.compact_every
+            if due:
+                self._writes = 0
+        if due:
+            self.compact()
+
+    @staticmethod
+    def _to_dict(r):
+        return {"action_id": r[0], "session_id": r[1], "action": r[2],
+                "context": json.loads(r[3]) if r[3] else {}, "ts": r[4]}
+
+    def get(self, action_id):
+        with self._lock:
+            r = self._db.execute("SELECT * FROM actions WHERE action_id = ?", (action_id,)).fetchone()
+        return self._to_dict(r) if r else None
+
+    def get_many(self, action_ids):
+        ids = list(action_ids)
+        out = {}
+        with self._lock:
+            # stay under SQLite's bound-parameter limit
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                q = f"SELECT * FROM actions WHERE action_id IN ({','.join('?' * len(chunk))})"
+                for r in self._db.execute(q, chunk):
+                    out[r[0]] = self._to_dict(r)
+        return out
+
+    def by_session(self, session_id):
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM actions WHERE session_id = ? ORDER BY ts", (session_id,)).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    def compact(self, vacuum=False):
+        cutoff = time.time() - self.retention_days * 86400.0
+        with self._lock:
+            with self._db:
+                n = self._db.execute("DELETE FROM actions WHERE ts < ?", (cutoff,)).rowcount
+            if vacuum:
+                self._db.execute("VACUUM")
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if n:
+            print(f"[actions] compacted {n} decisions older than {self.retention_days} days")
+        return n
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM actions").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -1,19 +1,46 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from typing import Dict, Any
-from pymongo import MongoClient
+from typing import Dict, Any, List, Optional
+from pymongo import AsyncMongoClient
+from pymongo.errors import PyMongoError
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import numpy as np
+import asyncio
+import time
 import uuid
 import os
 import json
 
 from controller.bandit import LinUCB
+from controller.checkpoint import Checkpointer, feature_layout
+from controller.shared_state import SHARED_STATE, SharedModel, open_store
+from controller.action_store import ActionStore
+from controller.decision_log import AsyncBulkInserter, DecisionLog
+from controller.profiling import RequestProfiler
+from controller import metrics
+from controller.metrics import REQUEST_SECONDS, STAGE_SECONDS, DECISIONS, UPDATES, REPORTS_MISSING, PENDING_REPORTS
+from common.mongo_indexes import bootstrap_indexes
 
 # Config
 MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
-MODEL_PATH = os.environ.get("MODEL_PATH", "controller/linucb.pkl")
+MODEL_PATH = os.environ.get("MODEL_PATH", "controller/linucb.npz")
+WAL_PATH = os.environ.get("WAL_PATH", "controller/linucb.wal")
+LEGACY_MODEL_PATH = os.environ.get("LEGACY_MODEL_PATH", "controller/linucb.pkl")   # migrated once if present
+CHECKPOINT_INTERVAL = float(os.environ.get("CHECKPOINT_INTERVAL", "30"))   # seconds
+CHECKPOINT_EVERY_N = int(os.environ.get("CHECKPOINT_EVERY_N", "500"))   # updates
+WAL_FSYNC = os.environ.get("WAL_FSYNC", "0") == "1"   # fsync every update, not just every interval
+ACTION_DB_PATH = os.environ.get("ACTION_DB_PATH", "controller/actions.db")
+ACTION_RETENTION_DAYS = float(os.environ.get("ACTION_RETENTION_DAYS", "30"))
 SCHEMA_PATH = os.environ.get("SCHEMA_PATH", "controller/feature_schema.json")
+SEQ_DIMS = int(os.environ.get("SEQ_DIMS", "0"))   # dense dims the hashed command-sequence buckets fold into (see _fold); 0 = ignore them
+SHARED_SYNC_INTERVAL = float(os.environ.get("SHARED_SYNC_INTERVAL", "5"))   # seconds between merges with the shared model
+SHARED_SYNC_EVERY_N = int(os.environ.get("SHARED_SYNC_EVERY_N", "200"))   # or after this many local updates
+LOG_BATCH = int(os.environ.get("DECISION_LOG_BATCH", "500"))   # docs per background insert_many
+LOG_INTERVAL = float(os.environ.get("DECISION_LOG_INTERVAL", "0.05"))   # seconds a partial batch waits
+LOG_MAX_QUEUE = int(os.environ.get("DECISION_LOG_MAX", "50000"))   # queued docs before /decide waits on Mongo
+MONGO_TIMEOUT_MS = int(os.environ.get("MONGO_TIMEOUT_MS", "2000"))   # server selection; bounds a /report lookup while Mongo is down
 
 # Actions your controller can choose (start small)
 ACTIONS = [
@@ -25,31 +52,91 @@ ACTIONS = [
     "fingerprint:windows"
 ]
 
-# Connect Mongo
-client = MongoClient(MONGO_URI)
+# Connect Mongo: the async client serves requests (indexes are set up at startup, see
+# _start_logs; importing this module never touches the network)
+client = AsyncMongoClient(MONGO_URI, serverSelectionTimeoutMS=MONGO_TIMEOUT_MS)
 db = client["controller_db"]
 decisions_col = db["decisions"]
 reports_col = db["reports"]
 
+# Local decision log: serves /report lookups without a Mongo round trip
+actions = ActionStore(ACTION_DB_PATH, retention_days=ACTION_RETENTION_DAYS)
+
 # Load feature schema
 with open(SCHEMA_PATH, "r") as f:
     schema = json.load(f)
 FEATURE_ORDER = schema.get("features_order", [])
 
-DIM = max(len(FEATURE_ORDER), 1)
+DIM = max(len(FEATURE_ORDER) + SEQ_DIMS, 1)
+# saved with the model; a checkpoint or shared model trained on another layout is refused
+FEATURES = feature_layout(FEATURE_ORDER, SEQ_DIMS)
 
-# Load or init bandit
-if os.path.exists(MODEL_PATH):
-    policy = LinUCB.load(MODEL_PATH)
+# Load or init bandit. With SHARED_STATE set, every worker/replica merges its updates into
+# one shared model (controller/shared_state.py), so the app can run with --workers N or
+# behind a load balancer; otherwise the model is this process's checkpoint + WAL.
+if SHARED_STATE:
+    ckpt = SharedModel(open_store(SHARED_STATE, MONGO_URI, features=FEATURES), lambda: LinUCB(ACTIONS, DIM, alpha=0.8),
+                       interval=SHARED_SYNC_INTERVAL, every_n=SHARED_SYNC_EVERY_N)
 else:
-    policy = LinUCB(ACTIONS, DIM, alpha=0.8)
-    policy.save(MODEL_PATH)
+    ckpt = Checkpointer(MODEL_PATH, WAL_PATH, lambda: LinUCB(ACTIONS, DIM, alpha=0.8),
+                        interval=CHECKPOINT_INTERVAL, every_n=CHECKPOINT_EVERY_N,
+                        wal_fsync=WAL_FSYNC, legacy_pickle=LEGACY_MODEL_PATH, features=FEATURES)
+policy = ckpt.policy
+if policy.dim != DIM:
+    raise SystemExit(f"model at {MODEL_PATH} has dim {policy.dim}, but the schema and SEQ_DIMS={SEQ_DIMS} "
+                     f"give {DIM}; move the old model and WAL aside to start a new one")
+
+# reports are applied from this one thread, in arrival order; scoring takes ckpt.lock
+# on worker threads, never on the event loop
+updater = ThreadPoolExecutor(max_workers=1, thread_name_prefix="policy-update")
+decision_log = None
+report_log = None
+index_task = None
+
+profiler = RequestProfiler()
 
 app = FastAPI(title="Honeypot Controller")
 
+@app.middleware("http")
+async def _instrument(request: Request, call_next):
+    t0 = time.perf_counter()
+    with profiler.maybe(request.url.path):
+        response = await call_next(request)
+    # the route template, not the raw path, keeps the label set bounded
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    REQUEST_SECONDS.observe(time.perf_counter() - t0, route=route)
+    return response
+
+@app.on_event("startup")
+async def _start_logs():
+    global decision_log, report_log, index_task
+    # in the background over a short sync connection: a down Mongo must not hold up startup
+    index_task = asyncio.create_task(asyncio.to_thread(bootstrap_indexes, MONGO_URI, dbs=["controller_db"]))
+    kw = dict(batch_size=LOG_BATCH, flush_interval=LOG_INTERVAL, max_queue=LOG_MAX_QUEUE)
+    decision_log = DecisionLog(decisions_col, actions, **kw)
+    report_log = AsyncBulkInserter(reports_col, "reports", **kw)
+    decision_log.start()
+    report_log.start()
+
+@app.on_event("shutdown")
+async def _flush_model():
+    await index_task   # bounded by INDEX_TIMEOUT_MS
+    await decision_log.close()
+    await report_log.close()
+    updater.shutdown(wait=True)
+    ckpt.close()
+    actions.close()
+    await client.close()
+
+class SparseVec(BaseModel):
+    # hashed command-sequence features, same bucket space as the feature store's "seq" block
+    indices: List[int]
+    values: List[float]
+
 class DecideReq(BaseModel):
     session_id: str
     context: Dict[str, float]
+    seq: Optional[SparseVec] = None
 
 class DecideResp(BaseModel):
     action: str
@@ -61,57 +148,186 @@ class ReportReq(BaseModel):
     reward: float
     metadata: Dict[str, Any] = {}
 
-def _to_vec(context: Dict[str, float]):
-    # Build vector following feature order from schema
-    vec = np.array([float(context.get(k, 0.0)) for k in FEATURE_ORDER], dtype=float)
+class DecideBatchReq(BaseModel):
+    items: List[DecideReq]
+
+class DecideBatchResp(BaseModel):
+    decisions: List[DecideResp]
+
+class ReportBatchReq(BaseModel):
+    items: List[ReportReq]
+
+def _unit(vec):
     # simple L2 normalization for stability
     norm = np.linalg.norm(vec)
     if norm > 0:
         vec = vec / (norm + 1e-9)
     return vec
 
+def _fold(seq):
+    # LinUCB keeps a dense dim x dim matrix per action, so the 2**18 hashed buckets do not
+    # reach the policy as sparse features: bucket i is summed into slot i % SEQ_DIMS, and
+    # unrelated n-grams that land on the same slot collide. Changing SEQ_DIMS changes the
+    # layout, so the model has to be retrained (checkpoints record it and refuse others).
+    # O(nnz); the full-width vector is never built
+    if not seq or not seq.get("indices"):
+        return np.zeros(SEQ_DIMS)
+    idx = np.asarray(seq["indices"], dtype=np.int64) % SEQ_DIMS
+    return np.bincount(idx, weights=np.asarray(seq["values"], dtype=float), minlength=SEQ_DIMS)
+
+def _stored_context(req: DecideReq):
+    # the sequence rides along in the logged context so /report can rebuild the same vector
+    if req.seq is None:
+        return req.context
+    return {**req.context, "_seq": {"indices": req.seq.indices, "values": req.seq.values}}
+
+def _to_vec(context: Dict[str, Any]):
+    # Build vector following feature order from schema
+    vec = _unit(np.array([float(context.get(k, 0.0)) for k in FEATURE_ORDER], dtype=float))
+    if SEQ_DIMS:
+        vec = np.concatenate([vec, _unit(_fold(context.get("_seq")))])
+    return vec
+
+def _score(vec):
+    with STAGE_SECONDS.time(stage="score"), ckpt.lock:
+        return policy.decide(vec)
+
+def _score_batch(X):
+    with STAGE_SECONDS.time(stage="score"), ckpt.lock:
+        return policy.decide_batch(X)
+
+def _apply(updates):
+    for action, vec, reward in updates:
+        with STAGE_SECONDS.time(stage="model_update"):
+            ckpt.update(action, vec, reward)
+        UPDATES.inc(action=action)
+        PENDING_REPORTS.dec()
+
+async def _find_decisions(ids):
+    # decisions past local retention; with Mongo down they are simply not found
+    try:
+        cur = decisions_col.find({"action_id": {"$in": ids}}, {"_id": 0, "action_id": 1, "action": 1, "context": 1})
+        return {d["action_id"]: d async for d in cur}
+    except PyMongoError as e:
+        print("[report] Mongo decision lookup failed:", e)
+        return {}
+
+async def _update(updates):
+    PENDING_REPORTS.inc(len(updates))
+    await asyncio.get_running_loop().run_in_executor(updater, _apply, updates)
+
 @app.post("/decide", response_model=DecideResp)
-def decide(req: DecideReq):
-    vec = _to_vec(req.context)
-    action, scores = policy.decide(vec)
+async def decide(req: DecideReq):
+    context = _stored_context(req)
+    with STAGE_SECONDS.time(stage="vectorize"):
+        vec = _to_vec(context)
+    # scored off the loop: ckpt.lock is also held by the updater and checkpoint threads
+    # across WAL writes, and waiting for it here would stall every request
+    action, scores = await asyncio.to_thread(_score, vec)
+    DECISIONS.inc(action=action)
     action_id = str(uuid.uuid4())
-    # save decision
-    decisions_col.insert_one({
+    # logged in the background; /report finds it in decision_log until it is written
+    await decision_log.add({
         "action_id": action_id,
         "session_id": req.session_id,
         "action": action,
-        "context": req.context,
+        "context": context,
         "scores": scores,
         "ts": datetime.utcnow()
     })
-    policy.save(MODEL_PATH)
-    # Also write a small file to controller/actions so other processes (forwarder) can read it
-    os.makedirs("controller/actions", exist_ok=True)
-    with open(f"controller/actions/{action_id}.json", "w") as fh:
-        json.dump({"action_id": action_id, "session_id": req.session_id, "action": action, "ts": datetime.utcnow().isoformat()}, fh)
     return {"action": action, "action_id": action_id}
 
 @app.post("/report")
-def report(r: ReportReq):
-    reports_col.insert_one({
+async def report(r: ReportReq):
+    await report_log.add({
         "action_id": r.action_id,
         "session_id": r.session_id,
         "reward": float(r.reward),
         "metadata": r.metadata,
         "ts": datetime.utcnow()
     })
-    # find the decision to get the context
-    dec = decisions_col.find_one({"action_id": r.action_id})
+    # find the decision to get the context (Mongo only for decisions past local retention)
+    with STAGE_SECONDS.time(stage="decision_lookup"):
+        dec = decision_log.get(r.action_id) or await asyncio.to_thread(actions.get, r.action_id)
+        if not dec:
+            dec = (await _find_decisions([r.action_id])).get(r.action_id)
     if not dec:
+        REPORTS_MISSING.inc()
         raise HTTPException(status_code=404, detail="action_id not found")
     action = dec["action"]
-    context = dec.get("context", {})
-    vec = _to_vec(context)
-    policy.update(action, vec, float(r.reward))
-    policy.save(MODEL_PATH)
+    with STAGE_SECONDS.time(stage="vectorize"):
+        vec = _to_vec(dec.get("context", {}))
+    await _update([(action, vec, float(r.reward))])
     return {"updated": True}
 
+@app.post("/decide/batch", response_model=DecideBatchResp)
+async def decide_batch(req: DecideBatchReq):
+    if not req.items:
+        return {"decisions": []}
+    contexts = [_stored_context(it) for it in req.items]
+    with STAGE_SECONDS.time(stage="vectorize"):
+        X = np.vstack([_to_vec(c) for c in contexts])
+    # like /decide, scored off the loop (the einsum and ckpt.lock both can take a while)
+    results = await asyncio.to_thread(_score_batch, X)
+    now = datetime.utcnow()
+    docs = []
+    out = []
+    for it, context, (action, scores) in zip(req.items, contexts, results):
+        action_id = str(uuid.uuid4())
+        docs.append({
+            "action_id": action_id,
+            "session_id": it.session_id,
+            "action": action,
+            "context": context,
+            "scores": scores,
+            "ts": now
+        })
+        out.append({"action": action, "action_id": action_id})
+        DECISIONS.inc(action=action)
+    await decision_log.add_many(docs)
+    return {"decisions": out}
+
+@app.post("/report/batch")
+async def report_batch(req: ReportBatchReq):
+    if not req.items:
+        return {"updated": 0, "missing": []}
+    now = datetime.utcnow()
+    await report_log.add_many([{
+        "action_id": r.action_id,
+        "session_id": r.session_id,
+        "reward": float(r.reward),
+        "metadata": r.metadata,
+        "ts": now
+    } for r in req.items])
+    # queued decisions first, then one indexed lookup locally, Mongo only for the rest
+    ids = list({r.action_id for r in req.items})
+    with STAGE_SECONDS.time(stage="decision_lookup"):
+        found = {i: d for i in ids if (d := decision_log.get(i))}
+        found.update(await asyncio.to_thread(actions.get_many, [i for i in ids if i not in found]))
+        rest = [i for i in ids if i not in found]
+        if rest:
+            found.update(await _find_decisions(rest))
+    updates = []
+    missing = []
+    with STAGE_SECONDS.time(stage="vectorize"):
+        for r in req.items:
+            dec = found.get(r.action_id)
+            if not dec:
+                missing.append(r.action_id)
+                continue
+            updates.append((dec["action"], _to_vec(dec.get("context", {})), float(r.reward)))
+    if missing:
+        REPORTS_MISSING.inc(len(missing))
+    await _update(updates)
+    return {"updated": len(updates), "missing": missing}
+
 @app.get("/health")
-def health():
-    return {"status": "ok", "policy_saved": os.path.exists(MODEL_PATH)}
+async def health():
+    return {"status": "ok", "policy_saved": os.path.exists(MODEL_PATH), "checkpoint": ckpt.status(),
+            "decision_log": decision_log.stats(), "report_log": report_log.stats()}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    for log in (decision_log, report_log):
+        metrics.QUEUE_DEPTH.set(len(log), log=log.name)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -3,35 +3,106 @@ import pickle
 from pathlib import Path
 
 class LinUCB:
+    # Per-action statistics are stacked into (K, d, d) / (K, d) arrays so every
+    # action is scored in one vectorized pass. A_inv and theta are cached and kept
+    # current with rank-one Sherman-Morrison updates, so nothing is inverted on
+    # the decide path.
+    REFRESH_EVERY = 1000   # exact re-inversion every N updates of an action, bounds float drift
+
     def __init__(self, actions, dim, alpha=0.8):
         self.actions = list(actions)
         self.dim = dim
         self.alpha = alpha
-        self.A = {a: np.eye(dim) for a in self.actions}
-        self.b = {a: np.zeros(dim) for a in self.actions}
+        K = len(self.actions)
+        self.index = {a: i for i, a in enumerate(self.actions)}
+        self.A = np.tile(np.eye(dim), (K, 1, 1))
+        self.b = np.zeros((K, dim))
+        self.A_inv = np.tile(np.eye(dim), (K, 1, 1))
+        self.theta = np.zeros((K, dim))
+        self.n_updates = np.zeros(K, dtype=np.int64)
 
     def _theta(self, a):
-        return np.linalg.inv(self.A[a]).dot(self.b[a])
+        return self.theta[self.index[a]]
 
     def score(self, context_vec):
-        res = {}
-        for a in self.actions:
-            Ainv = np.linalg.inv(self.A[a])
-            theta = Ainv.dot(self.b[a])
-            mean = float(np.dot(theta, context_vec))
-            s = float(np.sqrt(context_vec.dot(Ainv).dot(context_vec)))
-            ucb = mean + self.alpha * s
-            res[a] = {"ucb": ucb, "pred": mean}
-        return res
+        x = np.asarray(context_vec, dtype=float)
+        pred = self.theta.dot(x)
+        s = np.sqrt(np.maximum(self.A_inv.dot(x).dot(x), 0.0))
+        ucb = pred + self.alpha * s
+        return {a: {"ucb": float(ucb[k]), "pred": float(pred[k])} for k, a in enumerate(self.actions)}
 
     def decide(self, context_vec):
         scores = self.score(context_vec)
         best = max(scores.items(), key=lambda kv: kv[1]["ucb"])[0]
         return best, scores
 
+    def score_batch(self, X):
+        # X: (n, dim) contexts -> (n, K) ucb and pred arrays
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        pred = X.dot(self.theta.T)
+        quad = np.einsum("ni,kij,nj->nk", X, self.A_inv, X, optimize=True)
+        ucb = pred + self.alpha * np.sqrt(np.maximum(quad, 0.0))
+        return ucb, pred
+
+    def decide_batch(self, X):
+        ucb, pred = self.score_batch(X)
+        best = ucb.argmax(axis=1)
+        out = []
+        for i, j in enumerate(best):
+            scores = {a: {"ucb": float(ucb[i, k]), "pred": float(pred[i, k])} for k, a in enumerate(self.actions)}
+            out.append((self.actions[j], scores))
+        return out
+
     def update(self, action, context_vec, reward):
-        self.A[action] += np.outer(context_vec, context_vec)
-        self.b[action] += reward * context_vec
+        k = self.index[action]
+        x = np.asarray(context_vec, dtype=float)
+        self.A[k] += np.outer(x, x)
+        self.b[k] += reward * x
+        self.n_updates[k] += 1
+        if self.n_updates[k] % self.REFRESH_EVERY == 0:
+            self.A_inv[k] = np.linalg.inv(self.A[k])
+        else:
+            # (A + x x^T)^-1 = A^-1 - (A^-1 x)(A^-1 x)^T / (1 + x^T A^-1 x)
+            Ax = self.A_inv[k].dot(x)
+            self.A_inv[k] -= np.outer(Ax, Ax) / (1.0 + x.dot(Ax))
+        self.theta[k] = self.A_inv[k].dot(self.b[k])
+
+    def refresh(self):
+        self.A_inv = np.linalg.inv(self.A)
+        self.theta = np.einsum("kij,kj->ki", self.A_inv, self.b)
+
+    def __setstate__(self, state):
+        # upgrade pickles from the dict-of-matrices layout
+        if isinstance(state.get("A"), dict):
+            actions = state["actions"]
+            state["A"] = np.stack([state["A"][a] for a in actions])
+            state["b"] = np.stack([state["b"][a] for a in actions])
+            state["index"] = {a: i for i, a in enumerate(actions)}
+            state["n_updates"] = np.zeros(len(actions), dtype=np.int64)
+            self.__dict__.update(state)
+            self.refresh()
+        else:
+            self.__dict__.update(state)
+
+    def to_state(self):
+        # plain arrays only: the checkpoint format must not depend on pickle
+        return {
+            "actions": np.array(self.actions, dtype=str),
+            "dim": np.array(self.dim),
+            "alpha": np.array(self.alpha),
+            "A": self.A,
+            "b": self.b,
+            "n_updates": self.n_updates,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        p = cls([str(a) for a in state["actions"]], int(state["dim"]), alpha=float(state["alpha"]))
+        p.A = np.array(state["A"], dtype=float)
+        p.b = np.array(state["b"], dtype=float)
+        p.n_updates = np.array(state["n_updates"], dtype=np.int64)
+        p.refresh()
+        return p
 
     def save(self, path):
         p = Path(path)
@@ -43,4 +114,3 @@ class LinUCB:
     def load(path):
         with open(path, "rb") as f:
             return pickle.load(f)
-
@@ -0,0 +1,220 @@
+# controller/checkpoint.py
+# Asynchronous, atomic model checkpoints (.npz) plus a write-ahead log of updates.
+import os
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+
+from controller.bandit import LinUCB
+from controller.metrics import STAGE_SECONDS
+
+# v2 stores the feature layout the model was trained on
+FORMAT_VERSION = 2
+# context columns of every model saved without a layout (v1 checkpoints, legacy pickles,
+# shared state written before the layout was recorded)
+LEGACY_FEATURE_ORDER = ["duration", "cmd_count", "unique_cmds", "downloads", "reward", "dummy1", "dummy2", "dummy3"]
+
+
+def feature_layout(features_order, seq_dims=0):
+    """Short fingerprint of what each context dimension means: the schema's feature
+    order plus the folded sequence dims. Weights are only reusable under the same one."""
+    spec = json.dumps({"features": list(features_order), "seq_dims": int(seq_dims)}, separators=(",", ":"))
+    return hashlib.sha1(spec.encode()).hexdigest()[:16]
+
+
+def legacy_layout(dim):
+    return feature_layout(LEGACY_FEATURE_ORDER, dim - len(LEGACY_FEATURE_ORDER))
+
+
+def check_layout(found, expected, what):
+    if expected and found != expected:
+        raise ValueError(f"{what} was trained on another feature layout ({found}, this schema is {expected}); "
+                         f"its weights would be reused for different features. Move it aside to start a new model")
+
+
+def save_checkpoint(state, path, seq, features=None):
+    """Writes `state` (LinUCB.to_state()), the last applied WAL seq and the feature
+    layout atomically."""
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    extra = {"features": np.array(features)} if features else {}
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "wb") as fh:
+        np.savez_compressed(fh, format_version=np.array(FORMAT_VERSION), wal_seq=np.array(seq), **extra, **state)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path):
+    """Returns (policy, wal_seq, feature layout)."""
+    with np.load(path, allow_pickle=False) as z:
+        version = int(z["format_version"])
+        if version > FORMAT_VERSION:
+            raise ValueError(f"checkpoint {path} has format v{version}, this build reads up to v{FORMAT_VERSION}")
+        state = {k: z[k] for k in z.files}
+    policy = LinUCB.from_state(state)
+    features = str(state["features"]) if "features" in state else legacy_layout(policy.dim)
+    return policy, int(state["wal_seq"]), features
+
+
+class WriteAheadLog:
+    """Append-only JSON-lines log of (seq, action, context, reward).
+
+    `rotate()` starts a fresh segment and returns the sealed one; the sealed
+    segment is deleted once a checkpoint covering it is on disk.
+    """
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._fh = open(path, "a")
+
+    def segments(self):
+        return [p for p in (self.path + ".old", self.path) if os.path.exists(p)]
+
+    def replay(self, after_seq):
+        for seg in self.segments():
+            with open(seg, "r") as fh:
+                for line in fh:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        break   # torn final write from a crash
+                    if rec["seq"] > after_seq:
+                        yield rec
+
+    def append(self, rec):
+        self._fh.write(json.dumps(rec, separators=(",", ":")) + "\n")
+        self._fh.flush()
+        if self.fsync:
+            os.fsync(self._fh.fileno())
+
+    def rotate(self):
+        self._fh.close()
+        sealed = self.path + ".old"
+        if os.path.exists(sealed):
+            # previous checkpoint failed; keep both segments by appending
+            with open(sealed, "a") as out, open(self.path, "r") as cur:
+                out.write(cur.read())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, sealed)
+        self._fh = open(self.path, "a")
+        return sealed
+
+    def sync(self):
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def close(self):
+        self._fh.close()
+
+
+class Checkpointer:
+    """Owns the live policy: updates are logged to the WAL and applied under a lock,
+    and a background thread persists a checkpoint every `interval` seconds or
+    after `every_n` updates, whichever comes first, only when the model is dirty.
+    Nothing on the request path touches the checkpoint file.
+    """
+
+    def __init__(self, path, wal_path, make_policy, interval=30.0, every_n=500, wal_fsync=False,
+                 legacy_pickle=None, features=None):
+        self.path = path
+        self.features = features   # feature_layout() of the schema; a model from another is refused
+        self.interval = interval
+        self.every_n = every_n
+        self.lock = threading.RLock()
+        self._ckpt_lock = threading.Lock()   # one checkpoint write at a time
+        self.seq = 0
+        self.saved_seq = 0
+        self.last_save_ts = None
+        self.policy = self._load(make_policy, legacy_pickle)
+        self.wal = WriteAheadLog(wal_path, fsync=wal_fsync)
+        replayed = 0
+        for rec in self.wal.replay(self.seq):
+            self.policy.update(rec["a"], np.asarray(rec["x"], dtype=float), rec["r"])
+            self.seq = rec["seq"]
+            replayed += 1
+        if replayed:
+            print(f"[checkpoint] replayed {replayed} updates from WAL")
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="checkpointer", daemon=True)
+        self._thread.start()
+        if replayed or not os.path.exists(self.path):
+            self.checkpoint()
+
+    def _load(self, make_policy, legacy_pickle):
+        if os.path.exists(self.path):
+            policy, self.seq, features = load_checkpoint(self.path)
+            check_layout(features, self.features, f"checkpoint {self.path}")
+            self.saved_seq = self.seq
+            return policy
+        if legacy_pickle and os.path.exists(legacy_pickle):
+            print("[checkpoint] migrating legacy pickle", legacy_pickle)
+            policy = LinUCB.load(legacy_pickle)
+            check_layout(legacy_layout(policy.dim), self.features, f"legacy model {legacy_pickle}")
+            return policy
+        return make_policy()
+
+    @property
+    def dirty(self):
+        return self.seq != self.saved_seq
+
+    def update(self, action, vec, reward):
+        with self.lock:
+            seq = self.seq + 1
+            self.wal.append({"seq": seq, "a": action, "x": [float(v) for v in vec], "r": float(reward)})
+            self.policy.update(action, vec, reward)
+            self.seq = seq
+            if seq - self.saved_seq >= self.every_n:
+                self._wake.set()
+
+    def checkpoint(self):
+        with self._ckpt_lock:
+            with self.lock:
+                if not self.dirty and os.path.exists(self.path):
+                    return False
+                seq = self.seq
+                state = {k: np.copy(v) for k, v in self.policy.to_state().items()}
+                sealed = self.wal.rotate()
+            # serialization and disk I/O happen outside the model lock
+            with STAGE_SECONDS.time(stage="model_save"):
+                save_checkpoint(state, self.path, seq, self.features)
+            os.remove(sealed)
+            with self.lock:
+                self.saved_seq = seq
+                self.last_save_ts = time.time()
+            return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                if self.dirty:
+                    self.checkpoint()
+                else:
+                    with self.lock:
+                        self.wal.sync()
+            except Exception as e:
+                print("[checkpoint] failed:", e)
+
+    def status(self):
+        with self.lock:
+            return {"seq": self.seq, "saved_seq": self.saved_seq, "dirty": self.dirty,
+                    "last_save_ts": self.last_save_ts}
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(10)
+        self.checkpoint()
+        self.wal.close()
@@ -0,0 +1,149 @@
+# controller/decision_log.py
+# asyncio write-behind for the controller's Mongo writes, so /decide and /report answer
+# without waiting for Mongo.
+import time
+import asyncio
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from controller.metrics import STAGE_SECONDS, LOG_FAILED
+
+
+class AsyncBulkInserter:
+    """Queues documents and inserts them with unordered insert_many from one background
+    task, in batches of up to `batch_size` or whatever arrived within `flush_interval`.
+    The queue is bounded: add() waits once `max_queue` documents are pending, which
+    slows callers down instead of growing memory when Mongo is slow."""
+
+    def __init__(self, collection, name, batch_size=500, flush_interval=0.05, max_queue=50000, max_retries=5):
+        self.collection = collection
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._task = None
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(), name=f"insert:{self.name}")
+
+    async def add(self, doc):
+        await self._queue.put(doc)
+
+    async def add_many(self, docs):
+        for d in docs:
+            await self._queue.put(d)
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._write(batch)
+            except Exception as e:
+                # e.g. InvalidDocument; the batch is lost, the writer must keep draining
+                # or add() and close() would wait on a queue nobody empties
+                print(f"[{self.name}] dropping batch of {len(batch)}:", repr(e))
+                self.failed += len(batch)
+                LOG_FAILED.inc(len(batch), log=self.name)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write(self, batch):
+        t0 = time.monotonic()
+        for attempt in range(self.max_retries):
+            try:
+                await self.collection.insert_many(batch, ordered=False)
+                self.written += len(batch)
+                break
+            except BulkWriteError as e:
+                # duplicates from a retried batch are fine; anything else is counted as lost
+                errs = [w for w in e.details.get("writeErrors", []) if w.get("code") != 11000]
+                self.written += len(batch) - len(errs)
+                self.failed += len(errs)
+                LOG_FAILED.inc(len(errs), log=self.name)
+                break
+            except PyMongoError as e:
+                print(f"[{self.name}] insert failed (attempt {attempt + 1}):", e)
+                await asyncio.sleep(min(0.2 * 2 ** attempt, 5.0))
+        else:
+            self.failed += len(batch)
+            LOG_FAILED.inc(len(batch), log=self.name)
+        self.flushes += 1
+        self.last_flush_ms = (time.monotonic() - t0) * 1000
+        STAGE_SECONDS.observe(self.last_flush_ms / 1000, stage="mongo_insert")
+
+    async def drain(self):
+        await self._queue.join()
+
+    async def close(self):
+        await self.drain()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        return {"queue_depth": len(self), "written": self.written, "failed": self.failed,
+                "flushes": self.flushes, "last_flush_ms": round(self.last_flush_ms, 2)}
+
+
+class DecisionLog(AsyncBulkInserter):
+    """Decisions are written to the local ActionStore (in a worker thread) and then to
+    Mongo. Until the ActionStore write has landed, get() serves them from memory, so
+    a /report that arrives right after its /decide still finds the decision."""
+
+    def __init__(self, collection, actions, **kw):
+        super().__init__(collection, "decisions", **kw)
+        self.actions = actions
+        self._pending = {}
+
+    async def add(self, doc):
+        self._pending[doc["action_id"]] = doc
+        await super().add(doc)
+
+    async def add_many(self, docs):
+        for d in docs:
+            self._pending[d["action_id"]] = d
+        await super().add_many(docs)
+
+    def get(self, action_id):
+        return self._pending.get(action_id)
+
+    async def _write(self, batch):
+        try:
+            try:
+                t0 = time.perf_counter()
+                await asyncio.to_thread(self.actions.put_many,
+                                        [(d["action_id"], d["session_id"], d["action"], d["context"], None) for d in batch])
+                STAGE_SECONDS.observe(time.perf_counter() - t0, stage="action_write")
+            except Exception as e:
+                print("[decisions] action store write failed:", e)
+            await super()._write(batch)
+        finally:
+            for d in batch:
+                self._pending.pop(d["action_id"], None)
+
+    def stats(self):
+        s = super().stats()
+        s["pending_lookup"] = len(self._pending)
+        return s
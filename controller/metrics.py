@@ -0,0 +1,141 @@
+# controller/metrics.py
+# Minimal Prometheus metrics (text exposition format 0.0.4), enough for /metrics without
+# pulling in prometheus_client. Metrics are updated from the event loop and from the
+# updater / checkpoint threads, so every metric has its own lock.
+import time
+import threading
+from contextlib import contextmanager
+
+# seconds; fine at the bottom because most stages are sub-millisecond
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+REGISTRY = []
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _num(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {} if self.labelnames or self.kind == "histogram" else {(): 0}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            lines.extend(self._lines(key, v))
+        return lines
+
+    def _lines(self, key, v):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_num(v)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        k = self._key(labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        k = self._key(labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        k = self._key(labels)
+        with self._lock:
+            h = self._values.get(k)
+            if h is None:
+                h = self._values[k] = [[0] * len(self.buckets), 0.0, 0]
+            for i, le in enumerate(self.buckets):
+                if value <= le:
+                    h[0][i] += 1
+                    break
+            h[1] += value
+            h[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def _lines(self, key, h):
+        counts, total, n = h
+        out = []
+        cum = 0
+        for le, c in zip(self.buckets, counts):
+            cum += c
+            out.append(f"{self.name}_bucket{_labels(self.labelnames, key, {'le': _num(float(le))})} {cum}")
+        out.append(f"{self.name}_bucket{_labels(self.labelnames, key, {'le': '+Inf'})} {n}")
+        out.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_num(total)}")
+        out.append(f"{self.name}_count{_labels(self.labelnames, key)} {n}")
+        return out
+
+
+def render():
+    lines = []
+    for m in REGISTRY:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+# Controller metrics, shared by app.py, decision_log.py and the model stores
+REQUEST_SECONDS = Histogram("controller_request_seconds", "End-to-end request latency by route", ["route"])
+STAGE_SECONDS = Histogram("controller_stage_seconds",
+                          "Time per processing stage: vectorize, score, decision_lookup, model_update, "
+                          "model_save, action_write, mongo_insert", ["stage"])
+DECISIONS = Counter("controller_decisions_total", "Decisions made, by chosen action", ["action"])
+UPDATES = Counter("controller_model_updates_total", "Rewards applied to the model, by action", ["action"])
+REPORTS_MISSING = Counter("controller_reports_missing_total", "Reports whose action_id was not found")
+PENDING_REPORTS = Gauge("controller_pending_reports", "Reports received but not yet applied to the model")
+QUEUE_DEPTH = Gauge("controller_log_queue_depth", "Documents waiting for the background Mongo insert", ["log"])
+LOG_FAILED = Counter("controller_log_failed_total", "Documents the background insert gave up on", ["log"])
@@ -0,0 +1,69 @@
+# controller/profiling.py
+# Opt-in per-request profiling. PROFILE=cprofile|pyinstrument profiles a random
+# PROFILE_RATE share of requests and writes one file per profiled request to PROFILE_DIR
+# (.prof for cProfile, open with snakeviz / pstats; .html for pyinstrument).
+# Only one request is profiled at a time: on the event loop a profiler sees every
+# coroutine that runs meanwhile, and cProfile refuses a second active profiler anyway.
+import os
+import time
+import random
+import cProfile
+from contextlib import contextmanager
+
+PROFILE = os.environ.get("PROFILE", "").lower()   # "", "cprofile" or "pyinstrument"
+PROFILE_RATE = float(os.environ.get("PROFILE_RATE", "0.01"))   # share of requests profiled
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "controller/profiles")
+
+try:
+    from pyinstrument import Profiler as _Pyinstrument
+except ImportError:   # optional
+    _Pyinstrument = None
+
+
+class RequestProfiler:
+    def __init__(self, mode=PROFILE, rate=PROFILE_RATE, out_dir=PROFILE_DIR):
+        if mode == "pyinstrument" and _Pyinstrument is None:
+            print("[profile] pyinstrument is not installed; falling back to cProfile")
+            mode = "cprofile"
+        if mode not in ("", "cprofile", "pyinstrument"):
+            raise ValueError(f"PROFILE must be cprofile or pyinstrument, got {mode!r}")
+        self.mode = mode
+        self.rate = rate
+        self.out_dir = out_dir
+        self._busy = False
+        self.written = 0
+        if mode:
+            os.makedirs(out_dir, exist_ok=True)
+            print(f"[profile] {mode} on {rate:.1%} of requests -> {out_dir}")
+
+    def _path(self, name, ext):
+        slug = name.strip("/").replace("/", "_") or "root"
+        return os.path.join(self.out_dir, f"{int(time.time() * 1000)}-{slug}.{ext}")
+
+    @contextmanager
+    def maybe(self, name):
+        if not self.mode or self._busy or random.random() >= self.rate:
+            yield
+            return
+        self._busy = True
+        try:
+            if self.mode == "pyinstrument":
+                prof = _Pyinstrument(async_mode="enabled")
+                prof.start()
+                try:
+                    yield
+                finally:
+                    prof.stop()
+                    with open(self._path(name, "html"), "w") as fh:
+                        fh.write(prof.output_html())
+            else:
+                prof = cProfile.Profile()
+                prof.enable()
+                try:
+                    yield
+                finally:
+                    prof.disable()
+                    prof.dump_stats(self._path(name, "prof"))
+            self.written += 1
+        finally:
+            self._busy = False
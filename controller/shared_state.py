@@ -0,0 +1,265 @@
+# controller/shared_state.py
+# Shared LinUCB statistics for running several controller workers or replicas.
+# A and b are sums over updates, so each worker only has to add what it learned since
+# its last sync (delta A, delta b per action) to a shared total and load the total back.
+# Run: python -m controller.shared_state seed controller/linucb.npz   (once, to start from a local model)
+#      python -m controller.shared_state show
+import os
+import time
+import fcntl
+import argparse
+import threading
+import numpy as np
+from pymongo import MongoClient
+
+from controller.metrics import STAGE_SECONDS
+from controller.checkpoint import legacy_layout, check_layout
+
+SHARED_STATE = os.environ.get("SHARED_STATE", "")   # "", "file:<path.npz>" or "mongo"
+SHARED_MODEL_KEY = os.environ.get("SHARED_MODEL_KEY", "linucb")   # one shared model per key
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
+
+
+def _totals(actions, dim):
+    K = len(actions)
+    return {"A": np.zeros((K, dim, dim)), "b": np.zeros((K, dim)), "n": np.zeros(K, dtype=np.int64)}
+
+
+class FileStateStore:
+    """Totals in one .npz next to a lock file; merge() is a locked read-add-write, so it
+    works for uvicorn workers on one host or replicas sharing a POSIX filesystem."""
+
+    def __init__(self, path, features=None):
+        self.path = path
+        self.features = features   # feature layout this process uses; None skips the check
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+
+    def __str__(self):
+        return f"file:{self.path}"
+
+    def _read(self, actions, dim):
+        if not os.path.exists(self.path):
+            return _totals(actions, dim)
+        with np.load(self.path, allow_pickle=False) as z:
+            if [str(a) for a in z["actions"]] != list(actions) or int(z["dim"]) != dim:
+                raise ValueError(f"{self.path} holds a model for other actions or dim {int(z['dim'])}")
+            found = str(z["features"]) if "features" in z.files else legacy_layout(dim)
+            check_layout(found, self.features, f"shared model {self.path}")
+            return {"A": z["A"], "b": z["b"], "n": z["n"]}
+
+    def load(self, actions, dim):
+        with open(self.path + ".lock", "a") as lk:
+            fcntl.flock(lk, fcntl.LOCK_SH)
+            return self._read(actions, dim)
+
+    def merge(self, delta, actions, dim):
+        with open(self.path + ".lock", "a") as lk:
+            fcntl.flock(lk, fcntl.LOCK_EX)
+            tot = self._read(actions, dim)
+            tot = {k: tot[k] + delta[k] for k in tot}
+            tmp = f"{self.path}.tmp-{os.getpid()}"
+            with open(tmp, "wb") as fh:
+                extra = {"features": np.array(self.features)} if self.features else {}
+                np.savez(fh, actions=np.array(actions, dtype=str), dim=np.array(dim), **extra, **tot)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp, self.path)
+            return tot
+
+    def counts(self):
+        if not os.path.exists(self.path):
+            return {}
+        with np.load(self.path, allow_pickle=False) as z:
+            return {str(a): int(n) for a, n in zip(z["actions"], z["n"])}
+
+
+class MongoStateStore:
+    """One document per action holding flattened totals; a merge is one $inc per
+    action document, which Mongo applies atomically, so any number of replicas can
+    merge concurrently without a lock."""
+
+    def __init__(self, collection, key=SHARED_MODEL_KEY, features=None):
+        self.col = collection
+        self.key = key
+        self.features = features
+
+    def __str__(self):
+        return f"mongo:{self.col.full_name}/{self.key}"
+
+    def _unpack(self, doc, dim, tot, k):
+        if doc.get("dim", dim) != dim:
+            raise ValueError(f"shared model {self.key} has dim {doc['dim']}, expected {dim}")
+        check_layout(doc.get("features") or legacy_layout(dim), self.features, f"shared model {self.key}")
+        A = doc.get("A", {})
+        b = doc.get("b", {})
+        tot["A"][k] = np.array([A.get(str(i), 0.0) for i in range(dim * dim)]).reshape(dim, dim)
+        tot["b"][k] = np.array([b.get(str(i), 0.0) for i in range(dim)])
+        tot["n"][k] = doc.get("n", 0)
+
+    def load(self, actions, dim):
+        tot = _totals(actions, dim)
+        index = {a: k for k, a in enumerate(actions)}
+        for doc in self.col.find({"model": self.key}):
+            if doc["action"] in index:
+                self._unpack(doc, dim, tot, index[doc["action"]])
+        return tot
+
+    def merge(self, delta, actions, dim):
+        # refuse to add to totals learned on another layout
+        self.load(actions, dim)
+        meta = {"model": self.key, "dim": dim}
+        if self.features:
+            meta["features"] = self.features
+        for k, a in enumerate(actions):
+            inc = {f"A.{i}": float(v) for i, v in enumerate(delta["A"][k].ravel()) if v}
+            inc.update({f"b.{i}": float(v) for i, v in enumerate(delta["b"][k]) if v})
+            # n can be 0 with real A / b (models upgraded from legacy pickles have no
+            # update count), so only an all-zero delta is skipped, as in FileStateStore
+            if not inc and not delta["n"][k]:
+                continue
+            inc["n"] = int(delta["n"][k])
+            self.col.update_one({"_id": f"{self.key}:{a}"},
+                                {"$inc": inc, "$set": {**meta, "action": a}}, upsert=True)
+        # totals of the other actions moved too (other workers), so read them all back
+        return self.load(actions, dim)
+
+    def counts(self):
+        return {d["action"]: d.get("n", 0) for d in self.col.find({"model": self.key}, {"action": 1, "n": 1})}
+
+
+def open_store(spec=SHARED_STATE, mongo_uri=MONGO_URI, features=None):
+    if spec.startswith("file:"):
+        return FileStateStore(spec[len("file:"):], features=features)
+    if spec == "mongo":
+        return MongoStateStore(MongoClient(mongo_uri)["controller_db"]["bandit_state"], features=features)
+    raise ValueError(f"SHARED_STATE must be 'file:<path>' or 'mongo', got {spec!r}")
+
+
+class SharedModel:
+    """Stands in for Checkpointer when the model is shared: same lock / policy /
+    update() / status() / close(). Updates apply to the local policy at once and are
+    summed into a pending delta; every `interval` seconds or `every_n` updates the
+    delta is merged into the store and the policy is rebuilt from the merged totals
+    plus whatever arrived while the merge was in flight. A crash loses at most the
+    unmerged delta of that worker."""
+
+    def __init__(self, store, make_policy, interval=5.0, every_n=200):
+        self.store = store
+        self.interval = interval
+        self.every_n = every_n
+        self.lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self.policy = make_policy()
+        self.actions = list(self.policy.actions)
+        self.dim = self.policy.dim
+        self._prior_A = self.policy.A.copy()
+        self._prior_b = self.policy.b.copy()
+        self._delta = _totals(self.actions, self.dim)
+        self.syncs = 0
+        self.last_sync_ts = None
+        self.last_sync_ms = 0.0
+        self._apply(self.store.load(self.actions, self.dim))
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="shared-sync", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self):
+        return int(self._delta["n"].sum())
+
+    def update(self, action, vec, reward):
+        k = self.policy.index[action]
+        x = np.asarray(vec, dtype=float)
+        with self.lock:
+            self.policy.update(action, x, reward)
+            self._delta["A"][k] += np.outer(x, x)
+            self._delta["b"][k] += reward * x
+            self._delta["n"][k] += 1
+            if self.pending >= self.every_n:
+                self._wake.set()
+
+    def _apply(self, tot):
+        # caller holds self.lock or runs before the policy is shared
+        p = self.policy
+        p.A = self._prior_A + tot["A"] + self._delta["A"]
+        p.b = self._prior_b + tot["b"] + self._delta["b"]
+        p.n_updates = np.asarray(tot["n"] + self._delta["n"], dtype=np.int64)
+        p.refresh()
+
+    def sync(self):
+        with self._sync_lock:
+            t0 = time.monotonic()
+            with self.lock:
+                delta = self._delta
+                self._delta = _totals(self.actions, self.dim)
+            try:
+                # store I/O happens outside the model lock; decides keep the current model
+                if delta["n"].any():
+                    tot = self.store.merge(delta, self.actions, self.dim)
+                else:
+                    tot = self.store.load(self.actions, self.dim)
+            except Exception:
+                with self.lock:
+                    for k in delta:
+                        self._delta[k] += delta[k]
+                raise
+            with self.lock:
+                self._apply(tot)
+                self.syncs += 1
+                self.last_sync_ts = time.time()
+                self.last_sync_ms = (time.monotonic() - t0) * 1000
+            STAGE_SECONDS.observe(self.last_sync_ms / 1000, stage="model_save")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                # runs even with nothing pending, to pick up the other workers' updates
+                self.sync()
+            except Exception as e:
+                print("[shared] sync failed:", e)
+
+    def status(self):
+        with self.lock:
+            return {"store": str(self.store), "pending": self.pending, "syncs": self.syncs,
+                    "last_sync_ts": self.last_sync_ts, "last_sync_ms": round(self.last_sync_ms, 2)}
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(10)
+        try:
+            self.sync()
+        except Exception as e:
+            print("[shared] final sync failed, losing", self.pending, "updates:", e)
+
+
+def main(argv=None):
+    from controller.checkpoint import load_checkpoint
+
+    ap = argparse.ArgumentParser(description="Shared bandit state")
+    ap.add_argument("--state", default=SHARED_STATE or "mongo", help="file:<path> or mongo")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("seed", help="add a local checkpoint's learned statistics to the shared model")
+    p.add_argument("checkpoint")
+    sub.add_parser("show")
+    args = ap.parse_args(argv)
+    store = open_store(args.state)
+
+    if args.cmd == "seed":
+        policy, _, store.features = load_checkpoint(args.checkpoint)
+        K, d = len(policy.actions), policy.dim
+        # the identity prior is added by every worker, so only what was learned is shared
+        delta = {"A": policy.A - np.tile(np.eye(d), (K, 1, 1)), "b": policy.b, "n": policy.n_updates}
+        store.merge(delta, policy.actions, d)
+        print(f"Seeded {store} with {int(policy.n_updates.sum())} updates from {args.checkpoint}")
+    else:
+        for a, n in store.counts().items():
+            print(f"{a:24s} {int(n)} updates")
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,66 @@
 import pandas as pd
 import requests
 import os
-import time
+import sys
 
-API_DECIDE = os.environ.get("API_DECIDE", "http://localhost:9000/decide")
-API_REPORT = os.environ.get("API_REPORT", "http://localhost:9000/report")
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.feature_store import read_any, read_sparse, model_features, exists
 
-# path to your features CSV (ensure it exists)
-DATA = os.path.join(os.getcwd(), "..", "notebooks", "features_agg.csv")
-if not os.path.exists(DATA):
-    raise SystemExit("features_agg.csv not found at " + DATA)
+API_DECIDE = os.environ.get("API_DECIDE", "http://localhost:9000/decide/batch")
+API_REPORT = os.environ.get("API_REPORT", "http://localhost:9000/report/batch")
+BATCH = int(os.environ.get("REPLAY_BATCH", "256"))   # rows per decide/report round trip
 
-df = pd.read_csv(DATA)
+# feature store table (or a CSV path) with one row per session and its reward
+DATA = os.environ.get("REPLAY_FEATURES", "features_agg")
 
 # choose the context keys to send - must match feature_schema.json order
-keys = ["duration","cmd_count","unique_cmds","downloads","reward","dummy1","dummy2","dummy3"]
+keys = model_features()
 
-for idx, row in df.iterrows():
-    session_id = str(row.get("session_id", f"s{idx}"))
-    context = {k: float(row.get(k, 0.0)) if k in row else 0.0 for k in keys}
-    # call decide
-    r = requests.post(API_DECIDE, json={"session_id": session_id, "context": context})
+# only the id and context columns are read (plus the sparse command sequence if the table has it)
+X_seq = None
+if exists(DATA):
+    df, X_seq = read_sparse(DATA, "seq", columns=["session_id"] + keys)
+else:
+    df = read_any(DATA, columns=["session_id"] + keys)
+if df.empty:
+    raise SystemExit("no feature rows found in " + DATA)
+# tables extracted before a schema column existed (e.g. ioc_count, cmd_gap_*) have no values
+# for it; replaying them as 0.0 would train the model on a feature it never saw
+absent = {k: int(n) for k, n in df.reindex(columns=keys).isna().sum().items() if n}
+if absent:
+    raise SystemExit(f"{DATA} lacks schema columns (rows without a value: {absent}); "
+                     "regenerate it with notebooks/feature_extractor.py before replaying")
+
+def seq_of(i):
+    if X_seq is None:
+        return None
+    row = X_seq[i]
+    return {"indices": row.indices.tolist(), "values": row.data.tolist()}
+
+# vectorized context extraction instead of iterrows()
+ctx_df = df.reindex(columns=keys).apply(pd.to_numeric, errors="coerce").fillna(0.0).astype(float)
+contexts = ctx_df.to_dict(orient="records")
+session_ids = df["session_id"].astype(str).tolist() if "session_id" in df.columns else [f"s{i}" for i in range(len(df))]
+rewards = ctx_df["reward"].tolist()
+
+http = requests.Session()
+for start in range(0, len(df), BATCH):
+    idx = range(start, min(start + BATCH, len(df)))
+    # call decide for the whole chunk
+    r = http.post(API_DECIDE, json={"items": [{"session_id": session_ids[i], "context": contexts[i], "seq": seq_of(i)}
+                                              for i in idx]})
     if r.status_code != 200:
         print("decide failed:", r.status_code, r.text)
         continue
-    resp = r.json()
-    action_id = resp["action_id"]
-    # compute reward from data (if present)
-    reward = float(row.get("reward", 0.0))
-    # report the reward
-    rr = requests.post(API_REPORT, json={"action_id": action_id, "session_id": session_id, "reward": reward, "metadata": {"idx": idx}})
+    decisions = r.json()["decisions"]
+    # report the rewards (from data) for the same chunk
+    rr = http.post(API_REPORT, json={"items": [
+        {"action_id": d["action_id"], "session_id": session_ids[i], "reward": rewards[i], "metadata": {"idx": i}}
+        for i, d in zip(idx, decisions)
+    ]})
     if rr.status_code != 200:
         print("report failed:", rr.status_code, rr.text)
-    # throttle a little
-    time.sleep(0.01)
+    else:
+        print(f"rows {idx.start}-{idx.stop - 1}: updated={rr.json().get('updated')}")
 
 print("Replay complete")
-
@@ -0,0 +1,284 @@
+# infra/forwarder/controller_client.py
+# Non-blocking client for the controller's /decide and /report endpoints.
+import os
+import time
+import json
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_ACTION = "default"
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; after `reset_timeout` seconds
+    lets a single probe request through (half-open) and closes again on success."""
+
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            st = self.state
+            if st == "closed":
+                return True
+            if st == "half-open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    print(f"[controller] circuit open after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+
+class ReportQueue:
+    """Durable FIFO of pending /report payloads in a small SQLite file, so rewards
+    survive controller outages and forwarder restarts."""
+
+    def __init__(self, path):
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS reports (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "payload TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0)")
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def put(self, payload):
+        with self._lock:
+            self._db.execute("INSERT INTO reports (payload) VALUES (?)", (json.dumps(payload),))
+        self._wake.set()
+
+    def peek(self, n):
+        with self._lock:
+            rows = self._db.execute("SELECT id, payload, attempts FROM reports ORDER BY id LIMIT ?", (n,)).fetchall()
+        return [(rid, json.loads(p), attempts) for rid, p, attempts in rows]
+
+    def ack(self, rid):
+        with self._lock:
+            self._db.execute("DELETE FROM reports WHERE id = ?", (rid,))
+
+    def nack(self, rid):
+        with self._lock:
+            self._db.execute("UPDATE reports SET attempts = attempts + 1 WHERE id = ?", (rid,))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+
+    def wait(self, timeout):
+        self._wake.wait(timeout)
+        self._wake.clear()
+
+
+class ControllerClient:
+    """Issues /decide calls on a thread pool with pooled keep-alive connections.
+
+    `decide(session_id, context)` returns a Future immediately; concurrent calls
+    for the same session share one in-flight request. While the circuit is open
+    the Future resolves at once to a local default action (marked `local`).
+    Reports go through a durable queue drained by a background thread that
+    posts them to /report/batch and retries with backoff until the controller
+    accepts them.
+    """
+
+    def __init__(self, base_url, report_queue_path, workers=8, timeout=5.0,
+                 breaker=None, max_report_attempts=20, report_batch_size=100):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.max_report_attempts = max_report_attempts
+        self.report_batch_size = report_batch_size
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="controller")
+        self._local = threading.local()
+        self._pool_size = workers
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self.reports = ReportQueue(report_queue_path)
+        self._stop = threading.Event()
+        self._reporter = threading.Thread(target=self._drain_reports, name="controller-reports", daemon=True)
+        self._reporter.start()
+
+    def _http(self):
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            self._local.session = s
+        return s
+
+    @staticmethod
+    def local_decision(session_id):
+        return {"action": DEFAULT_ACTION, "action_id": session_id, "local": True}
+
+    # ----- decide -----
+    def decide(self, session_id, context, seq=None, fragment=0):
+        # a reopened session (fragment > 0) gets its own decision, not the earlier piece's
+        key = (session_id, fragment)
+        with self._inflight_lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                return fut
+            if not self.breaker.allow():
+                fut = Future()
+                fut.set_result(self.local_decision(session_id))
+                return fut
+            fut = self._pool.submit(self._decide, session_id, context, seq)
+            self._inflight[key] = fut
+        fut.add_done_callback(lambda _f: self._forget(key))
+        return fut
+
+    def _forget(self, key):
+        with self._inflight_lock:
+            self._inflight.pop(key, None)
+
+    def _decide(self, session_id, context, seq=None):
+        payload = {"session_id": session_id, "context": context}
+        if seq:
+            payload["seq"] = seq
+        try:
+            resp = self._http().post(f"{self.base_url}/decide", json=payload,
+                                     timeout=self.timeout)
+            resp.raise_for_status()
+            decision = resp.json()
+            self.breaker.success()
+            return decision
+        except Exception as e:
+            self.breaker.failure()
+            print("Controller error (decide):", e)
+            return self.local_decision(session_id)
+
+    # ----- report -----
+    def report(self, action_id, session_id, reward, metadata=None):
+        payload = {"action_id": action_id, "session_id": session_id, "reward": float(reward)}
+        if metadata:
+            payload["metadata"] = metadata
+        self.reports.put(payload)
+
+    def _post_report(self, payload):
+        """True when done with the payload (accepted or permanently rejected)."""
+        try:
+            resp = self._http().post(f"{self.base_url}/report", json=payload, timeout=self.timeout)
+        except Exception as e:
+            self.breaker.failure()
+            print("Controller error (report):", e)
+            return False
+        if resp.status_code >= 500:
+            self.breaker.failure()
+            return False
+        self.breaker.success()
+        if resp.status_code >= 400:
+            print(f"[controller] report rejected ({resp.status_code}) for session={payload['session_id']}: {resp.text[:200]}")
+        else:
+            print(f"[controller] reported reward={payload['reward']} for session={payload['session_id']}")
+        return True
+
+    def _post_report_batch(self, payloads):
+        """True/False like _post_report for the whole batch; None if the controller
+        has no /report/batch endpoint."""
+        try:
+            resp = self._http().post(f"{self.base_url}/report/batch", json={"items": payloads}, timeout=self.timeout)
+        except Exception as e:
+            self.breaker.failure()
+            print("Controller error (report batch):", e)
+            return False
+        if resp.status_code in (404, 405):
+            # the controller answered (it just predates /report/batch); this may have been
+            # the half-open probe, so resolve it or the breaker stays short-circuited
+            self.breaker.success()
+            return None
+        if resp.status_code >= 500:
+            self.breaker.failure()
+            return False
+        self.breaker.success()
+        if resp.status_code >= 400:
+            print(f"[controller] report batch rejected ({resp.status_code}): {resp.text[:200]}")
+            return True
+        missing = resp.json().get("missing") or []
+        if missing:
+            print(f"[controller] {len(missing)} reports referenced unknown action_ids, dropped")
+        print(f"[controller] reported {len(payloads)} rewards")
+        return True
+
+    def _drain_reports(self):
+        backoff = 0.5
+        batch_endpoint = True
+        while not self._stop.is_set():
+            batch = self.reports.peek(self.report_batch_size) if self.breaker.state != "open" else []
+            if not batch:
+                self.reports.wait(1.0 if not len(self.reports) else backoff)
+                continue
+            if not self.breaker.allow():
+                self._stop.wait(backoff)
+                continue
+            if batch_endpoint:
+                ok = self._post_report_batch([p for _, p, _ in batch])
+                if ok is None:
+                    print("[controller] /report/batch not available, falling back to single reports")
+                    batch_endpoint = False
+                    continue
+                results = [(rid, p, attempts, ok) for rid, p, attempts in batch]
+            else:
+                rid, p, attempts = batch[0]
+                results = [(rid, p, attempts, self._post_report(p))]
+            progressed = False
+            for rid, payload, attempts, ok in results:
+                if ok:
+                    self.reports.ack(rid)
+                    progressed = True
+                elif attempts + 1 >= self.max_report_attempts:
+                    print(f"[controller] dropping report for session={payload['session_id']} after {attempts + 1} attempts")
+                    self.reports.ack(rid)
+                else:
+                    self.reports.nack(rid)
+            if progressed:
+                backoff = 0.5
+            else:
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    def stats(self):
+        with self._inflight_lock:
+            inflight = len(self._inflight)
+        return {"inflight_decides": inflight, "pending_reports": len(self.reports),
+                "circuit": self.breaker.state, "failures": self.breaker.failures}
+
+    def close(self, timeout=10):
+        self._pool.shutdown(wait=True)
+        # give queued reports a last chance to go out; whatever remains stays on disk
+        end = time.monotonic() + timeout
+        while len(self.reports) and time.monotonic() < end and self.breaker.state != "open":
+            time.sleep(0.1)
+        self._stop.set()
+        self._reporter.join(timeout)
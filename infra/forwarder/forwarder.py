@@ -1,26 +1,34 @@
 #!/usr/bin/env python3
-import geoip2.database
 import os
+import sys
 import time
+import signal
 import json
+import threading
 import traceback
-from collections import defaultdict
 from pymongo import MongoClient
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from dateutil import parser as dateparser
-import requests
-from bson import json_util
+
+# the shared `common` package lives at the repo root (copied next to this file in the image)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.indicators import get_matcher
+from common.mongo_indexes import bootstrap_indexes
+from common.timestamps import parse_ts
+from common.session_features import SessionFeatures
+from common.geo import get_locator
+from common.map_cells import CellRollup, CELLS_COLLECTION
+from common.rollups import SessionRollup, ROLLUPS_COLLECTION
+from tailer import LogTailer, OffsetStore
+from mongo_writer import BulkWriter
+from controller_client import ControllerClient
+from session_store import SessionStore
 
 # ----- Config -----
 CONTROLLER_URL = os.getenv("CONTROLLER_URL", "http://host.docker.internal:9000")
 # MONGO selection helper will try env, then localhost, then docker hostname 'mongo'
 _MONGO_ENV = os.getenv("MONGO_URI", None)
-GEOIP_DB = "data/GeoLite2-City.mmdb"
-geo_reader = None
 
-if os.path.exists(GEOIP_DB):
-    geo_reader = geoip2.database.Reader(GEOIP_DB)
 def _pick_mongo_uri():
     candidates = []
     if _MONGO_ENV:
@@ -38,6 +46,17 @@ def _pick_mongo_uri():
 
 MONGO_URI = _pick_mongo_uri()
 LOG_DIR = os.getenv("LOG_DIR", "/cowrie/log")   # where Cowrie writes json logs
+OFFSETS_PATH = os.getenv("OFFSETS_PATH", "state/offsets.json")   # persisted per-file read offsets
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "500"))
+BULK_FLUSH_INTERVAL = float(os.getenv("BULK_FLUSH_INTERVAL", "1.0"))   # seconds
+BULK_MAX_QUEUE = int(os.getenv("BULK_MAX_QUEUE", "20000"))   # add() blocks beyond this
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", "60"))
+CONTROLLER_WORKERS = int(os.getenv("CONTROLLER_WORKERS", "8"))
+CONTROLLER_TIMEOUT = float(os.getenv("CONTROLLER_TIMEOUT", "5"))
+REPORT_QUEUE_PATH = os.getenv("REPORT_QUEUE_PATH", "state/reports.db")   # durable pending /report calls
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "600"))   # finalize after this much silence
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "50000"))   # hard ceiling, least recently active evicted first
+ROLLUP_FLUSH_INTERVAL = float(os.getenv("ROLLUP_FLUSH_INTERVAL", "10"))   # seconds between map cell / overview rollup upserts
 # ------------------
 
 # Mongo client + collections
@@ -46,107 +65,68 @@ db = client['honeypot']
 raw_collection = db['sessions']
 agg_collection = db['sessions_agg']
 
-# in-memory session aggregator
-sessions = defaultdict(lambda: {
-    "first_ts": None,
-    "last_ts": None,
-    "cmds": [],
-    "downloads": 0,
-    "unique_cmds": set(),
-    "src_ip": None,
-    "action": None,
-    "action_id": None
-})
+# write-behind buffers: events and finished sessions go to Mongo in unordered bulk batches.
+# Neither can be recomputed, so they retry through an outage (max_retries=None) and the
+# full queue blocks ingestion instead of dropping batches
+raw_writer = BulkWriter(raw_collection, batch_size=BULK_BATCH_SIZE, flush_interval=BULK_FLUSH_INTERVAL,
+                        max_queue=BULK_MAX_QUEUE, max_retries=None)
+agg_writer = BulkWriter(agg_collection, batch_size=BULK_BATCH_SIZE, flush_interval=BULK_FLUSH_INTERVAL,
+                        max_queue=BULK_MAX_QUEUE, max_retries=None)
+# map cells and overview rollups are summed in memory and written as $inc upserts every
+# ROLLUP_FLUSH_INTERVAL, tagged with a flush id so writer retries can't double-count.
+# `python -m common.map_cells rebuild` / `python -m common.rollups rebuild` recount them
+# from sessions_agg, with the forwarder stopped, so these give up after a few retries
+cells = CellRollup()
+cells_writer = BulkWriter(db[CELLS_COLLECTION], batch_size=BULK_BATCH_SIZE,
+                          flush_interval=BULK_FLUSH_INTERVAL, max_queue=BULK_MAX_QUEUE)
+rollups = SessionRollup()
+rollups_writer = BulkWriter(db[ROLLUPS_COLLECTION], batch_size=BULK_BATCH_SIZE,
+                            flush_interval=BULK_FLUSH_INTERVAL, max_queue=BULK_MAX_QUEUE)
 
-# ----- Controller helpers -----
-def enrich_geo(ip):
-    if not geo_reader or not ip:
-        return None
-    try:
-        r = geo_reader.city(ip)
-        return {
-            "country": r.country.name,
-            "city": r.city.name,
-            "lat": r.location.latitude,
-            "lon": r.location.longitude
-        }
-    except:
-        return None
+ioc_matcher = get_matcher()
+# local GeoLite2 lookups (mmap + LRU + disk cache, GEOIP_DB / GEO_CACHE); geo is stored on
+# sessions_agg here so the dashboards never have to look it up
+geo = get_locator()
 
-def send_to_controller(session_id, context):
-    try:
-        resp = requests.post(
-            f"{CONTROLLER_URL}/decide",
-            json={"session_id": session_id, "context": context},
-            timeout=5
-        )
-        return resp.json()
-    except Exception as e:
-        print("Controller error (decide):", e)
-        return {"action": "default", "action_id": session_id}
+# in-memory session aggregator (bounded; idle sessions are finalized by the main loop)
+sessions = SessionStore(SessionFeatures, idle_timeout=SESSION_IDLE_TIMEOUT, max_sessions=MAX_SESSIONS)
+# events are applied on the watchdog thread, idle expiry and shutdown run on the main one;
+# this lock keeps a session from being finalized halfway through an update
+session_lock = threading.RLock()
 
-def send_reward_to_controller(action_id, session_id, reward):
-    try:
-        requests.post(
-            f"{CONTROLLER_URL}/report",
-            json={"action_id": action_id, "session_id": session_id, "reward": float(reward)},
-            timeout=5
-        )
-        print(f"[controller] reported reward={reward} for session={session_id}")
-    except Exception as e:
-        print("Controller error (report):", e)
+# ----- Controller helpers -----
+controller = ControllerClient(CONTROLLER_URL, REPORT_QUEUE_PATH,
+                              workers=CONTROLLER_WORKERS, timeout=CONTROLLER_TIMEOUT)
+
+def apply_decision(session_id, sess, decision):
+    sess.action = decision.get("action")
+    sess.action_id = decision.get("action_id")
+    print(f"[controller decide] session={session_id} action={sess.action} id={sess.action_id}")
 
 # ----- Features & Reward -----
+# both come from the shared streaming engine (common/session_features.py), the same code
+# the offline extractor trains on
 def compute_features(session):
-    first = session["first_ts"]
-    last = session["last_ts"]
-    duration = 0.0
-    if first and last:
-        duration = (last - first).total_seconds()
-    cmd_count = len(session["cmds"])
-    unique_cmds = len(session["unique_cmds"])
-    downloads = session["downloads"]
-    return {
-        "duration": duration,
-        "cmd_count": cmd_count,
-        "unique_cmds": unique_cmds,
-        "downloads": downloads,
-        "reward": 0.0,
-        "dummy1": 0.0,
-        "dummy2": 0.0,
-        "dummy3": 0.0
-    }
+    return session.features.context()
 
 def compute_reward(session):
-    first = session["first_ts"]
-    last = session["last_ts"]
-    duration = 0.0
-    if first and last:
-        duration = max(0.0, (last - first).total_seconds())
-    unique_cmds = len(session["unique_cmds"])
-    dur_norm = min(duration / 300.0, 1.0)
-    cmd_norm = min(unique_cmds / 5.0, 1.0)
-    reward = 0.6 * dur_norm + 0.4 * cmd_norm
-    return max(0.0, min(reward, 1.0))
+    return session.features.reward()
 
 # ----- Event processing -----
-def safe_parse_timestamp(ts):
-    try:
-        return dateparser.parse(ts)
-    except Exception:
-        return None
-
 def process_event_obj(obj):
+    with session_lock:
+        _process_event_obj(obj)
+
+def _process_event_obj(obj):
+    # parse the timestamp once; used for both the raw doc and the session bounds
+    parsed = parse_ts(obj.get("timestamp"))
     # store raw event safely (avoid storing unserializable types as-is)
     try:
         if "timestamp" in obj:
-            try:
-                obj["_ts_parsed"] = dateparser.parse(obj["timestamp"]).isoformat()
-            except Exception:
-                obj["_ts_parsed"] = obj["timestamp"]
-        raw_collection.insert_one(obj)
+            obj["_ts_parsed"] = parsed.isoformat() if parsed else obj["timestamp"]
+        raw_writer.add(obj)
     except Exception as e:
-        print("Mongo insert raw failed:", e)
+        print("Mongo enqueue raw failed:", e)
 
     # determine session id
     session_id = None
@@ -159,146 +139,211 @@ def process_event_obj(obj):
         ts = obj.get("timestamp", str(time.time()))
         session_id = f"{src}-{ts}"
 
-    sess = sessions[session_id]
-
-    # timestamps
-    parsed = None
-    if "timestamp" in obj:
-        try:
-            parsed = dateparser.parse(obj["timestamp"])
-        except Exception:
-            parsed = None
-    if parsed:
-        if sess["first_ts"] is None or parsed < sess["first_ts"]:
-            sess["first_ts"] = parsed
-        if sess["last_ts"] is None or parsed > sess["last_ts"]:
-            sess["last_ts"] = parsed
+    sess, evicted = sessions.touch(session_id)
+    for sid, st in evicted:
+        finish_session(sid, st, reason="evicted")
 
     # src ip
-    if not sess["src_ip"]:
-        sess["src_ip"] = obj.get("src_ip") or obj.get("src_ip_str") or obj.get("src_ip_addr")
+    if not sess.src_ip:
+        sess.src_ip = obj.get("src_ip") or obj.get("src_ip_str") or obj.get("src_ip_addr")
 
-    # commands
-    if "command" in obj or "input" in obj:
-        cmd = obj.get("command") or obj.get("input") or obj.get("message")
-        if cmd:
-            sess["cmds"].append(cmd)
-            sess["unique_cmds"].add(cmd.split()[0] if isinstance(cmd, str) else cmd)
-
-    # downloads detection (safe dump)
-    try:
-        s = json_util.dumps(obj).lower()
-    except Exception:
-        obj_clean = dict(obj)
-        obj_clean.pop("_id", None)
-        s = json.dumps(obj_clean, default=str).lower()
-    if "wget" in s or "curl" in s or "download" in str(obj.get("eventid","")).lower():
-        sess["downloads"] += 1
+    # timestamps, commands, n-grams, command timing, downloads / IOCs: one O(1) update
+    sess.features.update(obj, ts=parsed, matcher=ioc_matcher)
 
     # session closed?
     eventid = obj.get("eventid") or obj.get("event") or ""
     if "session.closed" in str(eventid) or "cowrie.session.closed" in str(eventid):
+        sessions.pop(session_id)
         finish_session(session_id, sess)
     else:
-        # call controller once at first meaningful event if no action yet
-        if sess["action_id"] is None:
+        # call controller once at first meaningful event; the answer arrives on a pool thread
+        if sess.decision is None:
             ctx = compute_features(sess)
-            decision = send_to_controller(session_id, ctx)
-            sess["action"] = decision.get("action")
-            sess["action_id"] = decision.get("action_id")
-            print(f"[controller decide] session={session_id} action={sess['action']} id={sess['action_id']}")
+            sess.decision = controller.decide(session_id, ctx, sess.features.seq_sparse(), sess.fragment)
+            sess.decision.add_done_callback(
+                lambda f, sid=session_id, s=sess: apply_decision(sid, s, f.result()))
 
-def finish_session(session_id, session_data):
-    geo = enrich_geo(session_data.get("src_ip"))
+def finish_session(session_id, session_data, reason="closed"):
+    # session_data is already out of the store; reason is closed / idle / evicted / shutdown.
+    # A session id seen again after it was finalized becomes fragment 1, 2, ... with its own
+    # sessions_agg doc and decision; (session_id, fragment) tells them apart
     try:
-        features = compute_features(session_data)
         reward = compute_reward(session_data)
-        features["reward"] = reward
+        features = session_data.features.context(reward)
+        first, last = session_data.features.first_ts, session_data.features.last_ts
 
         agg_doc = {
             "session_id": session_id,
-            "src_ip": session_data.get("src_ip"),
-            "geo": geo,
-            "start": session_data.get("first_ts").isoformat() if session_data.get("first_ts") else None,
-            "end": session_data.get("last_ts").isoformat() if session_data.get("last_ts") else None,
-            "duration": features["duration"],
-            "cmd_count": features["cmd_count"],
-            "unique_cmds": features["unique_cmds"],
-            "downloads": features["downloads"],
-            "reward": reward,
-            "applied_action": session_data.get("action"),
-            "applied_action_id": session_data.get("action_id"),
+            "fragment": session_data.fragment,
+            "src_ip": session_data.src_ip,
+            "geo": geo.lookup(session_data.src_ip),
+            "start": first.isoformat() if first else None,
+            "end": last.isoformat() if last else None,
+            **features,
+            "iocs": sorted(session_data.features.iocs),
+            "end_reason": reason,
+            "applied_action": None,
+            "applied_action_id": None,
             "ts": time.time()
         }
 
-        try:
-            agg_collection.insert_one(agg_doc)
-        except Exception as e:
-            print("Failed to insert aggregated doc:", e)
+        def complete(decision):
+            # runs inline, or on a controller pool thread if /decide is still in flight
+            try:
+                agg_doc["applied_action"] = decision.get("action")
+                agg_doc["applied_action_id"] = decision.get("action_id")
+                agg_writer.add(agg_doc)
+                cells.add(agg_doc["geo"], reward, agg_doc["ts"])
+                rollups.add(agg_doc)
+                # local fallback decisions are unknown to the controller; nothing to report
+                if not decision.get("local"):
+                    controller.report(decision["action_id"], session_id, reward,
+                                      {"fragment": session_data.fragment} if session_data.fragment else None)
+                print(f"[session finished] {session_id} reward={reward} saved.")
+            except Exception:
+                print("Error completing session:", session_id, traceback.format_exc())
 
-        action_id = session_data.get("action_id") or session_id
-        send_reward_to_controller(action_id, session_id, reward)
-        print(f"[session finished] {session_id} reward={reward} saved.")
+        fut = session_data.decision
+        if fut is None:
+            complete(ControllerClient.local_decision(session_id))
+        else:
+            fut.add_done_callback(lambda f: complete(f.result()))
     except Exception:
         print("Error in finish_session:", traceback.format_exc())
-    finally:
-        if session_id in sessions:
-            del sessions[session_id]
+
+def expire_idle_sessions():
+    with session_lock:
+        for sid, st in sessions.expire_idle():
+            finish_session(sid, st, reason="idle")
+
+def finish_open_sessions():
+    # sessions still open at exit get their sessions_agg doc and /report too
+    with session_lock:
+        open_sessions = sessions.drain()
+        for sid, st in open_sessions:
+            finish_session(sid, st, reason="shutdown")
+    if open_sessions:
+        print(f"[sessions] finalized {len(open_sessions)} open sessions at shutdown")
 
 # ----- File reading / watchdog -----
+def process_line(line):
+    obj = None
+    try:
+        obj = json.loads(line)
+    except Exception:
+        try:
+            start = line.index('{')
+            obj = json.loads(line[start:])
+        except Exception:
+            return
+    if obj:
+        try:
+            process_event_obj(obj)
+        except Exception:
+            print("Error processing event:", traceback.format_exc())
+
+def is_log_file(path):
+    # also matches rotated names such as cowrie.json.2025-10-21
+    name = os.path.basename(path)
+    return not name.endswith(".tmp") and (".json" in name or ".log" in name)
+
+# offsets are saved from the raw writer's thread, behind the events they cover: a crash
+# re-reads lines whose events were still queued instead of skipping them
+tailer = LogTailer(OffsetStore(OFFSETS_PATH), process_line, commit=raw_writer.add_callback)
+
 def process_file(path):
     try:
-        with open(path, 'r', errors='ignore') as fh:
-            for line in fh:
-                line = line.strip()
-                if not line:
-                    continue
-                obj = None
-                try:
-                    obj = json.loads(line)
-                except Exception:
-                    try:
-                        start = line.index('{')
-                        obj = json.loads(line[start:])
-                    except Exception:
-                        continue
-                if obj:
-                    process_event_obj(obj)
+        tailer.poll(path)
     except Exception:
         print("Error processing file:", path, traceback.format_exc())
 
-class NewFileHandler(FileSystemEventHandler):
+class LogFileHandler(FileSystemEventHandler):
+    def _poll(self, path):
+        if is_log_file(path):
+            process_file(path)
+
     def on_created(self, event):
-        if event.is_directory:
-            return
-        path = event.src_path
-        if path.endswith(".log") or path.endswith(".json"):
-            try:
-                process_file(path)
-            except Exception as e:
-                print("error processing created file", path, e)
+        if not event.is_directory:
+            self._poll(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self._poll(event.src_path)
+
+    def on_moved(self, event):
+        # rotation: the renamed file keeps its inode, so its offset follows it
+        if not event.is_directory:
+            self._poll(event.dest_path)
 
 def initial_scan():
     try:
-        for fname in os.listdir(LOG_DIR):
-            full = os.path.join(LOG_DIR, fname)
-            if os.path.isfile(full):
-                process_file(full)
+        n = tailer.scan(LOG_DIR, accept=is_log_file)
+        print("initial_scan: read", n, "new lines")
     except Exception as e:
         print("initial_scan error", e)
 
+def flush_rollups():
+    for op in cells.drain():
+        cells_writer.add_op(op)
+    for op in rollups.drain():
+        rollups_writer.add_op(op)
+
+def print_writer_stats():
+    for w in (raw_writer, agg_writer, cells_writer, rollups_writer):
+        st = w.stats()
+        print(f"[bulk:{w.name}] queue={st['queue_depth']} written={st['written']} failed={st['failed']} "
+              f"flushes={st['flushes']} last_ms={st['last_flush_ms']:.1f} avg_ms={st['avg_flush_ms']:.1f} "
+              f"max_ms={st['max_flush_ms']:.1f} blocked={st['blocked_puts']} held={st['held_callbacks']}")
+
+def print_controller_stats():
+    st = controller.stats()
+    print(f"[controller] inflight={st['inflight_decides']} pending_reports={st['pending_reports']} "
+          f"circuit={st['circuit']} failures={st['failures']}")
+
+def print_session_stats():
+    st = sessions.stats()
+    print(f"[sessions] open={st['open']} opened={st['opened']} closed={st['closed']} "
+          f"expired={st['expired']} evicted={st['evicted']} reopened={st['reopened']}")
+
+def shutdown():
+    # open sessions first, then in-flight decides, which may still enqueue session docs
+    finish_open_sessions()
+    controller.close()
+    flush_rollups()
+    for w in (raw_writer, agg_writer, cells_writer, rollups_writer):
+        w.close()
+    print_writer_stats()
+    print_controller_stats()
+    print_session_stats()
+
 # ----- Main -----
 if __name__ == "__main__":
     print("Starting forwarder. LOG_DIR =", LOG_DIR, "MONGO_URI =", MONGO_URI, "CONTROLLER_URL =", CONTROLLER_URL)
+    # docker stop sends SIGTERM; turn it into a normal exit so buffers get flushed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    bootstrap_indexes(MONGO_URI, dbs=["honeypot"])
     time.sleep(3)
     initial_scan()
-    event_handler = NewFileHandler()
+    event_handler = LogFileHandler()
     observer = Observer()
     observer.schedule(event_handler, LOG_DIR, recursive=False)
     observer.start()
+    last_stats = last_rollup = time.time()
     try:
         while True:
             time.sleep(1)
-    except KeyboardInterrupt:
+            expire_idle_sessions()
+            if time.time() - last_rollup >= ROLLUP_FLUSH_INTERVAL:
+                flush_rollups()
+                last_rollup = time.time()
+            if time.time() - last_stats >= STATS_INTERVAL:
+                print_writer_stats()
+                print_controller_stats()
+                print_session_stats()
+                last_stats = time.time()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
         observer.stop()
-    observer.join()
+        observer.join()
+        shutdown()
@@ -0,0 +1,198 @@
+# infra/forwarder/mongo_writer.py
+# Write-behind buffer that turns per-event inserts into unordered bulk batches.
+import time
+import queue
+import threading
+from bson import ObjectId
+from pymongo import InsertOne
+from pymongo.errors import AutoReconnect, BulkWriteError, PyMongoError
+
+RETRY_DELAY = 0.5       # first backoff after AutoReconnect, doubling per attempt
+MAX_RETRY_DELAY = 10.0
+
+
+class _Callback:
+    # queue marker: run once every item queued before it has been flushed
+    __slots__ = ("fn",)
+
+    def __init__(self, fn):
+        self.fn = fn
+
+
+class BulkWriter:
+    """Buffers documents (or bulk operations) for one collection and writes them
+    from a background thread with unordered `bulk_write`.
+
+    A batch is flushed once `batch_size` items are queued or `flush_interval`
+    seconds have passed since the oldest unflushed item. The queue is bounded by
+    `max_queue`: when Mongo falls behind, `add()` blocks the caller, which slows
+    log ingestion instead of growing memory without limit.
+
+    `max_retries` bounds the AutoReconnect retries of one batch before it is
+    dropped; None retries until Mongo is back, which with the bounded queue turns
+    an outage into backpressure. Use None for data that exists nowhere else (raw
+    events, sessions), a bound only for what can be rebuilt (cells, rollups).
+
+    Once a batch could not be fully written, callbacks stop running for the rest
+    of the process: they persist monotonic file offsets, and any later one would
+    commit past the lost documents. A restart re-reads from the last point where
+    everything before it was durable.
+    """
+
+    def __init__(self, collection, name=None, batch_size=500, flush_interval=1.0,
+                 max_queue=20000, max_retries=5):
+        self.collection = collection
+        self.name = name or collection.name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._q = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._held = False   # a batch was lost; callbacks no longer run
+        self.counters = {
+            "enqueued": 0,
+            "written": 0,
+            "failed": 0,
+            "flushes": 0,
+            "blocked_puts": 0,
+            "held_callbacks": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name=f"bulk-{self.name}", daemon=True)
+        self._thread.start()
+
+    # ----- producer side -----
+    def add(self, doc):
+        # assign _id here so pymongo never mutates a dict the caller may still read
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()
+        self.add_op(InsertOne(doc))
+
+    def add_op(self, op):
+        self._put(op)
+        self.counters["enqueued"] += 1
+
+    def add_callback(self, fn):
+        """Calls fn() on the writer thread once everything queued before it has been
+        written; e.g. to persist file offsets only behind the data. Never called
+        once a batch has been dropped."""
+        self._put(_Callback(fn))
+
+    def _put(self, op):
+        try:
+            self._q.put_nowait(op)
+        except queue.Full:
+            self.counters["blocked_puts"] += 1
+            while True:
+                try:
+                    self._q.put(op, timeout=5)
+                    break
+                except queue.Full:
+                    print(f"[bulk:{self.name}] backpressure: queue full ({self._q.qsize()}), waiting on Mongo")
+
+    # ----- consumer side -----
+    def _drain(self, first):
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        # (ops applied, whether every op in the batch is now in Mongo)
+        delay = RETRY_DELAY
+        attempt = 0
+        while True:
+            try:
+                res = self.collection.bulk_write(batch, ordered=False)
+                return res.inserted_count + res.upserted_count + res.modified_count, True
+            except BulkWriteError as e:
+                # unordered: everything except the failed ops was applied. Duplicate keys
+                # come from a retried batch whose first attempt landed (inserts carry their
+                # _id, cell / rollup upserts their flush id), so those ops are done too.
+                details = e.details or {}
+                errs = [w for w in details.get("writeErrors", []) if w.get("code") != 11000]
+                dups = len(details.get("writeErrors", [])) - len(errs)
+                self.counters["failed"] += len(errs)
+                if errs:
+                    print(f"[bulk:{self.name}] {len(errs)} write errors, first: {errs[0].get('errmsg')}")
+                done = details.get("nInserted", 0) + details.get("nUpserted", 0) + details.get("nModified", 0) + dups
+                return done, not errs
+            except AutoReconnect as e:
+                if self.max_retries is not None and attempt >= self.max_retries:
+                    break
+                attempt += 1
+                print(f"[bulk:{self.name}] Mongo unavailable, retrying in {delay:.1f}s:", e)
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+            except PyMongoError as e:
+                print(f"[bulk:{self.name}] bulk write failed:", e)
+                break
+        self.counters["failed"] += len(batch)
+        return 0, False
+
+    def _flush_batch(self, batch):
+        ops = [op for op in batch if not isinstance(op, _Callback)]
+        ok = True
+        if ops:
+            t0 = time.perf_counter()
+            written, ok = self._write(ops)
+            ms = (time.perf_counter() - t0) * 1000.0
+            c = self.counters
+            c["written"] += written
+            c["flushes"] += 1
+            c["last_flush_ms"] = ms
+            c["max_flush_ms"] = max(c["max_flush_ms"], ms)
+            c["total_flush_ms"] += ms
+        if not ok and not self._held:
+            self._held = True
+            print(f"[bulk:{self.name}] batch not fully written; holding callbacks (offsets) until restart")
+        # ops ahead of a marker are in this batch or an earlier one, so all are done now
+        for op in batch:
+            if isinstance(op, _Callback):
+                if self._held:
+                    self.counters["held_callbacks"] += 1
+                    continue
+                try:
+                    op.fn()
+                except Exception as e:
+                    print(f"[bulk:{self.name}] callback failed:", e)
+        for _ in batch:
+            self._q.task_done()
+
+    def _run(self):
+        while not self._stop.is_set() or not self._q.empty():
+            try:
+                first = self._q.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            # give a partial batch up to flush_interval to fill before writing
+            deadline = time.monotonic() + self.flush_interval
+            while self._q.qsize() + 1 < self.batch_size and time.monotonic() < deadline and not self._stop.is_set():
+                time.sleep(min(0.05, self.flush_interval))
+            self._flush_batch(self._drain(first))
+
+    def flush(self, timeout=None):
+        """Blocks until everything enqueued so far has been written (or failed)."""
+        end = None if timeout is None else time.monotonic() + timeout
+        while self._q.unfinished_tasks:
+            if end is not None and time.monotonic() > end:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self, timeout=30):
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            print(f"[bulk:{self.name}] shutdown timed out with {self._q.qsize()} items unflushed")
+
+    def stats(self):
+        c = dict(self.counters)
+        c["queue_depth"] = self._q.qsize()
+        c["avg_flush_ms"] = c["total_flush_ms"] / c["flushes"] if c["flushes"] else 0.0
+        return c
@@ -0,0 +1,115 @@
+# infra/forwarder/session_store.py
+# Bounded in-memory session table with idle-timeout and LRU eviction.
+import time
+import threading
+from collections import OrderedDict
+
+
+class SessionState:
+    """Per-session aggregate: the incremental feature state (see
+    common/session_features.py) plus the controller decision for the session.
+
+    `fragment` numbers the pieces of one session id: 0 normally, n when the id shows up
+    again after n earlier pieces were already finalized (idle expiry, eviction, events
+    after session.closed)."""
+
+    __slots__ = ("features", "src_ip", "action", "action_id", "decision", "last_seen", "fragment")
+
+    def __init__(self, features, fragment=0):
+        self.features = features
+        self.fragment = fragment
+        self.src_ip = None
+        self.action = None
+        self.action_id = None
+        self.decision = None
+        self.last_seen = time.monotonic()
+
+
+class SessionStore:
+    """Open sessions in an OrderedDict kept in last-activity order.
+
+    Touching a session moves it to the end, so the front is always the least
+    recently active one: idle expiry pops from the front until it reaches a
+    session seen within `idle_timeout`, and the `max_sessions` ceiling evicts
+    from the same end (LRU). Expired and evicted sessions are returned to the
+    caller for finalization instead of being dropped.
+
+    The ids of the last `max_ended` finalized sessions are remembered with their
+    fragment number, so a session reopened by late events gets the next one.
+    """
+
+    def __init__(self, new_features, idle_timeout=600.0, max_sessions=50000, max_ended=None):
+        self.new_features = new_features   # factory for a session's feature state
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.max_ended = max_sessions if max_ended is None else max_ended
+        self._sessions = OrderedDict()
+        self._ended = OrderedDict()   # session_id -> fragment of its last finalized piece
+        self._lock = threading.Lock()
+        self.counters = {"opened": 0, "closed": 0, "expired": 0, "evicted": 0, "reopened": 0}
+
+    def _end(self, session_id, st):
+        # caller holds the lock
+        self._ended.pop(session_id, None)
+        self._ended[session_id] = st.fragment
+        while len(self._ended) > self.max_ended:
+            self._ended.popitem(last=False)
+
+    def touch(self, session_id):
+        """Returns (state, evicted) where evicted is a list of (session_id, state)
+        pushed out by the size ceiling."""
+        evicted = []
+        with self._lock:
+            st = self._sessions.get(session_id)
+            if st is None:
+                last = self._ended.pop(session_id, None)
+                st = SessionState(self.new_features(), fragment=0 if last is None else last + 1)
+                self._sessions[session_id] = st
+                self.counters["opened"] += 1
+                self.counters["reopened"] += last is not None
+                while len(self._sessions) > self.max_sessions:
+                    evicted.append(self._sessions.popitem(last=False))
+                for sid, old in evicted:
+                    self._end(sid, old)
+                self.counters["evicted"] += len(evicted)
+            else:
+                self._sessions.move_to_end(session_id)
+            st.last_seen = time.monotonic()
+        return st, evicted
+
+    def pop(self, session_id):
+        with self._lock:
+            st = self._sessions.pop(session_id, None)
+            if st is not None:
+                self._end(session_id, st)
+                self.counters["closed"] += 1
+            return st
+
+    def expire_idle(self, now=None):
+        now = time.monotonic() if now is None else now
+        cutoff = now - self.idle_timeout
+        out = []
+        with self._lock:
+            while self._sessions:
+                sid, st = next(iter(self._sessions.items()))
+                if st.last_seen > cutoff:
+                    break
+                self._sessions.popitem(last=False)
+                self._end(sid, st)
+                out.append((sid, st))
+            self.counters["expired"] += len(out)
+        return out
+
+    def drain(self):
+        with self._lock:
+            out = list(self._sessions.items())
+            self._sessions.clear()
+        return out
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self):
+        c = dict(self.counters)
+        c["open"] = len(self._sessions)
+        return c
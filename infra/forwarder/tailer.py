@@ -0,0 +1,200 @@
+# infra/forwarder/tailer.py
+# Incremental tailing of Cowrie log files with persisted, inode-aware byte offsets.
+import os
+import json
+import hashlib
+import threading
+
+CHUNK_SIZE = 1 << 20   # read 1 MiB at a time
+HEAD_BYTES = 256   # file head fingerprinted with the offset, to spot a new file on a reused inode
+
+
+def _head(fh, n):
+    return hashlib.sha1(os.pread(fh.fileno(), n, 0)).hexdigest()
+
+
+def _is_complete_json(raw):
+    try:
+        json.loads(raw)
+        return True
+    except ValueError:
+        return False
+
+
+class OffsetStore:
+    """Byte offsets keyed by (device, inode), persisted atomically as JSON.
+
+    Keying by inode instead of path means a rotated file (cowrie.json ->
+    cowrie.json.2025-10-21) keeps its offset under the new name, while the
+    fresh cowrie.json starts from zero. Each entry also holds a hash of the
+    file's first bytes: once a deleted file's inode is reused, the new file's
+    head differs and it is read from the start instead of from the stale offset.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = {}
+        self._dirty = False
+        self._io_lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def key(st):
+        return f"{st.st_dev}:{st.st_ino}"
+
+    def load(self):
+        try:
+            with open(self.path, "r") as fh:
+                self.offsets = json.load(fh)
+        except FileNotFoundError:
+            self.offsets = {}
+        except Exception as e:
+            print("Offset store unreadable, starting from scratch:", self.path, e)
+            self.offsets = {}
+
+    def get(self, st):
+        entry = self.offsets.get(self.key(st))
+        return entry["offset"] if entry else 0
+
+    def head(self, st):
+        """(length, sha1) of the file head recorded with the offset, or None."""
+        entry = self.offsets.get(self.key(st))
+        return (entry["head_len"], entry["head"]) if entry and "head" in entry else None
+
+    def set(self, st, path, offset, head=None):
+        entry = {"path": path, "offset": offset}
+        head = head or self.head(st)
+        if head:
+            entry["head_len"], entry["head"] = head
+        self.offsets[self.key(st)] = entry
+        self._dirty = True
+
+    def prune(self, live_keys):
+        for k in list(self.offsets):
+            if k not in live_keys:
+                del self.offsets[k]
+                self._dirty = True
+
+    def snapshot(self):
+        """Copy of the offsets if they changed since the last snapshot, else None."""
+        if not self._dirty:
+            return None
+        self._dirty = False
+        return {k: dict(v) for k, v in self.offsets.items()}
+
+    def save(self, snapshot=None):
+        # writes `snapshot` (default: the current offsets, if changed); may run on another thread
+        if snapshot is None:
+            snapshot = self.snapshot()
+            if snapshot is None:
+                return
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with self._io_lock:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as fh:
+                json.dump(snapshot, fh)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp, self.path)
+
+
+class LogTailer:
+    """Reads only the bytes appended since the last poll of each file.
+
+    Only complete lines are handed to `on_line`; a trailing partial line is left
+    for the next poll. A file that shrank below its stored offset is treated as
+    truncated and re-read from the start.
+
+    `commit(fn)`, if given, decides when new offsets reach disk: it must call fn() only
+    once everything `on_line` handed off so far is durable (the forwarder queues it
+    behind the raw events in its BulkWriter), so a crash re-reads lines instead of
+    losing them. Without it offsets are saved after every poll.
+    """
+
+    def __init__(self, offsets, on_line, chunk_size=CHUNK_SIZE, commit=None):
+        self.offsets = offsets
+        self.on_line = on_line
+        self.chunk_size = chunk_size
+        self.commit = commit
+        self._lock = threading.Lock()
+
+    def _checkpoint(self):
+        snap = self.offsets.snapshot()
+        if snap is None:
+            return
+        if self.commit is None:
+            self.offsets.save(snap)
+        else:
+            self.commit(lambda: self.offsets.save(snap))
+
+    def _same_file(self, fh, st):
+        # offsets saved before fingerprints existed can't be checked; trust them
+        head = self.offsets.head(st)
+        return head is None or _head(fh, head[0]) == head[1]
+
+    def poll(self, path):
+        with self._lock:
+            try:
+                fh = open(path, "rb")
+            except FileNotFoundError:
+                return 0
+            n = 0
+            with fh:
+                # stat the open handle so a rotation between stat and open can't mix inodes
+                st = os.fstat(fh.fileno())
+                offset = self.offsets.get(st)
+                if st.st_size < offset:
+                    print("File truncated, re-reading from start:", path)
+                    offset = 0
+                elif offset and not self._same_file(fh, st):
+                    print("File replaced on a reused inode, re-reading from start:", path)
+                    offset = 0
+                if st.st_size == offset:
+                    return 0
+                fh.seek(offset)
+                pending = b""
+                while True:
+                    chunk = fh.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    buf = pending + chunk
+                    cut = buf.rfind(b"\n")
+                    if cut < 0:
+                        pending = buf
+                        continue
+                    pending = buf[cut + 1:]
+                    for raw in buf[:cut].split(b"\n"):
+                        line = raw.decode("utf-8", errors="ignore").strip()
+                        if line:
+                            self.on_line(line)
+                            n += 1
+                    offset += cut + 1
+                    self.offsets.set(st, path, offset)
+                # single-object files (e.g. scripts/generate_fake_logs.py) have no trailing
+                # newline; take the tail only if it is already a complete JSON document
+                if pending and _is_complete_json(pending):
+                    self.on_line(pending.decode("utf-8", errors="ignore").strip())
+                    n += 1
+                    offset += len(pending)
+                    self.offsets.set(st, path, offset)
+                if offset:
+                    size = min(HEAD_BYTES, offset)
+                    self.offsets.set(st, path, offset, (size, _head(fh, size)))
+            self._checkpoint()
+            return n
+
+    def scan(self, directory, accept=None):
+        live = set()
+        total = 0
+        for fname in sorted(os.listdir(directory)):
+            full = os.path.join(directory, fname)
+            if not os.path.isfile(full) or (accept and not accept(full)):
+                continue
+            live.add(OffsetStore.key(os.stat(full)))
+            total += self.poll(full)
+        with self._lock:
+            self.offsets.prune(live)
+            self._checkpoint()
+        return total
@@ -6,6 +6,7 @@ docker compose -f docker-compose.yml down --volumes --remove-orphans
 # remove logs and DB data (careful: this deletes local data)
 rm -rf ../honeypot/cowrie/log/*
 rm -rf ../data/mongo/*
+rm -rf ./data/forwarder/*
 docker compose -f docker-compose.yml up -d --build
 echo "Stack reset and restarted."
 
@@ -1,23 +1,132 @@
 # notebooks/extract_sessions.py
-# Run: python3 extract_sessions.py
+# Run: python3 extract_sessions.py [--out sessions.jsonl] [--format jsonl|parquet|json]
 from pymongo import MongoClient
-import pandas as pd
-from dateutil import parser
-from datetime import timedelta
-import json
+from datetime import datetime, timedelta, timezone
+import argparse
 import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.timestamps import parse_ts
+from common.session_io import open_sink
 
 MONGO_URI = "mongodb://localhost:27017"
-OUT = "sessions.json"   # output - list of session dicts
+OUT = "sessions.jsonl"   # output - one session dict per line
+BATCH_SIZE = 5000
+GAP = timedelta(minutes=5)   # inactivity gap that splits src_ip-keyed sessions
+SESSION_ID_TIMEOUT = timedelta(hours=1)   # an explicit session id with no events for this long is done
+
+# only the fields sessionization and feature extraction read
+EVENT_FIELDS = ["timestamp", "time", "ts", "src_ip", "srcip", "peer", "event", "eventid", "message",
+                "input", "cmd", "command", "url", "session", "sessionid", "username", "password"]
 
 def to_dt(x):
-    try:
-        return parser.parse(x)
-    except:
-        return None
+    if isinstance(x, (int, float)):
+        return datetime.fromtimestamp(x, tz=timezone.utc)
+    dt = parse_ts(x)
+    # compare everything in UTC; naive Cowrie/fake-log timestamps are UTC already
+    if dt is not None and dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+def _iso(dt):
+    return dt.isoformat() if dt else None
+
+class StreamingSessionizer:
+    """Consumes time-ordered events and emits finished sessions as soon as they can
+    no longer grow, so memory holds only currently open sessions.
+
+    Events carrying a session id are grouped by it; a session ends at its
+    session.closed event or after SESSION_ID_TIMEOUT of stream time without
+    events. Events without one are grouped per src_ip and split on GAP.
+    """
+
+    def __init__(self, emit, gap=GAP, sid_timeout=SESSION_ID_TIMEOUT):
+        self.emit = emit
+        self.gap = gap
+        self.sid_timeout = sid_timeout
+        self.open = {}   # key -> session dict (+ "_kind": "sid" or "ip")
+        self.now = None
+        self.emitted = 0
+
+    def _close(self, key):
+        sess = self.open.pop(key)
+        sess.pop("_kind", None)
+        sess["start"] = _iso(sess["start"])
+        sess["end"] = _iso(sess["end"])
+        self.emit(sess)
+        self.emitted += 1
+
+    def feed(self, d):
+        ts = d.get("timestamp") or d.get("time") or d.get("ts")
+        ts = to_dt(ts) if ts else None
+        src = d.get("src_ip") or d.get("srcip") or d.get("peer")
+        sid = d.get("session") or d.get("sessionid")
+        if ts is not None:
+            self.now = ts if self.now is None or ts > self.now else self.now
+
+        if sid:
+            key = ("sid", str(sid))
+            sess = self.open.get(key)
+            if sess is None:
+                sess = self.open[key] = {"session_id": str(sid), "src_ip": src, "start": ts, "end": ts,
+                                         "events": [], "_kind": "sid"}
+        else:
+            key = ("ip", src)
+            sess = self.open.get(key)
+            if sess is not None and ts is not None and sess["end"] is not None and ts - sess["end"] > self.gap:
+                self._close(key)
+                sess = None
+            if sess is None:
+                sess = self.open[key] = {"session_id": f"{src}-{ts.isoformat() if ts else 'na'}", "src_ip": src,
+                                         "start": ts, "end": ts, "events": [], "_kind": "ip"}
+        sess["events"].append(d)
+        if ts is not None:
+            if sess["start"] is None or ts < sess["start"]:
+                sess["start"] = ts
+            if sess["end"] is None or ts > sess["end"]:
+                sess["end"] = ts
+        if not sess["src_ip"]:
+            sess["src_ip"] = src
+        event = str(d.get("eventid") or d.get("event") or "")
+        if sid and "session.closed" in event:
+            self._close(key)
 
-def main():
-    client = MongoClient(MONGO_URI)
+    def sweep(self):
+        """Emits every open session that the time-ordered stream has moved past."""
+        if self.now is None:
+            return
+        for key, sess in list(self.open.items()):
+            limit = self.sid_timeout if sess["_kind"] == "sid" else self.gap
+            if sess["end"] is not None and self.now - sess["end"] > limit:
+                self._close(key)
+
+    def flush(self):
+        for key in list(self.open):
+            self._close(key)
+
+    def snapshot(self):
+        """Open sessions as JSON-safe dicts, to resume them in a later run."""
+        out = []
+        for (kind, k), sess in self.open.items():
+            s = dict(sess)
+            s["_key"] = k
+            s["start"] = _iso(sess["start"])
+            s["end"] = _iso(sess["end"])
+            out.append(s)
+        return out
+
+    def restore(self, snapshot):
+        for s in snapshot:
+            s = dict(s)
+            key = (s["_kind"], s.pop("_key"))
+            s["start"] = to_dt(s["start"]) if s.get("start") else None
+            s["end"] = to_dt(s["end"]) if s.get("end") else None
+            self.open[key] = s
+            if s["end"] is not None and (self.now is None or s["end"] > self.now):
+                self.now = s["end"]
+
+def pick_collection(client):
     # Try common db names (we used 'honeypot')
     db_name = None
     for candidate in ("honeypot","cowrie","default"):
@@ -36,89 +145,40 @@ def main():
             break
     if not coll_name:
         coll_name = db.list_collection_names()[0]
-    coll = db[coll_name]
+    return db_name, coll_name, db[coll_name]
+
+def iter_events(coll, query=None, batch_size=BATCH_SIZE):
+    # projected, timestamp-sorted cursor (served by the honeypot.sessions timestamp index)
+    return coll.find(query or {}, {f: 1 for f in EVENT_FIELDS}).sort([("timestamp", 1)]).batch_size(batch_size)
 
-    # read events into dataframe (may be many - adjust limit if needed)
-    docs = list(coll.find().sort([("timestamp", 1)]))
-    if not docs:
+def sessionize(events, sink, sweep_every=BATCH_SIZE):
+    sz = StreamingSessionizer(sink.write)
+    n = 0
+    for d in events:
+        sz.feed(d)
+        n += 1
+        if n % sweep_every == 0:
+            sz.sweep()
+    sz.flush()
+    return n, sz.emitted
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Sessionize raw Cowrie events from Mongo")
+    ap.add_argument("--uri", default=MONGO_URI)
+    ap.add_argument("--out", default=OUT)
+    ap.add_argument("--format", choices=["jsonl", "parquet", "json"], default=None,
+                    help="default: from the --out extension")
+    ap.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = ap.parse_args(argv)
+
+    client = MongoClient(args.uri)
+    db_name, coll_name, coll = pick_collection(client)
+    with open_sink(args.out, args.format) as sink:
+        n_events, n_sessions = sessionize(iter_events(coll, batch_size=args.batch_size), sink, args.batch_size)
+    if not n_events:
         print("No events found in", db_name, coll_name)
         return
-
-    # normalize timestamps and important fields
-    rows = []
-    for d in docs:
-        ts = d.get("timestamp") or d.get("time") or d.get("ts")
-        if ts:
-            ts = to_dt(ts) if not isinstance(ts, (int,float)) else pd.to_datetime(ts, unit="s")
-        rows.append({
-            "raw": d,
-            "timestamp": ts,
-            "src_ip": d.get("src_ip") or d.get("srcip") or d.get("peer"),
-            "event": d.get("event") or d.get("eventid") or d.get("message"),
-            "input": d.get("input") or d.get("message") or d.get("cmd"),
-            "session": d.get("session") or d.get("sessionid") or None
-        })
-    df = pd.DataFrame(rows).sort_values("timestamp").reset_index(drop=True)
-
-    # Sessionization strategy:
-    # If session id present, group by session id.
-    # Else group by (src_ip) with inactivity gap (e.g., 5 minutes) -> new session.
-    sessions = []
-    if "session" in df.columns and df["session"].notnull().any():
-        for sid, g in df.groupby("session"):
-            if sid is None:
-                continue
-            g = g.sort_values("timestamp")
-            sess = {
-                "session_id": str(sid),
-                "src_ip": g["src_ip"].iloc[0],
-                "start": g["timestamp"].min().isoformat() if g["timestamp"].notnull().any() else None,
-                "end": g["timestamp"].max().isoformat() if g["timestamp"].notnull().any() else None,
-                "events": [r for r in g["raw"].tolist()]
-            }
-            sessions.append(sess)
-    else:
-        # group by src_ip + inactivity window
-        gap = timedelta(minutes=5)
-        for src, group in df.groupby("src_ip"):
-            group = group.sort_values("timestamp")
-            cur_events = []
-            cur_start = None
-            cur_end = None
-            for _, row in group.iterrows():
-                ts = row["timestamp"]
-                if cur_start is None:
-                    cur_start = ts
-                    cur_end = ts
-                    cur_events = [row["raw"]]
-                else:
-                    if ts is None or (ts - cur_end) <= gap:
-                        cur_events.append(row["raw"])
-                        if ts is not None:
-                            cur_end = ts
-                    else:
-                        sessions.append({
-                            "session_id": f"{src}-{cur_start.isoformat() if cur_start else 'na'}",
-                            "src_ip": src,
-                            "start": cur_start.isoformat() if cur_start else None,
-                            "end": cur_end.isoformat() if cur_end else None,
-                            "events": cur_events
-                        })
-                        cur_start = ts
-                        cur_end = ts
-                        cur_events = [row["raw"]]
-            if cur_events:
-                sessions.append({
-                    "session_id": f"{src}-{cur_start.isoformat() if cur_start else 'na'}",
-                    "src_ip": src,
-                    "start": cur_start.isoformat() if cur_start else None,
-                    "end": cur_end.isoformat() if cur_end else None,
-                    "events": cur_events
-                })
-    # write sessions.json
-    with open(OUT, "w") as f:
-        json.dump(sessions, f, indent=2, default=str)
-    print("Wrote", len(sessions), "sessions to", OUT)
+    print("Wrote", n_sessions, "sessions from", n_events, "events to", args.out)
 
 if __name__ == "__main__":
     main()
@@ -1,77 +1,148 @@
 # notebooks/feature_extractor.py
 import json
 import pandas as pd
-from dateutil import parser
-from sklearn.feature_extraction.text import HashingVectorizer
 import numpy as np
+import scipy.sparse as sp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import argparse
 import os
+import sys
+import time
 
-IN = "sessions.json"
-OUT = "features.csv"
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.timestamps import parse_ts, parse_series
+from common.session_features import SessionFeatures, command_of, N_FEATURES, NGRAM
+from common.session_io import iter_sessions
+from common.feature_store import write_table
+
+IN = "sessions.jsonl"   # from extract_sessions.py; .parquet and the legacy sessions.json also work
+OUT = "features"   # feature store table (common/feature_store.py)
+SHARD_SIZE = 2000      # sessions per worker task
+WORKERS = os.cpu_count() or 1
 
 def parse_iso(dt):
-    try:
-        return parser.parse(dt) if dt else None
-    except:
-        return None
+    return parse_ts(dt) if dt else None
 
-def summarize_events(events):
-    # events are raw JSON docs from Cowrie; we try to extract command inputs
+def summarize_session(s, n_features=N_FEATURES, ngram=NGRAM):
+    """Feeds a session's events through the same streaming engine the forwarder runs live."""
+    feats = SessionFeatures(n_features, ngram)
     cmds = []
-    downloads = 0
-    for e in events:
-        # common fields where command may appear
-        input_field = e.get("input") or e.get("message") or e.get("command") or e.get("cmd")
-        if input_field:
-            # if it's a dict or list convert to str
-            cmds.append(str(input_field))
-        # check for download attempts (basic heuristic)
-        msg = json.dumps(e).lower()
-        if "download" in msg or "wget" in msg or "curl" in msg or ".sh" in msg or "upload" in msg:
-            downloads += 1
-    return cmds, downloads
+    for e in s.get("events", []):
+        feats.update(e)
+        cmd = command_of(e)
+        if cmd is not None:
+            cmds.append(cmd)
+    return feats, cmds
+
+def session_row(s, n_features=N_FEATURES, ngram=NGRAM):
+    """(row, {bucket: count}) for one session."""
+    feats, cmds = summarize_session(s, n_features, ngram)
+    row = {
+        "session_id": s.get("session_id"),
+        "src_ip": s.get("src_ip"),
+        "start": s.get("start"),
+        "end": s.get("end"),
+    }
+    row.update(feats.context(feats.reward()))
+    row["iocs"] = ";".join(sorted(feats.iocs))
+    row["sequence_text"] = " ; ".join(cmds)[:10000]  # limit length
+    return row, feats.seq
+
+def extract_shard(shard, n_features=N_FEATURES, ngram=NGRAM):
+    """Rows and hashed sequence features (CSR) for one shard of sessions; runs in a
+    worker process. Items are session dicts or raw JSONL lines (parsed here, so the
+    JSON decoding is spread over the workers too)."""
+    rows = []
+    indptr, indices, data = [0], [], []
+    for item in shard:
+        row, seq = session_row(json.loads(item) if isinstance(item, str) else item, n_features, ngram)
+        rows.append(row)
+        for b in sorted(seq):
+            indices.append(b)
+            data.append(seq[b])
+        indptr.append(len(indices))
+    X_seq = sp.csr_matrix((np.asarray(data, dtype=np.float64), np.asarray(indices, dtype=np.int64),
+                           np.asarray(indptr, dtype=np.int64)), shape=(len(rows), n_features))
+    return rows, X_seq
 
-def main():
-    with open(IN, "r") as f:
-        sessions = json.load(f)
+def _chunks(items, size):
+    shard = []
+    for item in items:
+        shard.append(item)
+        if len(shard) >= size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+def iter_shards(path, size=SHARD_SIZE):
+    """Shards of a sessions file. JSONL shards are raw lines, left for the workers to parse."""
+    if path.endswith(".parquet") or path.endswith(".json"):
+        yield from _chunks(iter_sessions(path), size)
+        return
+    with open(path, "r") as f:
+        yield from _chunks((line for line in f if line.strip()), size)
+
+def iter_extracted(shards, workers=1, n_features=N_FEATURES, ngram=NGRAM):
+    """Results of extract_shard in shard order, whatever order the workers finish in.
+    At most 2 * workers shards are in flight, so memory stays bounded on a backfill."""
+    if workers <= 1:
+        for shard in shards:
+            yield extract_shard(shard, n_features, ngram)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for shard in shards:
+            pending.append(pool.submit(extract_shard, shard, n_features, ngram))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def build_features(sessions=None, shards=None, workers=1, shard_size=SHARD_SIZE,
+                   n_features=N_FEATURES, ngram=NGRAM):
+    """(rows, X_seq) for an iterable of session dicts (as written by extract_sessions.py)
+    or for pre-built shards (see iter_shards). X_seq is the hashed command sequence as
+    a CSR matrix with one row per feature row; it is never densified."""
+    if shards is None:
+        shards = _chunks(sessions, shard_size)
     rows = []
-    for s in sessions:
-        start = parse_iso(s.get("start"))
-        end = parse_iso(s.get("end"))
-        duration = (end - start).total_seconds() if start and end else None
-        cmds, downloads = summarize_events(s.get("events", []))
-        unique_cmds = len(set(cmds))
-        cmd_count = len(cmds)
-        seq_text = " ; ".join(cmds)[:10000]  # limit length
-        start_hour = start.hour if start else None
-        rows.append({
-            "session_id": s.get("session_id"),
-            "src_ip": s.get("src_ip"),
-            "start": s.get("start"),
-            "end": s.get("end"),
-            "duration": duration,
-            "cmd_count": cmd_count,
-            "unique_cmds": unique_cmds,
-            "downloads": downloads,
-            "start_hour": start_hour,
-            "sequence_text": seq_text
-        })
+    mats = []
+    for shard_rows, X_shard in iter_extracted(shards, workers, n_features, ngram):
+        rows.extend(shard_rows)
+        mats.append(X_shard)
+    if not rows:
+        return pd.DataFrame(), sp.csr_matrix((0, n_features))
     df = pd.DataFrame(rows)
+    # duration comes from the event timestamps (engine); start_hour parsed column-wise
+    start = parse_series(df["start"])
+    df.insert(df.columns.get_loc("sequence_text"), "start_hour", start.dt.hour)
     # simple normalization placeholders
     df["duration_norm"] = df["duration"].fillna(0) / (300.0)
     df["cmd_count_norm"] = df["cmd_count"].fillna(0) / 20.0
 
-    # tokenization -> simple hashing vectorizer to get numeric features (sparse)
-    vec = HashingVectorizer(n_features=64, alternate_sign=False, norm=None)
-    X_seq = vec.transform(df["sequence_text"].fillna(""))
-    X_seq = X_seq.toarray()  # small n_features so okay
+    # shard matrices are stacked as CSR; stored as the feature store's "seq" block
+    return df, sp.vstack(mats, format="csr")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Per-session features from sessionized events")
+    ap.add_argument("--in", dest="inp", default=None, help="sessions file (default: sessions.jsonl, else sessions.json)")
+    ap.add_argument("--out", default=OUT, help="feature store table")
+    ap.add_argument("--workers", type=int, default=WORKERS, help="processes; 1 runs in-process")
+    ap.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    ap.add_argument("--n-features", type=int, default=N_FEATURES, help="hash buckets for the command sequence")
+    ap.add_argument("--ngram", type=int, default=NGRAM, help="longest word n-gram hashed")
+    args = ap.parse_args(argv)
 
-    seq_cols = [f"seq_{i}" for i in range(X_seq.shape[1])]
-    df_seq = pd.DataFrame(X_seq, columns=seq_cols)
-    out = pd.concat([df.reset_index(drop=True), df_seq.reset_index(drop=True)], axis=1)
-    out.to_csv(OUT, index=False)
-    print("Wrote", OUT, "with", len(out), "rows and", out.shape[1], "columns")
+    path = args.inp or (IN if os.path.exists(IN) or not os.path.exists("sessions.json") else "sessions.json")
+    t0 = time.time()
+    out, X_seq = build_features(shards=iter_shards(path, args.shard_size), workers=args.workers,
+                                n_features=args.n_features, ngram=args.ngram)
+    write_table(out, args.out, mode="overwrite", sparse={"seq": X_seq})
+    print("Wrote", args.out, "with", len(out), "rows,", out.shape[1], "columns and",
+          f"{X_seq.nnz} non-zero seq features over {X_seq.shape[1]} buckets",
+          f"({args.workers} workers, {time.time() - t0:.1f}s)")
 
 if __name__ == "__main__":
-    import json
     main()
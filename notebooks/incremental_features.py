@@ -0,0 +1,98 @@
+# notebooks/incremental_features.py
+# Incremental sessionize + featurize: only raw events past the stored watermark are read,
+# and the finished sessions are upserted into the date-partitioned "features" table of the
+# feature store (common/feature_store.py).
+# Run: python3 incremental_features.py [--state pipeline_state.json] [--table features] [--reset]
+from pymongo import MongoClient
+from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.feature_store import write_table
+from extract_sessions import MONGO_URI, BATCH_SIZE, StreamingSessionizer, pick_collection, iter_events
+from feature_extractor import build_features
+
+STATE = "pipeline_state.json"   # watermark + sessions still open at the end of the last run
+TABLE = "features"              # feature store table
+# events are given their _id when the forwarder queues them, and reach Mongo only after the
+# BulkWriter queue ahead of them (up to BULK_MAX_QUEUE docs) and its AutoReconnect retries;
+# reading stops this far behind "now" so the watermark never passes a doc still in flight.
+# Keep it well above the forwarder's worst write delay.
+SETTLE = timedelta(seconds=float(os.getenv("INCREMENTAL_SETTLE_SECONDS", "900")))
+
+def load_state(path):
+    if not os.path.exists(path):
+        return {"last_id": None, "open": [], "runs": 0}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def save_state(state, path):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def run(coll, state, table=TABLE, batch_size=BATCH_SIZE, now=None, root=None, mode="upsert", settle=None):
+    now = now or datetime.now(timezone.utc)
+    upper = now - (SETTLE if settle is None else settle)
+    query = {"_id": {"$lt": ObjectId.from_datetime(upper)}}
+    if state.get("last_id"):
+        query["_id"]["$gt"] = ObjectId(state["last_id"])
+
+    finished = []
+    sz = StreamingSessionizer(finished.append)
+    # sessions left open by the previous run pick up where they stopped
+    sz.restore(state.get("open", []))
+    last_id = state.get("last_id")
+    n = 0
+    for d in iter_events(coll, query, batch_size):
+        sz.feed(d)
+        _id = d.get("_id")
+        if isinstance(_id, ObjectId) and (last_id is None or _id > ObjectId(last_id)):
+            last_id = str(_id)
+        n += 1
+        if n % batch_size == 0:
+            sz.sweep()
+    # stream time stays event time: a session closes once later events show it idle, never
+    # because of the wall clock (backfilled or historical events would all close at once);
+    # the rest carries over in state["open"] to the next run
+    sz.sweep()
+
+    df, X_seq = build_features(finished)
+    # upsert rewrites only the date partitions these sessions fall in
+    written = write_table(df, table, mode=mode, root=root, sparse={"seq": X_seq})
+    # the watermark moves only after the store is written; a crash in between replays
+    # the same events, and the upsert makes that harmless
+    state.update({"last_id": last_id, "open": sz.snapshot(), "runs": state.get("runs", 0) + 1,
+                  "updated": now.isoformat()})
+    return n, len(finished), written
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Incremental session feature extraction")
+    ap.add_argument("--uri", default=MONGO_URI)
+    ap.add_argument("--state", default=STATE)
+    ap.add_argument("--table", default=TABLE)
+    ap.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    ap.add_argument("--settle", type=float, default=SETTLE.total_seconds(),
+                    help="seconds behind now the watermark stops (INCREMENTAL_SETTLE_SECONDS)")
+    ap.add_argument("--reset", action="store_true", help="forget the watermark and rebuild from all events")
+    args = ap.parse_args(argv)
+
+    state = {"last_id": None, "open": [], "runs": 0} if args.reset else load_state(args.state)
+    client = MongoClient(args.uri)
+    db_name, coll_name, coll = pick_collection(client)
+    n_events, n_sessions, written = run(coll, state, args.table, args.batch_size,
+                                       mode="overwrite" if args.reset else "upsert",
+                                       settle=timedelta(seconds=args.settle))
+    save_state(state, args.state)
+    print(f"Read {n_events} new events from {db_name}.{coll_name}; upserted {n_sessions} sessions "
+          f"into {len(written)} partitions; {len(state['open'])} sessions still open; watermark {state['last_id']}")
+
+if __name__ == "__main__":
+    main()
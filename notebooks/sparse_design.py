@@ -0,0 +1,39 @@
+# notebooks/sparse_design.py
+# Sparse design matrices for the week4 workflows: numeric session features next to the
+# hashed command-sequence block of the feature store, scaled and clustered without
+# densifying (MaxAbsScaler / MiniBatchKMeans / TruncatedSVD all take CSR input).
+import os
+import sys
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.preprocessing import MaxAbsScaler
+from sklearn.decomposition import TruncatedSVD
+from sklearn.cluster import MiniBatchKMeans
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.feature_store import read_sparse
+
+NUMERIC = ["duration", "cmd_count", "unique_cmds", "downloads", "ioc_count"]
+MIN_DF = 2   # hash buckets used by fewer sessions than this are dropped
+
+def load_design(table="features", numeric=NUMERIC, min_df=MIN_DF):
+    """(df, X, names): one CSR row per session. Sequence counts are log1p-damped and
+    every column is scaled to [-1, 1] by its max magnitude, which keeps zeros zero."""
+    df, X_seq = read_sparse(table, "seq")
+    num = df.reindex(columns=numeric).apply(pd.to_numeric, errors="coerce").fillna(0.0).to_numpy()
+    if X_seq is None:
+        X_seq = sp.csr_matrix((len(df), 0))
+    # with 2^18 buckets almost every column is empty; keep the ones that can inform a cluster
+    keep = np.flatnonzero(X_seq.getnnz(axis=0) >= min_df)
+    X = sp.hstack([sp.csr_matrix(num), X_seq[:, keep].log1p()], format="csr")
+    X = MaxAbsScaler().fit_transform(X)
+    return df, X, list(numeric) + [f"seq_{i}" for i in keep]
+
+def cluster(X, k=4, seed=42):
+    km = MiniBatchKMeans(n_clusters=k, random_state=seed, n_init=3, batch_size=4096)
+    return km.fit_predict(X), km
+
+def project_2d(X, seed=42):
+    # PCA needs centering (dense); truncated SVD works on the sparse matrix directly
+    return TruncatedSVD(n_components=2, random_state=seed).fit_transform(X)
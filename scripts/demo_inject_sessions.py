@@ -1,17 +1,27 @@
 # scripts/demo_inject_sessions.py
-import pandas as pd
 import time
 from pymongo import MongoClient
 import os
 import random
+import sys
 from datetime import datetime
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.feature_store import read_any
+from common.geo import lookup
+from common.map_cells import CELLS_COLLECTION
+from common.map_cells import record as record_cells
+from common.rollups import ROLLUPS_COLLECTION
+from common.rollups import record as record_rollups
+
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 client = MongoClient(MONGO_URI)
 db = client["honeypot"]
 agg = db.sessions_agg
+cells = db[CELLS_COLLECTION]
+rollups = db[ROLLUPS_COLLECTION]
 
-CSV = "notebooks/features_agg.csv"
+FEATURES = "features_agg"   # feature store table, or a CSV path
 
 def synthetic(n=20):
     rows = []
@@ -30,16 +40,19 @@ def synthetic(n=20):
         rows.append(s)
     return rows
 
-def inject_from_csv(path, delay=0.2):
-    if not os.path.exists(path):
-        print("CSV not found, injecting synthetic instead")
+def inject_from_features(source, delay=0.2):
+    df = read_any(source, columns=["session_id", "src_ip", "start", "reward", "applied_action"])
+    if df.empty:
+        print("No feature rows found, injecting synthetic instead")
         for doc in synthetic(50):
             doc["ts"] = time.time()
+            doc["geo"] = lookup(doc["src_ip"])
             agg.insert_one(doc)
+            record_cells(cells, doc)
+            record_rollups(rollups, doc)
             print("Inserted synthetic", doc["session_id"])
             time.sleep(delay)
         return
-    df = pd.read_csv(path)
     # choose a sample subset so demo is quick
     sample = df.sample(min(100, len(df)))
     for _, r in sample.iterrows():
@@ -51,11 +64,13 @@ def inject_from_csv(path, delay=0.2):
             "applied_action": r.get("applied_action") or "default",
             "ts": time.time()
         }
+        doc["geo"] = lookup(doc["src_ip"])
         agg.insert_one(doc)
+        record_cells(cells, doc)
+        record_rollups(rollups, doc)
         print("Inserted", doc["session_id"])
         time.sleep(delay)
 
 if __name__ == "__main__":
-    import sys
     delay = float(sys.argv[1]) if len(sys.argv) > 1 else 0.1
-    inject_from_csv(CSV, delay=delay)
+    inject_from_features(FEATURES, delay=delay)
@@ -0,0 +1,33 @@
+# tests/conftest.py
+# Tests import the shared packages from the repo root and the forwarder's modules the
+# way forwarder.py does (flat, from infra/forwarder).
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+for p in (ROOT, os.path.join(ROOT, "infra", "forwarder")):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def controller_app(tmp_path_factory):
+    """(controller.app module, TestClient) with SEQ_DIMS=16, model files in a temp dir and
+    Mongo unreachable. The app's stores are module-level, so it is imported, started and
+    shut down once per run."""
+    d = tmp_path_factory.mktemp("controller")
+    os.environ.pop("SHARED_STATE", None)
+    os.environ.update(
+        MONGO_URI="mongodb://127.0.0.1:1", MONGO_TIMEOUT_MS="200", INDEX_TIMEOUT_MS="200", SEQ_DIMS="16",
+        MODEL_PATH=str(d / "linucb.npz"), WAL_PATH=str(d / "linucb.wal"),
+        LEGACY_MODEL_PATH=str(d / "none.pkl"), ACTION_DB_PATH=str(d / "actions.db"),
+        SCHEMA_PATH=os.path.join(ROOT, "controller", "feature_schema.json"),
+    )
+    import controller.app as app
+    from fastapi.testclient import TestClient
+    with TestClient(app.app) as client:
+        for log in (app.decision_log, app.report_log):
+            log.max_retries = 1   # Mongo is down; don't let shutdown wait out the backoff
+        yield app, client
@@ -0,0 +1,53 @@
+# tests/test_bandit.py
+import numpy as np
+
+from controller.bandit import LinUCB
+
+ACTIONS = ["a", "b", "c"]
+
+
+def _trained(n=400, dim=6, seed=0):
+    rng = np.random.default_rng(seed)
+    p = LinUCB(ACTIONS, dim, alpha=0.8)
+    for _ in range(n):
+        x = rng.normal(size=dim)
+        x /= np.linalg.norm(x)
+        p.update(ACTIONS[rng.integers(len(ACTIONS))], x, float(rng.random()))
+    return p, rng
+
+
+def test_sherman_morrison_matches_the_exact_inverse():
+    p, rng = _trained()
+    exact = np.linalg.inv(p.A)
+    np.testing.assert_allclose(p.A_inv, exact, rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(p.theta, np.einsum("kij,kj->ki", exact, p.b), rtol=1e-9, atol=1e-12)
+    x = rng.normal(size=p.dim)
+    scores = p.score(x)
+    for k, a in enumerate(ACTIONS):
+        theta = exact[k].dot(p.b[k])
+        ucb = theta.dot(x) + p.alpha * np.sqrt(x.dot(exact[k]).dot(x))
+        assert np.isclose(scores[a]["ucb"], ucb) and np.isclose(scores[a]["pred"], theta.dot(x))
+
+
+def test_periodic_refresh_keeps_the_inverse_exact(monkeypatch):
+    monkeypatch.setattr(LinUCB, "REFRESH_EVERY", 7)
+    p, _ = _trained(n=100)
+    np.testing.assert_allclose(p.A_inv, np.linalg.inv(p.A), rtol=1e-9, atol=1e-12)
+
+
+def test_batch_scoring_matches_single_decisions():
+    p, rng = _trained()
+    X = rng.normal(size=(20, p.dim))
+    for x, (action, scores) in zip(X, p.decide_batch(X)):
+        single_action, single = p.decide(x)
+        assert action == single_action
+        for a in ACTIONS:
+            assert np.isclose(scores[a]["ucb"], single[a]["ucb"])
+
+
+def test_state_round_trip_rebuilds_the_cache():
+    p, rng = _trained()
+    q = LinUCB.from_state(p.to_state())
+    x = rng.normal(size=p.dim)
+    assert q.decide(x)[0] == p.decide(x)[0]
+    np.testing.assert_allclose(q.A_inv, p.A_inv, rtol=1e-9, atol=1e-12)
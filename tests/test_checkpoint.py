@@ -0,0 +1,77 @@
+# tests/test_checkpoint.py
+import numpy as np
+import pytest
+
+from controller import checkpoint
+from controller.bandit import LinUCB
+from controller.checkpoint import Checkpointer
+
+ACTIONS = ["a", "b"]
+DIM = 4
+
+
+def _make():
+    return LinUCB(ACTIONS, DIM, alpha=0.8)
+
+
+def _open(tmp_path):
+    # no background saves: the test decides when a checkpoint happens
+    return Checkpointer(str(tmp_path / "m.npz"), str(tmp_path / "m.wal"), _make, interval=3600, every_n=10 ** 9)
+
+
+def _updates(n, seed):
+    rng = np.random.default_rng(seed)
+    return [(ACTIONS[i % 2], rng.normal(size=DIM), float(rng.random())) for i in range(n)]
+
+
+def _assert_same(policy, updates):
+    ref = _make()
+    for a, x, r in updates:
+        ref.update(a, x, r)
+    np.testing.assert_allclose(policy.A, ref.A)
+    np.testing.assert_allclose(policy.b, ref.b)
+
+
+def test_crash_replays_the_wal_past_the_last_checkpoint(tmp_path):
+    ups = _updates(30, 1)
+    ck = _open(tmp_path)
+    for u in ups[:20]:
+        ck.update(*u)
+    assert ck.checkpoint()
+    for u in ups[20:]:
+        ck.update(*u)
+    # crash: no close(), and the last WAL line is torn
+    with open(tmp_path / "m.wal", "a") as fh:
+        fh.write('{"seq": 31, "a": "a", "x": [0.1')
+
+    ck2 = _open(tmp_path)
+    assert ck2.seq == 30 and not ck2.dirty
+    _assert_same(ck2.policy, ups)
+    ck2.close()
+
+
+def test_failed_checkpoint_keeps_the_sealed_segment(tmp_path, monkeypatch):
+    ups = _updates(15, 2)
+    ck = _open(tmp_path)
+    for u in ups[:10]:
+        ck.update(*u)
+
+    def disk_full(*a, **kw):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(checkpoint, "save_checkpoint", disk_full)
+    with pytest.raises(OSError):
+        ck.checkpoint()
+    monkeypatch.undo()
+    for u in ups[10:]:
+        ck.update(*u)
+    # crash before any checkpoint made it: both WAL segments are replayed, in order
+    ck2 = _open(tmp_path)
+    assert ck2.seq == 15
+    _assert_same(ck2.policy, ups)
+    ck2.close()
+    # close() checkpointed; a clean restart reads the checkpoint alone
+    ck3 = _open(tmp_path)
+    assert ck3.seq == 15 and not (tmp_path / "m.wal.old").exists()
+    _assert_same(ck3.policy, ups)
+    ck3.close()
@@ -0,0 +1,76 @@
+# tests/test_controller_api.py
+# The controller_app fixture (conftest.py) points the app at an unreachable Mongo, so
+# every decision lookup here has to be served locally or come back as missing.
+import time
+import numpy as np
+
+
+def _missing(client):
+    for line in client.get("/metrics").text.splitlines():
+        if line.startswith("controller_reports_missing_total "):
+            return float(line.split()[1])
+    return 0.0
+
+
+def test_report_rebuilds_the_decide_vector_with_seq(controller_app, monkeypatch):
+    app, client = controller_app
+    scored, updated = [], []
+    score = app._score
+    monkeypatch.setattr(app, "_score", lambda vec: scored.append(vec) or score(vec))
+    monkeypatch.setattr(app.ckpt, "update", lambda action, vec, reward: updated.append(vec))
+
+    seq = {"indices": [3, 19, 70000], "values": [1.0, 2.0, 0.5]}
+    r = client.post("/decide", json={"session_id": "s1", "context": {"duration": 30, "cmd_count": 4}, "seq": seq})
+    assert r.status_code == 200
+    r = client.post("/report", json={"action_id": r.json()["action_id"], "session_id": "s1", "reward": 0.7})
+    assert r.json() == {"updated": True}
+
+    (vec,), (rebuilt,) = scored, updated
+    assert vec.shape == (app.DIM,) and np.array_equal(vec, rebuilt)
+    # 3 and 19 (19 % 16) share slot 3; 70000 % 16 = 0
+    block = vec[len(app.FEATURE_ORDER):]
+    assert np.count_nonzero(block) == 2 and block[0] > 0 and block[3] > 0
+
+
+def test_batch_endpoints_with_unknown_ids_while_mongo_is_down(controller_app):
+    app, client = controller_app
+    items = [{"session_id": f"b{i}", "context": {"duration": i, "cmd_count": 2}} for i in range(5)]
+    items[0]["seq"] = {"indices": [1, 2], "values": [1.0, 1.0]}
+    r = client.post("/decide/batch", json={"items": items})
+    assert r.status_code == 200
+    decisions = r.json()["decisions"]
+    assert len(decisions) == 5 and len({d["action_id"] for d in decisions}) == 5
+    assert all(d["action"] in app.ACTIONS for d in decisions)
+    assert client.post("/decide/batch", json={"items": []}).json() == {"decisions": []}
+
+    seq, missing = app.ckpt.seq, _missing(client)
+    t0 = time.monotonic()
+    r = client.post("/report/batch", json={"items": [
+        {"action_id": d["action_id"], "session_id": f"b{i}", "reward": 0.5} for i, d in enumerate(decisions)
+    ] + [{"action_id": "unknown", "session_id": "x", "reward": 1.0}]})
+    assert r.status_code == 200
+    assert r.json() == {"updated": 5, "missing": ["unknown"]}
+    assert time.monotonic() - t0 < 2.0   # the Mongo fallback gives up after MONGO_TIMEOUT_MS
+    assert app.ckpt.seq == seq + 5
+    assert _missing(client) == missing + 1
+
+
+def test_single_report_of_an_unknown_id_is_a_404(controller_app):
+    app, client = controller_app
+    missing = _missing(client)
+    r = client.post("/report", json={"action_id": "unknown", "session_id": "x", "reward": 1.0})
+    assert r.status_code == 404
+    assert _missing(client) == missing + 1
+
+
+def test_reports_resolve_from_the_action_store_after_the_mongo_write_failed(controller_app):
+    app, client = controller_app
+    r = client.post("/decide/batch", json={"items": [{"session_id": "late", "context": {"duration": 1}}]})
+    action_id = r.json()["decisions"][0]["action_id"]
+    # the background write gives up on Mongo; the decision is then only in the ActionStore
+    deadline = time.monotonic() + 10
+    while app.decision_log.stats()["pending_lookup"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert app.decision_log.get(action_id) is None
+    r = client.post("/report/batch", json={"items": [{"action_id": action_id, "session_id": "late", "reward": 0.2}]})
+    assert r.json() == {"updated": 1, "missing": []}
@@ -0,0 +1,45 @@
+# tests/test_feature_store.py
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from common.feature_store import write_table, read_sparse, read_table
+from common.session_features import N_FEATURES
+
+
+def _frame(ids, starts, reward=0.5):
+    return pd.DataFrame({"session_id": ids, "src_ip": "1.2.3.4", "start": starts,
+                         "duration": 10.0, "cmd_count": 3, "reward": reward})
+
+
+def _rows(X):
+    return [dict(zip(X[i].indices.tolist(), X[i].data.tolist())) for i in range(X.shape[0])]
+
+
+def test_sparse_block_round_trips_through_partitions(tmp_path):
+    df = _frame(["s1", "s2", "s3"], ["2025-10-21T10:00:00Z", "2025-10-22T09:00:00Z", "2025-10-21T08:00:00Z"])
+    X = sp.csr_matrix((np.array([1.0, 2.5, 0.25]), ([0, 0, 2], [5, N_FEATURES - 1, 77])),
+                      shape=(3, N_FEATURES))
+    write_table(df, "t", root=str(tmp_path), sparse={"seq": X})
+
+    out, Y = read_sparse("t", "seq", columns=["session_id", "reward"], root=str(tmp_path))
+    assert Y.shape == (3, N_FEATURES) and list(out.columns) == ["session_id", "reward"]
+    got = dict(zip(out["session_id"], _rows(Y)))
+    assert got == {"s1": {5: 1.0, N_FEATURES - 1: 2.5}, "s2": {}, "s3": {77: 0.25}}
+
+
+def test_upsert_replaces_rows_and_keeps_their_block(tmp_path):
+    root = str(tmp_path)
+    X = sp.csr_matrix(([1.0, 1.0], ([0, 1], [3, 4])), shape=(2, N_FEATURES))
+    write_table(_frame(["s1", "s2"], ["2025-10-21T10:00:00Z"] * 2), "t", root=root, sparse={"seq": X})
+    # same (session_id, start) written again with a new reward and sequence
+    X2 = sp.csr_matrix(([9.0], ([0], [8])), shape=(1, N_FEATURES))
+    write_table(_frame(["s1"], ["2025-10-21T10:00:00Z"], reward=0.9), "t", root=root, sparse={"seq": X2})
+    # a partition written without the block reads back as empty rows
+    write_table(_frame(["s9"], ["2025-11-01T00:00:00Z"]), "t", root=root)
+
+    out, Y = read_sparse("t", "seq", columns=["session_id", "reward"], root=root)
+    got = {sid: (r, row) for sid, r, row in zip(out["session_id"], out["reward"], _rows(Y))}
+    assert got == {"s1": (0.9, {8: 9.0}), "s2": (0.5, {4: 1.0}), "s9": (0.5, {})}
+    # plain reads never return the list columns
+    assert "seq_idx" not in read_table("t", root=root).columns
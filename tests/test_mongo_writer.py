@@ -0,0 +1,94 @@
+# tests/test_mongo_writer.py
+import os
+import json
+from types import SimpleNamespace
+from pymongo.errors import AutoReconnect, PyMongoError
+
+import mongo_writer
+from mongo_writer import BulkWriter
+from tailer import LogTailer, OffsetStore
+
+
+class FakeCollection:
+    name = "fake"
+
+    def __init__(self, error=None, failures=None):
+        self.error = error
+        self.failures = failures   # raise `error` this many times, then succeed
+        self.calls = []   # ("write", n) / ("callback",) in the order they happened
+        self.docs = []
+
+    def bulk_write(self, ops, ordered=False):
+        self.calls.append(("write", len(ops)))
+        error = self.error
+        if error is not None:
+            if self.failures is not None:
+                self.failures -= 1
+                if self.failures == 0:
+                    self.error = None
+            raise error
+        self.docs += [op._doc for op in ops]
+        return SimpleNamespace(inserted_count=len(ops), upserted_count=0, modified_count=0)
+
+
+def _tail(tmp_path, coll, **kw):
+    log = tmp_path / "cowrie.json"
+    log.write_text("".join(json.dumps({"n": i}) + "\n" for i in range(5)))
+    offsets_path = str(tmp_path / "offsets.json")
+    writer = BulkWriter(coll, batch_size=100, flush_interval=0.05, **kw)
+    tailer = LogTailer(OffsetStore(offsets_path), lambda line: writer.add(json.loads(line)),
+                       commit=writer.add_callback)
+    assert tailer.poll(str(log)) == 5
+    assert writer.flush(timeout=10)
+    writer.close()
+    return writer, offsets_path, log
+
+
+def test_offsets_saved_after_the_events_they_cover(tmp_path, monkeypatch):
+    coll = FakeCollection()
+    real_save = OffsetStore.save
+
+    def save(self, snapshot=None):
+        coll.calls.append(("callback",))
+        real_save(self, snapshot)
+
+    monkeypatch.setattr(OffsetStore, "save", save)
+    writer, offsets_path, log = _tail(tmp_path, coll)
+    assert coll.calls == [("write", 5), ("callback",)]
+    assert [d["n"] for d in coll.docs] == list(range(5))
+    saved = json.load(open(offsets_path))
+    assert [e["offset"] for e in saved.values()] == [log.stat().st_size]
+
+
+def test_failed_batch_does_not_advance_offsets(tmp_path):
+    writer, offsets_path, _ = _tail(tmp_path, FakeCollection(PyMongoError("boom")))
+    assert not os.path.exists(offsets_path)
+    st = writer.stats()
+    assert st["failed"] == 5 and st["held_callbacks"] == 1
+
+
+def test_callbacks_stay_held_after_a_dropped_batch(tmp_path):
+    coll = FakeCollection(AutoReconnect("down"))
+    writer = BulkWriter(coll, batch_size=100, flush_interval=0.05, max_retries=0)
+    ran = []
+    writer.add({"n": 1})
+    writer.add_callback(lambda: ran.append(1))
+    assert writer.flush(timeout=10)
+    # Mongo is back, but the first batch is gone: a later offset would skip it
+    coll.error = None
+    writer.add({"n": 2})
+    writer.add_callback(lambda: ran.append(2))
+    assert writer.flush(timeout=10)
+    writer.close()
+    assert ran == [] and [d["n"] for d in coll.docs] == [2]
+
+
+def test_unbounded_retries_ride_out_an_outage(tmp_path, monkeypatch):
+    monkeypatch.setattr(mongo_writer, "RETRY_DELAY", 0.01)
+    monkeypatch.setattr(mongo_writer, "MAX_RETRY_DELAY", 0.02)
+    coll = FakeCollection(AutoReconnect("down"), failures=8)
+    writer, offsets_path, log = _tail(tmp_path, coll, max_retries=None)
+    assert len(coll.calls) == 9 and len(coll.docs) == 5
+    assert writer.stats()["failed"] == 0
+    saved = json.load(open(offsets_path))
+    assert [e["offset"] for e in saved.values()] == [log.stat().st_size]
@@ -0,0 +1,31 @@
+# tests/test_session_store.py
+from session_store import SessionStore
+
+
+def test_reopened_session_ids_get_the_next_fragment():
+    store = SessionStore(dict, idle_timeout=10, max_sessions=2)
+    st, _ = store.touch("a")
+    assert st.fragment == 0
+    # idle expiry, then late events for the same id
+    assert [sid for sid, _ in store.expire_idle(now=st.last_seen + 11)] == ["a"]
+    st, _ = store.touch("a")
+    assert st.fragment == 1
+    # closed, then reopened again
+    store.pop("a")
+    assert store.touch("a")[0].fragment == 2
+    # LRU eviction also counts as finalized
+    store.touch("b")
+    _, evicted = store.touch("c")
+    assert [sid for sid, _ in evicted] == ["a"]
+    assert store.touch("a")[0].fragment == 3
+    assert store.stats()["reopened"] == 3
+
+
+def test_finalized_ids_are_bounded():
+    store = SessionStore(dict, max_sessions=10, max_ended=2)
+    for sid in ("a", "b", "c"):
+        store.touch(sid)
+        store.pop(sid)
+    # "a" fell out of the remembered ids, so it starts over
+    assert store.touch("a")[0].fragment == 0
+    assert store.touch("c")[0].fragment == 1
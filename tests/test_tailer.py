@@ -0,0 +1,68 @@
+# tests/test_tailer.py
+import os
+import json
+
+from tailer import LogTailer, OffsetStore
+
+
+def _lines(*ns):
+    return "".join(json.dumps({"n": n}) + "\n" for n in ns)
+
+
+def _tailer(tmp_path, seen):
+    return LogTailer(OffsetStore(str(tmp_path / "offsets.json")), lambda line: seen.append(json.loads(line)["n"]))
+
+
+def test_rotation_and_restart_read_every_line_once(tmp_path):
+    logs = tmp_path / "log"
+    logs.mkdir()
+    live = logs / "cowrie.json"
+    live.write_text(_lines(1, 2))
+    seen = []
+    tailer = _tailer(tmp_path, seen)
+    assert tailer.scan(str(logs)) == 2
+    # a partial line waits for its newline
+    with open(live, "a") as fh:
+        fh.write('{"n": 3')
+    assert tailer.poll(str(live)) == 0
+    with open(live, "a") as fh:
+        fh.write("}\n")
+    # rotate: the renamed file keeps its inode and offset, the new one starts at zero
+    os.rename(live, logs / "cowrie.json.2025-10-21")
+    live.write_text(_lines(4))
+    assert tailer.scan(str(logs)) == 2
+    assert sorted(seen) == [1, 2, 3, 4]
+
+    # restart from the saved offsets: only what was appended meanwhile is read
+    with open(live, "a") as fh:
+        fh.write(_lines(5))
+    seen.clear()
+    assert _tailer(tmp_path, seen).scan(str(logs)) == 1
+    assert seen == [5]
+
+
+def test_truncated_file_is_read_from_the_start(tmp_path):
+    log = tmp_path / "cowrie.json"
+    log.write_text(_lines(1, 2, 3))
+    seen = []
+    tailer = _tailer(tmp_path, seen)
+    tailer.poll(str(log))
+    log.write_text(_lines(9))
+    tailer.poll(str(log))
+    assert seen == [1, 2, 3, 9]
+
+
+def test_new_file_on_a_reused_inode_is_read_from_the_start(tmp_path):
+    log = tmp_path / "cowrie.json"
+    log.write_text(_lines(1, 2))
+    seen = []
+    tailer = _tailer(tmp_path, seen)
+    tailer.poll(str(log))
+    ino = os.stat(log).st_ino
+    # same inode, different and longer content: what a recycled inode looks like
+    with open(log, "r+") as fh:
+        fh.write(_lines(7, 8, 9, 10))
+    assert os.stat(log).st_ino == ino
+    seen.clear()
+    assert _tailer(tmp_path, seen).poll(str(log)) == 4
+    assert seen == [7, 8, 9, 10]
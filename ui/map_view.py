@@ -0,0 +1,135 @@
+# ui/map_view.py
+# Map data loaders and drawing shared by the dashboard (streamlit_app.py) and the
+# standalone Attack Map page (attack_map.py), including the live map fragment. Cached
+# Streamlit resources live here, so both pages share one Mongo client, one live feed and
+# one set of cached queries per server process.
+import os
+import sys
+import streamlit as st
+import pandas as pd
+import pydeck as pdk
+from pymongo import MongoClient
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.mongo_indexes import bootstrap_indexes
+from common.feature_store import read_any
+from common.geo import lookup_many, placeholder
+from common.map_cells import CELLS_COLLECTION, load_cells, cells_from_frame, for_deck
+from common.live_feed import LiveFeed, LIVE_WINDOW
+
+# what the pages use; the Mongo loader projects the same fields
+VIEW_COLUMNS = ["session_id", "src_ip", "start", "reward", "applied_action"]
+WINDOWS = {"Last hour": 1, "Last 24 hours": 24, "Last 7 days": 24 * 7, "Last 30 days": 24 * 30, "All time": None}
+RECENT_LIMIT = 200
+LIVE_REFRESH = float(os.getenv("LIVE_REFRESH", "1"))   # seconds between live map refreshes
+
+def window_start(hours):
+    return None if hours is None else datetime.now(timezone.utc) - timedelta(hours=hours)
+
+@st.cache_resource
+def get_client(uri):
+    # one pooled client per URI; indexes are ensured once, not on every rerun
+    client = MongoClient(uri)
+    bootstrap_indexes(uri, dbs=["honeypot"])
+    return client
+
+@st.cache_data(ttl=10)
+def load_features(source="features_agg"):
+    # only the columns the pages draw are read from the store
+    return read_any(source, columns=VIEW_COLUMNS)
+
+@st.cache_data(ttl=10)
+def load_live_cells(uri, zoom, hours):
+    # pre-aggregated by the forwarder: one row per occupied cell, whatever the session count
+    cells = load_cells(get_client(uri)["honeypot"][CELLS_COLLECTION], zoom, window_start(hours))
+    return pd.DataFrame(cells, columns=["lat", "lon", "count", "avg_reward"])
+
+@st.cache_data(ttl=5)
+def load_recent(uri, hours, limit=RECENT_LIMIT):
+    # newest sessions of the window only, straight off the ts index
+    since = window_start(hours)
+    query = {} if since is None else {"ts": {"$gte": since.timestamp()}}
+    cur = (get_client(uri)["honeypot"].sessions_agg
+           .find(query, {"_id":0, "session_id":1, "src_ip":1, "start":1, "reward":1, "applied_action":1})
+           .sort("ts", -1).limit(limit))
+    return pd.DataFrame(list(cur), columns=VIEW_COLUMNS)
+
+def ensure_geo(df):
+    # geo is stored on sessions_agg at ingest; only rows without it (feature store rows,
+    # older docs) are resolved here, in one batch against the local database and its cache
+    if df is None or df.empty:
+        return pd.DataFrame(columns=VIEW_COLUMNS + ["lat", "lon"])
+    df = df.copy()
+    if "lat" in df.columns and "lon" in df.columns:
+        return df
+    ips = df["src_ip"].fillna("0.0.0.0").astype(str).tolist()
+    stored = df["geo"].tolist() if "geo" in df.columns else [None] * len(df)
+    found = lookup_many([ip for ip, g in zip(ips, stored) if not isinstance(g, dict)])
+    lats, lons = [], []
+    for ip, g in zip(ips, stored):
+        g = g if isinstance(g, dict) else found.get(ip)
+        lat, lon = (g["lat"], g["lon"]) if g else placeholder(ip)
+        lats.append(lat); lons.append(lon)
+    df["lat"] = lats; df["lon"] = lons
+    return df
+
+@st.cache_data(ttl=10)
+def load_feature_cells(source, zoom):
+    df = load_features(source)
+    if df is None or df.empty:
+        return pd.DataFrame(columns=["lat", "lon", "count", "avg_reward"]), df
+    for c in VIEW_COLUMNS:
+        if c not in df.columns:
+            df[c] = None
+    df = ensure_geo(df)
+    return cells_from_frame(df, zoom), df.sort_values("start", ascending=False).head(RECENT_LIMIT)
+
+def draw_cells(cells, zoom):
+    # one point per cell, area by session count, color by average reward
+    cells = for_deck(cells, zoom)
+    total = int(cells["count"].sum())
+    mid = {"lat": float((cells["lat"] * cells["count"]).sum() / total),
+           "lon": float((cells["lon"] * cells["count"]).sum() / total)}
+    layer = pdk.Layer(
+        "ScatterplotLayer",
+        data=cells,
+        get_position='[lon, lat]',
+        get_fill_color="[255*(1-avg_reward), 60, 255*avg_reward, 160]",
+        get_radius="radius",
+        radius_min_pixels=2,
+        pickable=True,
+    )
+    view_state = pdk.ViewState(latitude=mid["lat"], longitude=mid["lon"], zoom=1.5, pitch=0)
+    r = pdk.Deck(layers=[layer], initial_view_state=view_state,
+                 tooltip={"text":"Sessions: {count}\nAvg reward: {avg_reward}"})
+    st.pydeck_chart(r)
+    return total
+
+@st.cache_resource
+def get_feed(uri):
+    # one follower per server process, shared by every browser session
+    return LiveFeed(get_client(uri)["honeypot"]["sessions_agg"])
+
+@st.fragment(run_every=LIVE_REFRESH)
+def live_attack_map(uri, zoom):
+    # reruns on its own every LIVE_REFRESH seconds; only sessions newer than the last
+    # refresh come back from the feed, the cells are its running counts
+    feed = get_feed(uri)
+    since = st.session_state.get("live_seq", 0)
+    if since > feed.seq:   # the feed restarted
+        since = 0
+        st.session_state["live_recent"] = []
+    state = feed.view(zoom, since_seq=since, limit=RECENT_LIMIT)
+    recent = (state["new"] + st.session_state.get("live_recent", []))[:RECENT_LIMIT]
+    st.session_state["live_seq"] = state["seq"]
+    st.session_state["live_recent"] = recent
+    cells = pd.DataFrame(state["cells"], columns=["lat", "lon", "count", "avg_reward"])
+    if cells.empty:
+        st.info("Waiting for located sessions...")
+    else:
+        draw_cells(cells, zoom)
+    st.caption(f"Live ({state['mode'] or 'starting'}): {state['total']} sessions in the last {LIVE_WINDOW}, "
+               f"{len(state['new'])} new since the previous refresh")
+    st.subheader("Recent attacker sessions")
+    st.dataframe(pd.DataFrame(recent, columns=VIEW_COLUMNS)[["session_id","src_ip","start","applied_action","reward"]])
@@ -1,65 +1,116 @@
 # streamlit_app.py
 import streamlit as st
 import pandas as pd
-import pydeck as pdk
+import numpy as np
 from pymongo import MongoClient
-import os, requests, random, time
+import os, sys, random, time
+from collections import deque
 from datetime import datetime
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.feature_store import read_any
+from common.geo import lookup
+from common.map_cells import ZOOMS, DEFAULT_ZOOM, CELLS_COLLECTION
+from common.map_cells import record as record_cells
+from common.rollups import ROLLUPS_COLLECTION, REWARD_BINS, overview
+from common.rollups import record as record_rollups
+from common.replay import PAGE_SIZE, find_sessions, session_events, iter_events, count_events, event_row
+from common.timestamps import parse_ts, parse_series
+from ui.map_view import (VIEW_COLUMNS, WINDOWS, RECENT_LIMIT, window_start, get_client, load_features,
+                         load_live_cells, load_recent, load_feature_cells, draw_cells, live_attack_map)
+
 st.set_page_config(layout="wide", page_title="AI-Driven Cyber Deception Dashboard")
 
-# ---------- Helpers ----------
-def geoip_lookup_fallback(ip):
-    # lightweight fallback geo lookup (ipapi.co) with try/except
-    try:
-        resp = requests.get(f"https://ipapi.co/{ip}/json/", timeout=2)
-        j = resp.json()
-        if j.get("latitude") and j.get("longitude"):
-            return float(j["latitude"]), float(j["longitude"])
-        if j.get("lat") and j.get("lon"):
-            return float(j["lat"]), float(j["lon"])
-    except Exception:
-        pass
-    return random.uniform(-30, 60), random.uniform(-130, 150)
+# ------------ Data loaders ------------
+@st.cache_data(ttl=10)
+def load_overview(uri, hours):
+    # per-minute / per-hour rollups kept by the forwarder; no session docs are read
+    return overview(get_client(uri)["honeypot"][ROLLUPS_COLLECTION], window_start(hours))
 
-def ensure_geo(df):
+@st.cache_data(ttl=30)
+def feature_overview(source):
+    # same shape as common.rollups.overview(), computed once from a static table
+    df = load_features(source)
     if df is None or df.empty:
-        return pd.DataFrame(columns=["session_id","src_ip","start","reward","applied_action","lat","lon"])
-    df = df.copy()
-    if "lat" in df.columns and "lon" in df.columns:
-        return df
-    lats, lons = [], []
-    for ip in df["src_ip"].fillna("0.0.0.0"):
-        try:
-            lat, lon = geoip_lookup_fallback(ip)
-        except Exception:
-            lat, lon = random.uniform(-30,60), random.uniform(-130,150)
-        lats.append(lat); lons.append(lon)
-    df["lat"] = lats; df["lon"] = lons
-    return df
+        return {"total": 0}
+    df = df.reindex(columns=VIEW_COLUMNS)
+    reward = pd.to_numeric(df["reward"], errors="coerce").fillna(0.0).clip(0.0, 1.0)
+    actions = (pd.DataFrame({"action": df["applied_action"].fillna("none"), "reward": reward})
+               .groupby("action")["reward"].agg(count="size", avg_reward="mean")
+               .sort_values("count", ascending=False).reset_index())
+    bins = np.bincount(np.minimum((reward.to_numpy() * REWARD_BINS).astype(int), REWARD_BINS - 1), minlength=REWARD_BINS)
+    hours = pd.to_datetime(df["start"], errors="coerce", utc=True).dt.floor("h")
+    series = (pd.DataFrame({"bucket": hours, "reward": reward}).dropna()
+              .groupby("bucket")["reward"].agg(count="size", avg_reward="mean").reset_index())
+    return {
+        "total": len(df),
+        "avg_reward": float(reward.mean()),
+        "actions": actions.to_dict("records"),
+        "reward_bins": [{"reward": f"{i / REWARD_BINS:.1f}-{(i + 1) / REWARD_BINS:.1f}", "count": int(c)}
+                        for i, c in enumerate(bins)],
+        "series": series.to_dict("records"),
+    }
 
-# ------------ Data loaders ------------
-@st.cache_data(ttl=10)
-def load_from_csv(path="notebooks/features_agg.csv"):
-    if not os.path.exists(path):
-        return pd.DataFrame()
-    df = pd.read_csv(path)
-    return df
-
-@st.cache_data(ttl=5)
-def load_from_mongo(uri="mongodb://localhost:27017"):
-    client = MongoClient(uri)
-    db = client.get_database("honeypot")
-    cur = db.sessions_agg.find({}, {"_id":0, "session_id":1, "src_ip":1, "start":1, "reward":1, "applied_action":1, "ts":1}).sort("ts", -1)
-    df = pd.DataFrame(list(cur))
-    return df
+# ------------ Session Replay ------------
+PLAYBACK_ROWS = 30   # events visible while playing
+PLAYBACK_MAX_GAP = 2.0   # seconds; longer pauses in a session are shortened to this
+PLAYBACK_REDRAW = 0.1   # seconds between table redraws when events arrive faster
+
+def session_page(search, after):
+    # one page of the search: (rows, cursor of the next page or None)
+    source, ip, action, window, limit = search
+    since = window_start(WINDOWS[window])
+    if source == "Feature store (static)":
+        df = load_features(FEATURE_SOURCE)
+        if ip:
+            df = df[df["src_ip"] == ip]
+        if action:
+            df = df[df["applied_action"] == action]
+        if since is not None:
+            df = df[parse_series(df["start"]) >= since]
+        offset = after or 0
+        rows = df.iloc[offset:offset + limit].to_dict(orient="records")
+        return rows, (offset + limit if offset + limit < len(df) else None)
+    coll = get_client(MONGO_URI)["honeypot"]["sessions_agg"]
+    return find_sessions(coll, ip or None, action or None, since, after=after, limit=limit)
+
+def play_session(raw, sid, speed):
+    # streams the session chunk by chunk, sleeping the (scaled, capped) real gaps
+    screen = st.empty()
+    progress = st.progress(0.0)
+    total = max(count_events(raw, sid), 1)
+    shown = deque(maxlen=PLAYBACK_ROWS)
+    prev = None
+    drawn = 0.0
+    played = 0
+    for chunk in iter_events(raw, sid):
+        for e in chunk:
+            t = parse_ts(e.get("timestamp"))
+            if prev is not None and t is not None:
+                try:
+                    gap = (t - prev).total_seconds() / speed
+                except TypeError:   # naive and aware timestamps mixed
+                    gap = 0.0
+                if gap > 0:
+                    time.sleep(min(gap, PLAYBACK_MAX_GAP))
+            prev = t or prev
+            shown.append(event_row(e))
+            played += 1
+            if time.time() - drawn >= PLAYBACK_REDRAW:
+                screen.dataframe(pd.DataFrame(list(shown)), use_container_width=True)
+                progress.progress(min(played / total, 1.0), text=f"{played} / {total} events")
+                drawn = time.time()
+    screen.dataframe(pd.DataFrame(list(shown)), use_container_width=True)
+    progress.progress(1.0, text=f"{played} / {total} events")
 
 # ------------ Demo injector ------------
-def inject_demo_from_csv(mongo_uri="mongodb://localhost:27017", csv_path="notebooks/features_agg.csv", delay=0.05, count=100):
+def inject_demo_from_features(mongo_uri="mongodb://localhost:27017", source="features_agg", delay=0.05, count=100):
     client = MongoClient(mongo_uri)
     agg = client["honeypot"]["sessions_agg"]
-    if os.path.exists(csv_path):
-        df = pd.read_csv(csv_path)
+    cells = client["honeypot"][CELLS_COLLECTION]
+    rollups = client["honeypot"][ROLLUPS_COLLECTION]
+    df = read_any(source, columns=VIEW_COLUMNS)
+    if not df.empty:
         sample = df.sample(min(len(df), count))
         for _, r in sample.iterrows():
             doc = {
@@ -70,7 +121,10 @@ def inject_demo_from_csv(mongo_uri="mongodb://localhost:27017", csv_path="notebo
                 "applied_action": r.get("applied_action") or "default",
                 "ts": time.time()
             }
+            doc["geo"] = lookup(doc["src_ip"])
             agg.insert_one(doc)
+            record_cells(cells, doc)
+            record_rollups(rollups, doc)
             time.sleep(delay)
     else:
         for i in range(count):
@@ -82,7 +136,10 @@ def inject_demo_from_csv(mongo_uri="mongodb://localhost:27017", csv_path="notebo
                 "applied_action": random.choice(["banner:generic","banner:hard","fakefs","default"]),
                 "ts": time.time()
             }
+            doc["geo"] = lookup(doc["src_ip"])
             agg.insert_one(doc)
+            record_cells(cells, doc)
+            record_rollups(rollups, doc)
             time.sleep(delay)
 
 # ---------------- UI pages ----------------
@@ -90,100 +147,122 @@ st.sidebar.title("Navigation")
 page = st.sidebar.radio("Go to", ["Overview", "Attack Map", "Session Replay", "Demo Controls"])
 
 # Global config
-DATA_SOURCE = st.sidebar.selectbox("Data source", ["MongoDB (live)", "CSV (static)"])
+DATA_SOURCE = st.sidebar.selectbox("Data source", ["MongoDB (live)", "Feature store (static)"])
 MONGO_URI = st.sidebar.text_input("Mongo URI", value=os.getenv("MONGO_URI","mongodb://localhost:27017"))
-CSV_PATH = st.sidebar.text_input("CSV path", value="notebooks/features_agg.csv")
+FEATURE_SOURCE = st.sidebar.text_input("Feature table or CSV path", value="features_agg")
 REFRESH = st.sidebar.button("Refresh data")
 
 # -------- Overview page --------
 if page == "Overview":
     st.title("Overview — AI-Driven Cyber Deception")
-    # load df
-    if DATA_SOURCE == "CSV (static)":
-        df = load_from_csv(CSV_PATH)
+    window = st.sidebar.selectbox("Time window", list(WINDOWS), index=1)
+    if DATA_SOURCE == "Feature store (static)":
+        summary = feature_overview(FEATURE_SOURCE)
+        recent = load_features(FEATURE_SOURCE).head(RECENT_LIMIT)
     else:
-        df = load_from_mongo(MONGO_URI)
-    if df is None or df.empty:
+        summary = load_overview(MONGO_URI, WINDOWS[window])
+        recent = load_recent(MONGO_URI, WINDOWS[window])
+    if not summary["total"]:
         st.warning("No data found. Use Demo Controls to inject demo sessions, or switch data source.")
     else:
-        total = len(df)
-        avg_reward = float(df["reward"].mean()) if "reward" in df.columns and len(df)>0 else 0.0
         col1, col2 = st.columns(2)
-        col1.metric("Total Sessions", total)
-        col2.metric("Avg Reward", f"{avg_reward:.3f}")
+        col1.metric("Total Sessions", summary["total"])
+        col2.metric("Avg Reward", f"{summary['avg_reward']:.3f}")
         st.subheader("Top actions")
-        if "applied_action" in df.columns:
-            st.table(df["applied_action"].value_counts().rename_axis("action").reset_index(name="count").head(10))
+        st.table(pd.DataFrame(summary["actions"]).head(10))
+        col1, col2 = st.columns(2)
+        with col1:
+            st.subheader("Sessions over time")
+            if summary["series"]:
+                st.line_chart(pd.DataFrame(summary["series"]).set_index("bucket")["count"])
+        with col2:
+            st.subheader("Reward distribution")
+            st.bar_chart(pd.DataFrame(summary["reward_bins"]).set_index("reward")["count"])
         st.subheader("Recent sessions sample")
-        show = df.head(200) if isinstance(df, pd.DataFrame) else pd.DataFrame()
-        st.dataframe(show)
+        st.dataframe(recent)
 
 # -------- Attack Map page --------
 elif page == "Attack Map":
     st.title("Attack Map — Live Attacker Locations")
-    if DATA_SOURCE == "CSV (static)":
-        df = load_from_csv(CSV_PATH)
+    live = DATA_SOURCE == "MongoDB (live)" and st.sidebar.toggle("Live updates", value=False)
+    window = None if live else st.sidebar.selectbox("Time window", list(WINDOWS), index=1)
+    zoom = st.sidebar.select_slider("Grid", options=sorted(ZOOMS), value=DEFAULT_ZOOM,
+                                    format_func=lambda z: f"{ZOOMS[z]:g}° cells")
+    if live:
+        live_attack_map(MONGO_URI, zoom)
+        st.stop()
+    if DATA_SOURCE == "Feature store (static)":
+        cells, recent = load_feature_cells(FEATURE_SOURCE, zoom)
     else:
-        df = load_from_mongo(MONGO_URI)
-    if df is None or df.empty:
-        st.warning("No data found. Use Demo Controls to inject sessions.")
+        cells = load_live_cells(MONGO_URI, zoom, WINDOWS[window])
+        recent = load_recent(MONGO_URI, WINDOWS[window])
+    if cells.empty:
+        st.warning("No located sessions found. Use Demo Controls to inject sessions.")
         st.stop()
-    # normalize columns and ensure geo
-    for c in ["session_id","src_ip","start","reward","applied_action"]:
-        if c not in df.columns:
-            df[c] = None
-    df = ensure_geo(df)
-    df["reward"] = pd.to_numeric(df["reward"].fillna(0.0))
-    df["size"] = (df["reward"] * 50) + 5
-    mid = {"lat": df["lat"].mean() if not df["lat"].isna().all() else 20,
-           "lon": df["lon"].mean() if not df["lon"].isna().all() else 0}
-    layer = pdk.Layer(
-        "ScatterplotLayer",
-        data=df,
-        get_position='[lon, lat]',
-        get_fill_color="[255*(1-reward), 60, 255*reward, 160]",
-        get_radius="size",
-        pickable=True,
-    )
-    view_state = pdk.ViewState(latitude=mid["lat"], longitude=mid["lon"], zoom=1.5, pitch=0)
-    r = pdk.Deck(layers=[layer], initial_view_state=view_state,
-                 tooltip={"text":"Session: {session_id}\nIP: {src_ip}\nAction: {applied_action}\nReward: {reward}"})
-    st.pydeck_chart(r)
+    total = draw_cells(cells, zoom)
+    st.caption(f"{total} sessions in {len(cells)} cells of {ZOOMS[zoom]:g}°")
     st.subheader("Recent attacker sessions")
-    st.dataframe(df[["session_id","src_ip","start","applied_action","reward"]].sort_values("start",ascending=False).head(200))
+    st.dataframe(recent[["session_id","src_ip","start","applied_action","reward"]])
 
-# -------- Session Replay page (simple) --------
+# -------- Session Replay page --------
 elif page == "Session Replay":
-    st.title("Session Replay (simple)")
-    # fetch sessions (from agg or csv)
-    if DATA_SOURCE == "CSV (static)":
-        df = load_from_csv(CSV_PATH)
-    else:
-        df = load_from_mongo(MONGO_URI)
-    if df is None or df.empty:
-        st.warning("No data for replay. Inject demo data first.")
+    st.title("Session Replay")
+    with st.sidebar.form("replay_search"):
+        ip = st.text_input("Source IP")
+        action = st.text_input("Applied action")
+        window = st.selectbox("Time window", list(WINDOWS), index=1)
+        page_size = st.number_input("Sessions per page", min_value=10, max_value=500, value=PAGE_SIZE, step=10)
+        st.form_submit_button("Search")
+    search = (DATA_SOURCE, ip.strip(), action.strip(), window, int(page_size))
+    if st.session_state.get("replay_search") != search:
+        # new search or source: back to the first page (cursors of one don't fit the other)
+        st.session_state["replay_search"] = search
+        st.session_state["replay_pages"] = [None]
+    pages = st.session_state["replay_pages"]   # cursor each page was read from
+    rows, cursor = session_page(search, pages[-1])
+    if not rows:
+        st.warning("No sessions match. Inject demo data first, or widen the search.")
         st.stop()
-    sid = st.selectbox("Choose session", df["session_id"].head(200).tolist())
-    st.write("Selected:", sid)
-    # try to fetch raw events from Mongo sessions collection if available
+    sessions = pd.DataFrame(rows).drop(columns=["_id"], errors="ignore")
+    st.dataframe(sessions, use_container_width=True)
+    col1, col2, col3 = st.columns([1, 1, 4])
+    if col1.button("← Newer", disabled=len(pages) == 1):
+        pages.pop()
+        st.rerun()
+    if col2.button("Older →", disabled=cursor is None):
+        pages.append(cursor)
+        st.rerun()
+    col3.caption(f"Page {len(pages)}")
+
+    sid = st.selectbox("Choose session", sessions["session_id"].tolist())
+    raw = get_client(MONGO_URI)["honeypot"]["sessions"]
     try:
-        client = MongoClient(MONGO_URI)
-        raw = client["honeypot"]["sessions"]
-        events = list(raw.find({"session": {"$regex": sid[:8]}}).limit(500))
+        n_events = count_events(raw, sid)
     except Exception:
-        events = []
-    if not events:
+        n_events = 0
+    if not n_events:
         st.info("No raw events found; showing aggregated info")
-        agg_row = df[df["session_id"]==sid].to_dict(orient="records")[0]
-        st.json(agg_row)
+        st.json(sessions[sessions["session_id"] == sid].iloc[0].to_dict())
+        st.stop()
+
+    mode = st.radio("Mode", ["Browse", "Playback"], horizontal=True)
+    if mode == "Browse":
+        # events are read a chunk at a time from the last one shown; st.dataframe only
+        # renders the visible rows, so long sessions stay responsive
+        loaded = st.session_state.get("replay_events")
+        if not loaded or loaded["sid"] != sid:
+            loaded = st.session_state["replay_events"] = {"sid": sid, "rows": [], "cursor": None, "done": False}
+        if not loaded["rows"] or (not loaded["done"] and st.button("Load more events")):
+            events, loaded["cursor"] = session_events(raw, sid, loaded["cursor"])
+            loaded["rows"].extend(event_row(e) for e in events)
+            loaded["done"] = loaded["cursor"] is None
+        st.subheader(f"Events (chronological) — {len(loaded['rows'])} of {n_events}")
+        st.dataframe(pd.DataFrame(loaded["rows"]), use_container_width=True, height=500)
     else:
-        st.subheader("Events (chronological)")
-        # show timestamp + event + command
-        table = []
-        for e in events:
-            t = e.get("timestamp") or e.get("_ts_parsed") or ""
-            table.append({"ts": str(t), "event": e.get("eventid") or e.get("event"), "input": e.get("input") or e.get("command") or e.get("message")})
-        st.table(pd.DataFrame(table))
+        speed = st.select_slider("Speed", options=[1, 2, 5, 10, 50, 100], value=10, format_func=lambda x: f"{x}x")
+        st.caption(f"{n_events} events; gaps over {PLAYBACK_MAX_GAP:g}s are shortened. Stop the app or change any control to halt.")
+        if st.button("Play"):
+            play_session(raw, sid, speed)
 
 # -------- Demo Controls --------
 elif page == "Demo Controls":
@@ -197,6 +276,6 @@ elif page == "Demo Controls":
         run = st.button("Inject demo sessions")
     if run:
         with st.spinner("Injecting..."):
-            inject_demo_from_csv(MONGO_URI, CSV_PATH, delay=delay, count=count)
+            inject_demo_from_features(MONGO_URI, FEATURE_SOURCE, delay=delay, count=count)
         st.success("Done injecting demo sessions")
 